@@ -7,13 +7,44 @@ Returns: HTTP response with products list or purchase creation result
 
 import json
 import os
-from typing import Dict, Any, List
+import random
+from typing import Dict, Any, List, Optional, Callable, Tuple, Union
 import urllib.request
 import urllib.parse
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+# Строки моложе этого возраста курсор since_id не проходит (дольше длится транзакция записи - нужен больший запас)
+CURSOR_SETTLE_SECONDS = int(os.environ.get('CURSOR_SETTLE_SECONDS', '60'))
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -54,30 +85,101 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             deal_id = query_params.get('deal_id', '').strip()
             action = query_params.get('action', '')
             
+            since_id = query_params.get('since_id', '')
+            since_ts = query_params.get('since_ts', '')
+            
+            # since_ts - закупки, созданные или изменённые после курсора
             if action == 'list_purchases':
-                cur.execute("""
-                    SELECT * FROM purchases 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                """)
-                purchases = cur.fetchall()
+                if since_ts:
+                    # По возрастанию (updated_at, id): при переполнении страницы следующий опрос продолжит с курсора
+                    cur.execute("""
+                        SELECT *, updated_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchases 
+                        WHERE (updated_at, id) > (%s::timestamp, %s)
+                        ORDER BY updated_at ASC, id ASC 
+                        LIMIT 100
+                    """, (CURSOR_SETTLE_SECONDS, *parse_since_ts(since_ts)))
+                else:
+                    cur.execute("""
+                        SELECT *, updated_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchases 
+                        ORDER BY created_at DESC 
+                        LIMIT 100
+                    """, (CURSOR_SETTLE_SECONDS,))
+                purchases = [dict(p) for p in cur.fetchall()]
+                next_ts = next_since_ts(purchases, 'updated_at', since_ts)
+                if since_ts:
+                    purchases.reverse()
+                for p in purchases:
+                    p.pop('settled', None)
                 
                 return response_json(200, {
                     'success': True,
-                    'purchases': [dict(p) for p in purchases]
+                    'purchases': purchases,
+                    'incremental': bool(since_ts),
+                    'has_more': bool(since_ts) and len(purchases) == 100,
+                    'cursor': {
+                        'since_ts': next_ts
+                    }
                 })
             
+            # since_id - только новые вебхуки (журнал только дописывается)
             if action == 'list_webhooks':
-                cur.execute("""
-                    SELECT * FROM purchase_webhooks 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                """)
-                webhooks = cur.fetchall()
+                if since_id.isdigit():
+                    # По возрастанию id: при переполнении страницы следующий опрос продолжит с курсора
+                    cur.execute("""
+                        SELECT *, created_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchase_webhooks 
+                        WHERE id > %s
+                        ORDER BY id ASC 
+                        LIMIT 100
+                    """, (CURSOR_SETTLE_SECONDS, int(since_id)))
+                else:
+                    cur.execute("""
+                        SELECT *, created_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchase_webhooks 
+                        ORDER BY created_at DESC 
+                        LIMIT 100
+                    """, (CURSOR_SETTLE_SECONDS,))
+                webhooks = [dict(w) for w in cur.fetchall()]
+                next_id = next_since_id(webhooks, since_id)
+                if since_id.isdigit():
+                    webhooks.reverse()
+                for w in webhooks:
+                    w.pop('settled', None)
                 
                 return response_json(200, {
                     'success': True,
-                    'webhooks': [dict(w) for w in webhooks]
+                    'webhooks': webhooks,
+                    'incremental': since_id.isdigit(),
+                    'has_more': since_id.isdigit() and len(webhooks) == 100,
+                    'cursor': {
+                        'since_id': next_id
+                    }
+                })
+            
+            # Поиск по журналу вебхуков закупок: сделка, компания, событие, вхождение JSON
+            if action == 'search_webhooks':
+                contains = query_params.get('contains', '').strip()
+                if contains:
+                    try:
+                        if not isinstance(json.loads(contains), (dict, list)):
+                            raise ValueError('contains must be a JSON object or array')
+                    except ValueError as e:
+                        return response_json(400, {'success': False, 'error': f'Некорректный contains: {e}'})
+                
+                webhooks = search_purchase_webhooks(
+                    cur,
+                    deal_id=deal_id,
+                    company_id=query_params.get('company_id', '').strip(),
+                    event_name=query_params.get('event', '').strip(),
+                    contains=contains,
+                    limit=min(int(query_params.get('limit', '100')), 500)
+                )
+                return response_json(200, {
+                    'success': True,
+                    'webhooks': [dict(w) for w in webhooks],
+                    'total': len(webhooks)
                 })
             
             if action == 'stats':
@@ -159,13 +261,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 deal_id = body_data.get('deal_id', '').strip()
                 products = body_data.get('products', [])
                 
-                import sys
-                print(f"DEBUG POST: deal_id={deal_id}, products count={len(products)}", file=sys.stderr)
+                log('DEBUG', 'flow', f"create_purchase: deal_id={deal_id}, products count={len(products)}")
                 if products:
-                    print(f"DEBUG: First product: {products[0]}", file=sys.stderr)
+                    log('DEBUG', 'payload', lambda: f"First product: {products[0]}")
                 else:
-                    print(f"DEBUG: body_data keys: {list(body_data.keys())}", file=sys.stderr)
-                    print(f"DEBUG: full body_data: {body_data}", file=sys.stderr)
+                    log('DEBUG', 'payload', lambda: f"body_data keys: {list(body_data.keys())}")
+                    log('DEBUG', 'payload', lambda: f"full body_data: {body_data}")
                 
                 if not deal_id:
                     return response_json(400, {
@@ -347,7 +448,7 @@ def create_purchase_in_bitrix(webhook_url: str, entity_type_id: str, deal_id: st
         # Добавляем товары через crm.item.productrow.set
         products_added = False
         try:
-            print(f"DEBUG: Товаров для добавления: {len(products)}")
+            log('DEBUG', 'flow', f"Товаров для добавления: {len(products)}")
             
             # Формируем массив товарных позиций
             product_rows = []
@@ -373,7 +474,7 @@ def create_purchase_in_bitrix(webhook_url: str, entity_type_id: str, deal_id: st
                 'productRows': product_rows
             }
             
-            print(f"DEBUG: Устанавливаем товарные позиции: {json.dumps(productrow_params, ensure_ascii=False)}")
+            log('DEBUG', 'payload', lambda: f"Устанавливаем товарные позиции: {json.dumps(productrow_params, ensure_ascii=False)}")
             
             productrow_data = json.dumps(productrow_params).encode('utf-8')
             productrow_req = urllib.request.Request(
@@ -384,17 +485,17 @@ def create_purchase_in_bitrix(webhook_url: str, entity_type_id: str, deal_id: st
             
             with urllib.request.urlopen(productrow_req, timeout=10) as productrow_response:
                 productrow_result = json.loads(productrow_response.read().decode('utf-8'))
-                print(f"DEBUG: Результат установки товарных позиций: {json.dumps(productrow_result, ensure_ascii=False)}")
+                log('DEBUG', 'payload', lambda: f"Результат установки товарных позиций: {json.dumps(productrow_result, ensure_ascii=False)}")
                 
                 if 'result' in productrow_result and productrow_result['result'].get('productRows'):
                     products_added = True
-                    print(f"DEBUG: Успешно добавлено {len(productrow_result['result']['productRows'])} товарных позиций")
+                    log('DEBUG', 'flow', f"Успешно добавлено {len(productrow_result['result']['productRows'])} товарных позиций")
                     
         except urllib.error.HTTPError as e:
             error_body = e.read().decode('utf-8') if e.fp else ''
-            print(f"ERROR: Ошибка добавления товаров HTTP {e.code}: {error_body}")
+            log('ERROR', 'bitrix', f"Ошибка добавления товаров HTTP {e.code}: {error_body}")
         except Exception as e:
-            print(f"ERROR: Ошибка добавления товаров: {str(e)}")
+            log('ERROR', 'flow', f"Ошибка добавления товаров: {str(e)}")
         
         # Добавляем товары комментарием в таймлайн (так как productRows не работает для смарт-процессов)
         try:
@@ -418,9 +519,9 @@ def create_purchase_in_bitrix(webhook_url: str, entity_type_id: str, deal_id: st
             
             with urllib.request.urlopen(comment_req, timeout=10) as comment_response:
                 comment_result = json.loads(comment_response.read().decode('utf-8'))
-                print(f"DEBUG: Комментарий добавлен: {comment_result}")
+                log('DEBUG', 'payload', lambda: f"Комментарий добавлен: {comment_result}")
         except Exception as e:
-            print(f"ERROR: Не удалось добавить комментарий: {str(e)}")
+            log('ERROR', 'flow', f"Не удалось добавить комментарий: {str(e)}")
         
         return {'purchase_id': purchase_id}
         
@@ -435,6 +536,30 @@ def create_purchase_in_bitrix(webhook_url: str, entity_type_id: str, deal_id: st
     except Exception as e:
         return {'error': f'Ошибка API: {str(e)}'}
 
+def search_purchase_webhooks(cur, deal_id: str = '', company_id: str = '', event_name: str = '', contains: str = '', limit: int = 100) -> List[Dict[str, Any]]:
+    '''
+    Поиск по purchase_webhooks через индексы: deal_id/company_id/request_event (B-tree)
+    и вхождение JSON в request_body (GIN jsonb_path_ops)
+    '''
+    conditions = []
+    params: List[Any] = []
+    if deal_id:
+        conditions.append("deal_id = %s")
+        params.append(deal_id)
+    if company_id:
+        conditions.append("company_id = %s")
+        params.append(company_id)
+    if event_name:
+        conditions.append("request_event = %s")
+        params.append(event_name)
+    if contains:
+        conditions.append("request_body @> %s::jsonb")
+        params.append(contains)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cur.execute(f"SELECT * FROM purchase_webhooks {where_sql} ORDER BY created_at DESC LIMIT %s", params + [limit])
+    return cur.fetchall()
+
 def calculate_monthly_stats(cur) -> Dict[str, Any]:
     """Calculate purchase statistics for current and previous month"""
     
@@ -485,6 +610,35 @@ def calculate_monthly_stats(cur) -> Dict[str, Any]:
         }
     }
 
+def next_since_id(rows: List[Dict[str, Any]], since_id: str) -> int:
+    '''
+    Курсор since_id для следующего опроса. id выдаются до коммита, поэтому строка с меньшим id
+    может стать видимой позже строки с большим: курсор не сдвигается дальше первой строки моложе
+    CURSOR_SETTLE_SECONDS (колонка settled), такие строки придут повторно - клиент сливает их по id
+    '''
+    current = int(since_id) if since_id.isdigit() else 0
+    unsettled = [row['id'] for row in rows if not row['settled']]
+    if unsettled:
+        return max(min(unsettled) - 1, current)
+    return max([row['id'] for row in rows], default=current)
+
+def parse_since_ts(since_ts: str) -> Tuple[str, int]:
+    '''Курсор since_ts "время|id" -> (время, id); старый курсор без id - (время, 0)'''
+    ts, _, row_id = since_ts.partition('|')
+    return ts, int(row_id) if row_id.isdigit() else 0
+
+def next_since_ts(rows: List[Dict[str, Any]], ts_field: str, since_ts: str) -> Optional[str]:
+    '''
+    Курсор since_ts для следующего опроса: старший ключ (время, id) среди строк старше
+    CURSOR_SETTLE_SECONDS. Время ставится в начале транзакции записи, поэтому более свежие строки
+    (и ещё не видимые строки с тем же временем) курсор не проходит - они придут повторно
+    '''
+    settled = [(row[ts_field], row['id']) for row in rows if row['settled'] and isinstance(row.get(ts_field), datetime)]
+    if not settled:
+        return since_ts or None
+    ts, row_id = max(settled)
+    return f"{ts.isoformat()}|{row_id}"
+
 def response_json(status_code: int, data: Dict[str, Any]) -> Dict[str, Any]:
     return {
         'statusCode': status_code,
@@ -5,10 +5,38 @@ Returns: Список логов БП со статусами, ошибками,
 '''
 import json
 import os
-from typing import Dict, Any, List, Optional
+import random
+from typing import Dict, Any, List, Optional, Callable, Union
 from datetime import datetime
 import requests
 
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     path: str = event.get('path', '')
@@ -38,20 +66,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if params.get('id'):
         bp_id = params.get('id')
         
-        print(f"[DEBUG] Запрос деталей для ID: {bp_id}")
+        log('DEBUG', 'bitrix', f"Запрос деталей для ID: {bp_id}")
         
         try:
             if bp_id.startswith('template_'):
-                print(f"[DEBUG] Это шаблон, загружаем статистику")
+                log('DEBUG', 'flow', "Это шаблон, загружаем статистику")
                 template_id = bp_id.replace('template_', '')
                 detail = get_template_stats(template_id)
-                print(f"[DEBUG] Получены данные шаблона, ключи: {list(detail.keys())}")
+                log('DEBUG', 'flow', lambda: f"Получены данные шаблона, ключи: {list(detail.keys())}")
             else:
-                print(f"[DEBUG] Это экземпляр БП, загружаем детали")
+                log('DEBUG', 'flow', "Это экземпляр БП, загружаем детали")
                 detail = get_bp_detail(bp_id)
             
             body_str = json.dumps(detail, ensure_ascii=False)
-            print(f"[DEBUG] Отправляем ответ, длина body: {len(body_str)} символов")
+            log('DEBUG', 'payload', lambda: f"Отправляем ответ, длина body: {len(body_str)} символов")
             
             return {
                 'statusCode': 200,
@@ -59,9 +87,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': body_str
             }
         except Exception as e:
-            print(f"[ERROR] Ошибка получения деталей: {e}")
+            log('ERROR', 'flow', f"Ошибка получения деталей: {e}")
             import traceback
-            traceback.print_exc()
+            log('ERROR', 'flow', traceback.format_exc)
             return {
                 'statusCode': 500,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -99,8 +127,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"[ERROR] Ошибка получения логов: {e}")
-        print(f"[ERROR] Traceback:\n{error_details}")
+        log('ERROR', 'flow', f"Ошибка получения логов: {e}")
+        log('ERROR', 'flow', f"Traceback:\n{error_details}")
         return {
             'statusCode': 500,
             'headers': {
@@ -120,7 +148,7 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
         raise ValueError('BITRIX24_BP_WEBHOOK_URL не настроен')
     
     webhook_url = webhook_url.rstrip('/')
-    print(f"[DEBUG] Используем webhook: {webhook_url[:50]}...")
+    log('DEBUG', 'bitrix', f"Используем webhook: {webhook_url[:50]}...")
     
     # Получаем список шаблонов БП с полной информацией
     templates_response = requests.post(
@@ -133,7 +161,7 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
     templates_response.raise_for_status()
     templates_data = templates_response.json()
     
-    print(f"[DEBUG] Получено шаблонов: {len(templates_data.get('result', []))}")
+    log('DEBUG', 'flow', f"Получено шаблонов: {len(templates_data.get('result', []))}")
     
     if 'result' not in templates_data:
         raise ValueError(f'Ошибка API получения шаблонов: {templates_data.get("error_description", "Неизвестная ошибка")}')
@@ -143,8 +171,8 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
     # Выводим первый шаблон для отладки
     if templates:
         first_template = list(templates.values())[0]
-        print(f"[DEBUG] Пример шаблона: {first_template}")
-        print(f"[DEBUG] Ключи шаблона: {list(first_template.keys())}")
+        log('DEBUG', 'payload', lambda: f"Пример шаблона: {first_template}")
+        log('DEBUG', 'flow', lambda: f"Ключи шаблона: {list(first_template.keys())}")
     
     logs = []
     
@@ -159,11 +187,11 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
         timeout=30
     )
     
-    print(f"[DEBUG] Статус instances: {instances_response.status_code}")
-    print(f"[DEBUG] URL запроса: {webhook_url}/bizproc.workflow.instances")
+    log('DEBUG', 'bitrix', f"Статус instances: {instances_response.status_code}")
+    log('DEBUG', 'bitrix', lambda: f"URL запроса: {webhook_url}/bizproc.workflow.instances")
     
     if instances_response.status_code != 200:
-        print(f"[DEBUG] Ошибка запроса instances: {instances_response.status_code}")
+        log('WARN', 'bitrix', f"Ошибка запроса instances: {instances_response.status_code}")
         # Если метод не работает, возвращаем информацию о шаблонах
         for template_id, template in list(templates.items())[:limit]:
             if search and search.lower() not in template.get('NAME', '').lower():
@@ -183,23 +211,23 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
     
     instances_data = instances_response.json()
     
-    print(f"[DEBUG] Полный ответ API instances: {instances_data}")
+    log('DEBUG', 'payload', lambda: f"Полный ответ API instances: {instances_data}")
     
     if 'error' in instances_data:
-        print(f"[DEBUG] Ошибка API: {instances_data.get('error_description', 'Неизвестная ошибка')}")
+        log('WARN', 'bitrix', lambda: f"Ошибка API: {instances_data.get('error_description', 'Неизвестная ошибка')}")
     
     instances = instances_data.get('result', [])
     
-    print(f"[DEBUG] Получено экземпляров БП: {len(instances)}")
+    log('DEBUG', 'flow', f"Получено экземпляров БП: {len(instances)}")
     if instances:
-        print(f"[DEBUG] Первый instance: {instances[0]}")
+        log('DEBUG', 'payload', lambda: f"Первый instance: {instances[0]}")
     else:
-        print(f"[DEBUG] Instances пуст!")
+        log('DEBUG', 'flow', "Instances пуст!")
     
     # Если нет экземпляров или запрошены все БП (show_all=True), показываем шаблоны
     if not instances or show_all:
-        print(f"[DEBUG] Экземпляров нет или show_all=True, добавляем шаблоны")
-        print(f"[DEBUG] Ключи templates: {list(templates.keys())}")
+        log('DEBUG', 'flow', "Экземпляров нет или show_all=True, добавляем шаблоны")
+        log('DEBUG', 'flow', lambda: f"Ключи templates: {list(templates.keys())}")
         for template_id, template in list(templates.items())[:limit]:
             if search and search.lower() not in template.get('NAME', '').lower():
                 continue
@@ -251,7 +279,7 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
                                     if 'Error' in activity_data:
                                         errors.append(f"Активность {activity_id}: {activity_data['Error']}")
             except Exception as e:
-                print(f"[DEBUG] Ошибка получения деталей БП {instance['ID']}: {e}")
+                log('WARN', 'flow', f"Ошибка получения деталей БП {instance['ID']}: {e}")
             
             # Определяем статус из WORKFLOW_STATUS
             workflow_status_code = instance.get('WORKFLOW_STATUS', {})
@@ -298,7 +326,7 @@ def get_logs_from_api(limit: int, offset: int, status_filter: Optional[str], sea
                 break
                 
         except Exception as e:
-            print(f"Ошибка обработки экземпляра {instance.get('ID')}: {e}")
+            log('ERROR', 'flow', f"Ошибка обработки экземпляра {instance.get('ID')}: {e}")
             continue
     
     return logs[offset:offset + limit]
@@ -357,7 +385,7 @@ def get_bp_detail(bp_id: str) -> Dict[str, Any]:
             history_data = history_response.json()
             history_items = history_data.get('result', [])
             
-            print(f"[DEBUG] История БП {bp_id}: получено {len(history_items)} записей")
+            log('DEBUG', 'flow', f"История БП {bp_id}: получено {len(history_items)} записей")
             
             for item in history_items:
                 history.append({
@@ -372,7 +400,7 @@ def get_bp_detail(bp_id: str) -> Dict[str, Any]:
                     'action_name': item.get('ACTION_NAME', '')
                 })
     except Exception as e:
-        print(f"[DEBUG] Ошибка получения истории: {e}")
+        log('WARN', 'flow', f"Ошибка получения истории: {e}")
     
     return {
         'id': bp_id,
@@ -403,7 +431,7 @@ def get_template_stats(template_id: str) -> Dict[str, Any]:
         raise ValueError('BITRIX24_BP_WEBHOOK_URL не настроен')
     
     webhook_url = webhook_url.rstrip('/')
-    print(f"[DEBUG] get_template_stats использует webhook: {webhook_url[:50]}...")
+    log('DEBUG', 'bitrix', f"get_template_stats использует webhook: {webhook_url[:50]}...")
     
     template_response = requests.post(
         f'{webhook_url}/bizproc.workflow.template.list',
@@ -417,14 +445,14 @@ def get_template_stats(template_id: str) -> Dict[str, Any]:
     templates_list = template_data.get('result', [])
     templates = {t['ID']: t for t in templates_list} if isinstance(templates_list, list) else templates_list
     
-    print(f"[DEBUG] Загружено шаблонов: {len(templates)}")
-    print(f"[DEBUG] Ищем template_id='{template_id}' в ключах: {list(templates.keys())}")
+    log('DEBUG', 'flow', f"Загружено шаблонов: {len(templates)}")
+    log('DEBUG', 'flow', lambda: f"Ищем template_id='{template_id}' в ключах: {list(templates.keys())}")
     template_info = templates.get(str(template_id), {})
     if template_info:
-        print(f"[DEBUG] Шаблон найден! Ключи: {list(template_info.keys())}")
-        print(f"[DEBUG] Содержимое шаблона: {template_info}")
+        log('DEBUG', 'flow', lambda: f"Шаблон найден! Ключи: {list(template_info.keys())}")
+        log('DEBUG', 'payload', lambda: f"Содержимое шаблона: {template_info}")
     else:
-        print(f"[DEBUG] Шаблон НЕ найден в словаре")
+        log('DEBUG', 'flow', "Шаблон НЕ найден в словаре")
     
     # Используем bizproc.workflow.instances для получения ВСЕХ экземпляров (включая завершённые)
     instances_response = requests.post(
@@ -436,16 +464,16 @@ def get_template_stats(template_id: str) -> Dict[str, Any]:
         timeout=30
     )
     
-    print(f"[DEBUG] Статус запроса instances для template_id={template_id}: {instances_response.status_code}")
+    log('DEBUG', 'bitrix', f"Статус запроса instances для template_id={template_id}: {instances_response.status_code}")
     
     instances = []
     if instances_response.status_code == 200:
         instances_data = instances_response.json()
-        print(f"[DEBUG] Ответ API instances: {instances_data}")
+        log('DEBUG', 'payload', lambda: f"Ответ API instances: {instances_data}")
         instances = instances_data.get('result', [])
-        print(f"[DEBUG] Получено экземпляров для шаблона {template_id}: {len(instances)}")
+        log('DEBUG', 'flow', f"Получено экземпляров для шаблона {template_id}: {len(instances)}")
     else:
-        print(f"[DEBUG] Ошибка запроса: {instances_response.status_code}, текст: {instances_response.text[:200]}")
+        log('WARN', 'bitrix', lambda: f"Ошибка запроса: {instances_response.status_code}, текст: {instances_response.text[:200]}")
     
     runs_by_user = {}
     runs_by_date = {}
@@ -500,7 +528,7 @@ def get_template_stats(template_id: str) -> Dict[str, Any]:
         }
     }
     
-    print(f"[DEBUG] Возвращаем данные шаблона: id={result['id']}, total_runs={result['stats']['total_runs']}")
+    log('DEBUG', 'flow', f"Возвращаем данные шаблона: id={result['id']}, total_runs={result['stats']['total_runs']}")
     return result
 
 def get_logs_from_db(limit: int, offset: int, status_filter: Optional[str], search: Optional[str], debug: bool = False) -> List[Dict[str, Any]]:
@@ -519,7 +547,7 @@ def get_logs_from_db(limit: int, offset: int, status_filter: Optional[str], sear
         else:
             raise ValueError('BITRIX24_BP_HISTORY_API_URL не настроен')
     
-    print(f"[DEBUG DB] Запрос к PHP API: {php_api_url}")
+    log('DEBUG', 'bitrix', lambda: f"Запрос к PHP API: {php_api_url}")
     
     # Формируем параметры запроса
     params = {
@@ -539,9 +567,9 @@ def get_logs_from_db(limit: int, offset: int, status_filter: Optional[str], sear
     # Выполняем HTTP-запрос к PHP API
     response = requests.get(php_api_url, params=params, timeout=30)
     
-    print(f"[DEBUG DB] Статус ответа PHP API: {response.status_code}")
-    print(f"[DEBUG DB] Content-Type: {response.headers.get('Content-Type', 'unknown')}")
-    print(f"[DEBUG DB] Сырой ответ (первые 1000 символов): {response.text[:1000]}")
+    log('DEBUG', 'bitrix', f"Статус ответа PHP API: {response.status_code}")
+    log('DEBUG', 'flow', lambda: f"Content-Type: {response.headers.get('Content-Type', 'unknown')}")
+    log('DEBUG', 'payload', lambda: f"Сырой ответ (первые 1000 символов): {response.text[:1000]}")
     
     if response.status_code != 200:
         raise ValueError(f"PHP API вернул ошибку: {response.status_code}, текст: {response.text[:500]}")
@@ -550,14 +578,14 @@ def get_logs_from_db(limit: int, offset: int, status_filter: Optional[str], sear
     try:
         data = response.json()
     except Exception as e:
-        print(f"[ERROR] Не удалось распарсить JSON ответ: {e}")
-        print(f"[ERROR] Сырой ответ: {response.text[:500]}")
+        log('ERROR', 'flow', f"Не удалось распарсить JSON ответ: {e}")
+        log('ERROR', 'payload', lambda: f"Сырой ответ: {response.text[:500]}")
         raise ValueError(f"PHP API вернул невалидный JSON: {e}")
     
     if not data.get('success', False):
         raise ValueError(f"PHP API вернул ошибку: {data.get('error', 'Неизвестная ошибка')}")
     
     logs = data.get('logs', [])
-    print(f"[DEBUG DB] Получено логов из PHP API: {len(logs)}")
+    log('DEBUG', 'bitrix', f"Получено логов из PHP API: {len(logs)}")
     
     return logs
\ No newline at end of file
@@ -1,11 +1,116 @@
 import json
 import os
+import random
 import urllib.parse
 import urllib.request
 import base64
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+def parse_form_body(body: str) -> Dict[str, Any]:
+    '''
+    Разбор x-www-form-urlencoded тела Битрикс24 за один проход: PHP-ключи со скобками
+    (auth[domain], data[FIELDS][ID], document_id[], data[FIELDS][UF_LIST][0]) раскладываются
+    во вложенные dict/list. Повтор ключа без скобок перезаписывает значение (как в PHP),
+    числовые индексы по порядку дают list, пропуск индекса превращает list в dict.
+    Тело декодируется одним вызовом unquote_plus (закодированные & и = защищены маркерами;
+    если маркеры уже есть в теле - сырыми или как %00/%01 - разбор попарный),
+    контейнеры запоминаются по префиксу ключа: соседние поля data[FIELDS][...] пишутся без обхода пути
+    '''
+    escaped = '%26' in body or '%3D' in body or '%3d' in body
+    if '\x00' in body or '\x01' in body or '%00' in body or '%01' in body:
+        pairs = [tuple(urllib.parse.unquote_plus(part) for part in pair.partition('=')[::2]) for pair in body.split('&') if pair]
+        escaped = False
+    else:
+        if escaped:
+            body = body.replace('%26', '\x00').replace('%3D', '\x01').replace('%3d', '\x01')
+        pairs = [pair.partition('=')[::2] for pair in urllib.parse.unquote_plus(body).split('&') if pair]
+    
+    result: Dict[str, Any] = {}
+    containers: Dict[str, Dict[str, Any]] = {}
+    for key, value in pairs:
+        if escaped:
+            key = key.replace('\x00', '&').replace('\x01', '=')
+            value = value.replace('\x00', '&').replace('\x01', '=')
+        
+        if not key.endswith(']') or key.find('[') <= 0:
+            if key in result:
+                containers.clear()
+            result[key] = value
+            continue
+        
+        cut = key.rfind('[')
+        prefix, last = key[:cut], key[cut + 1:-1]
+        container = containers.get(prefix)
+        if container is not None and last and not last.isdigit() and not isinstance(container.get(last), (dict, list)):
+            container[last] = value
+            continue
+        
+        bracket = key.find('[')
+        node: Any = result
+        name = key[:bracket]
+        for segment in key[bracket + 1:-1].split(']['):
+            child = form_node_get(node, name)
+            if isinstance(child, list) and segment and not (segment.isdigit() and int(segment) <= len(child)):
+                child = {str(index): item for index, item in enumerate(child)}
+                form_node_set(node, name, child)
+                containers.clear()
+            elif not isinstance(child, (dict, list)):
+                child = [] if not segment or segment == '0' else {}
+                form_node_set(node, name, child)
+            node, name = child, segment
+        if isinstance(form_node_get(node, name), (dict, list)):
+            containers.clear()
+        form_node_set(node, name, value)
+        if isinstance(node, dict) and '[]' not in prefix:
+            containers[prefix] = node
+    
+    return result
+
+def form_node_get(node: Any, name: str) -> Any:
+    '''Элемент контейнера по сегменту ключа; "[]" всегда создаёт новый элемент'''
+    if isinstance(node, list):
+        return node[int(name)] if name and int(name) < len(node) else None
+    return node.get(name)
+
+def form_node_set(node: Any, name: str, value: Any) -> None:
+    '''Запись в контейнер по сегменту ключа: в list - добавление в конец или замена по индексу'''
+    if isinstance(node, list):
+        if not name or int(name) == len(node):
+            node.append(value)
+        else:
+            node[int(name)] = value
+    else:
+        node[name] = value
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -33,10 +138,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     body_str = event.get('body', '')
     
     # Логируем RAW данные для дебага
-    print(f"[DEBUG] Method: {method}")
-    print(f"[DEBUG] Headers: {json.dumps(headers, ensure_ascii=False)[:300]}")
-    print(f"[DEBUG] Body (raw): {body_str[:500]}")
-    print(f"[DEBUG] Query params: {event.get('queryStringParameters', {})}")
+    log('DEBUG', 'flow', f"Method: {method}")
+    log('DEBUG', 'payload', lambda: f"Headers: {json.dumps(headers, ensure_ascii=False)[:300]}")
+    log('DEBUG', 'payload', lambda: f"Body (raw): {body_str[:500]}")
+    log('DEBUG', 'payload', lambda: f"Query params: {event.get('queryStringParameters', {})}")
     
     # Парсим данные от Битрикс24
     body_data = {}
@@ -48,37 +153,49 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if event.get('isBase64Encoded', False):
                 try:
                     body_str = base64.b64decode(body_str).decode('utf-8')
-                    print(f"[DEBUG] Decoded from base64: {body_str[:200]}")
+                    log('DEBUG', 'payload', lambda: f"Decoded from base64: {body_str[:200]}")
                 except Exception as e:
-                    print(f"[ERROR] Failed to decode base64: {e}")
+                    log('ERROR', 'flow', f"Failed to decode base64: {e}")
             
-            parsed = urllib.parse.parse_qs(body_str)
-            body_data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-            
-            # Парсим вложенные структуры auth и data
-            if 'auth[domain]' in body_data:
-                auth = {}
-                data_fields = {}
-                for key, value in list(body_data.items()):
-                    if key.startswith('auth['):
-                        auth_key = key.replace('auth[', '').replace(']', '')
-                        auth[auth_key] = value
-                        del body_data[key]
-                    elif key.startswith('data[FIELDS]['):
-                        field_key = key.replace('data[FIELDS][', '').replace(']', '')
-                        data_fields[field_key] = value
-                        del body_data[key]
-                
-                if auth:
-                    body_data['auth'] = auth
-                if data_fields:
-                    body_data['data'] = {'FIELDS': data_fields}
+            # auth[...], data[FIELDS][...] и массивы - во вложенные dict/list
+            body_data = parse_form_body(body_str)
         else:
             try:
                 body_data = json.loads(body_str)
             except:
                 body_data = {}
     
+    # Пакет событий из очереди event.offline.get (bitrix-event-pull)
+    if body_data.get('action') == 'process_events':
+        return process_event_batch(body_data.get('events', []))
+    
+    # Разбор буфера, оставшегося после сбоя (вызывается по расписанию)
+    if body_data.get('action') == 'flush':
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            flushed = flush_deal_buffer(conn, cur, float(os.environ.get('DEAL_FLUSH_MAX_SECONDS', '25')))
+            # Остаток буфера и возраст старейшего события - для настройки частоты расписания
+            cur.execute("""
+                SELECT COUNT(*) AS pending, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(received_at)) AS oldest_seconds
+                FROM deal_event_buffer
+            """)
+            backlog = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'success': True,
+                'flushed': len(flushed),
+                'pending': backlog['pending'],
+                'oldest_pending_seconds': int(backlog['oldest_seconds'] or 0)
+            }),
+            'isBase64Encoded': False
+        }
+    
     # Извлекаем данные события
     event_type = body_data.get('event', '')
     event_handler_id = body_data.get('event_handler_id', '')
@@ -92,10 +209,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     application_token = auth.get('application_token', '')
     client_endpoint = auth.get('client_endpoint', '')
     
-    print(f"[INFO] Событие: {event_type}, Сделка ID: {deal_id}, Домен: {domain}")
+    log('INFO', 'flow', f"Событие: {event_type}, Сделка ID: {deal_id}, Домен: {domain}")
     
     if not deal_id:
-        print(f"[WARN] Недостаточно данных для обработки события")
+        log('WARN', 'flow', "Недостаточно данных для обработки события")
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -103,122 +220,56 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    # Используем входящий вебхук из секретов для REST API
-    webhook_url = os.environ.get('BITRIX24_WEBHOOK_URL', '')
-    if not webhook_url:
-        print(f"[ERROR] Секрет BITRIX24_WEBHOOK_URL не настроен!")
-        deal_full_data = {'error': 'BITRIX24_WEBHOOK_URL не настроен', 'deal_id': deal_id}
-    else:
-        # Получаем полные данные сделки через REST API
-        rest_url = f"{webhook_url}crm.deal.get.json"
-        params = urllib.parse.urlencode({'ID': deal_id})
-        
-        try:
-            print(f"[INFO] Запрос к REST API: {rest_url}?{params[:100]}...")
-            
-            req = urllib.request.Request(f"{rest_url}?{params}")
-            with urllib.request.urlopen(req, timeout=10) as response:
-                rest_data = json.loads(response.read().decode('utf-8'))
-            
-            if not rest_data.get('result'):
-                print(f"[WARN] REST API не вернул данные сделки: {rest_data}")
-                deal_full_data = {'error': 'Нет данных от REST API', 'raw': rest_data}
-            else:
-                deal_full_data = rest_data['result']
-                print(f"[INFO] Получены данные сделки: {json.dumps(deal_full_data, ensure_ascii=False)[:200]}...")
-            
-        except Exception as e:
-            print(f"[ERROR] Ошибка при запросе к REST API: {e}")
-            deal_full_data = {'error': str(e), 'deal_id': deal_id}
+    event_row = {
+        'deal_id': str(deal_id),
+        'event_type': event_type,
+        'event_handler_id': event_handler_id,
+        'ts': ts,
+        'domain': domain,
+        'member_id': member_id
+    }
+    # Окно накопления пакета - только по явной настройке: ожидание оплачивается и задерживает ответ Битрикс24
+    batch_window_ms = int(os.environ.get('DEAL_BATCH_WINDOW_MS', '0'))
     
-    # Получаем данные пользователя из deal_data или через REST API
-    modifier_id = deal_full_data.get('MODIFY_BY_ID', '')
-    modifier_name = deal_full_data.get('MODIFY_BY_NAME', '')  # Иногда Битрикс возвращает имя
+    # Режим "сначала принять" (DEAL_INGEST_MODE=inbox): один INSERT в буфер и сразу ответ Битрикс24,
+    # снимки, дельты и запись в deal_changes - отдельным этапом action=flush по расписанию
+    if os.environ.get('DEAL_INGEST_MODE', 'batch') == 'inbox':
+        return ingest_deal_event(event_row)
     
-    # Если нет имени, пробуем загрузить через REST (может не работать для входящих вебхуков)
-    if modifier_id and not modifier_name and webhook_url:
-        try:
-            user_url = f"{webhook_url}user.get.json"
-            user_params = urllib.parse.urlencode({'ID': modifier_id})
-            user_req = urllib.request.Request(f"{user_url}?{user_params}")
-            
-            with urllib.request.urlopen(user_req, timeout=5) as user_response:
-                user_data = json.loads(user_response.read().decode('utf-8'))
-                
-            if user_data.get('result') and len(user_data['result']) > 0:
-                user = user_data['result'][0]
-                modifier_name = f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}".strip()
-                print(f"[INFO] Пользователь получен: {modifier_name}")
-        except Exception as e:
-            print(f"[WARN] Не удалось получить имя через API (ограничение прав вебхука): {e}")
-            # Формируем fallback из ID
-            if modifier_id:
-                modifier_name = f"Пользователь #{modifier_id}"
-    
-    # Находим предыдущее состояние для отслеживания изменений
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    previous_stage = None
-    try:
-        cur.execute("""
-            SELECT deal_data->>'STAGE_ID' as stage_id 
-            FROM deal_changes 
-            WHERE deal_id = %s 
-            ORDER BY timestamp_received DESC 
-            LIMIT 1
-        """, (deal_id,))
-        
-        prev_row = cur.fetchone()
-        if prev_row:
-            previous_stage = prev_row['stage_id']
-    except Exception as e:
-        print(f"[WARN] Не удалось получить предыдущее состояние: {e}")
-    
-    current_stage = deal_full_data.get('STAGE_ID', '')
-    
-    # Формируем summary изменений
-    changes_summary = {}
-    if previous_stage and previous_stage != current_stage:
-        changes_summary['stage'] = {'from': previous_stage, 'to': current_stage}
-    
     try:
-        cur.execute("""
-            INSERT INTO deal_changes (
-                deal_id, event_type, deal_data, event_handler_id,
-                bitrix_domain, member_id, timestamp_bitrix,
-                modifier_user_id, modifier_user_name, 
-                previous_stage, current_stage, changes_summary
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            deal_id,
-            event_type,
-            json.dumps(deal_full_data, ensure_ascii=False),
-            event_handler_id,
-            domain,
-            member_id,
-            int(ts) if ts else None,
-            modifier_id,
-            modifier_name,
-            previous_stage,
-            current_stage,
-            json.dumps(changes_summary, ensure_ascii=False) if changes_summary else None
-        ))
-        
-        result = cur.fetchone()
-        log_id = result['id']
-        conn.commit()
-        
-        print(f"[SUCCESS] Сохранено в БД с ID: {log_id}")
+        if batch_window_ms <= 0:
+            result = process_deal_events(cur, [event_row])[0]
+            conn.commit()
+            log('INFO', 'db', f"Сохранено в БД с ID: {result['log_id']}")
+            flushed = 1
+            log_id = result['log_id']
+        else:
+            # Событие - в буфер; через окно DEAL_BATCH_WINDOW_MS буфер разбирается одним пакетом.
+            # Вызов, который успел забрать события, обрабатывает их все, остальные находят буфер пустым
+            cur.execute("""
+                INSERT INTO deal_event_buffer (deal_id, event_type, event_handler_id, ts, domain, member_id)
+                VALUES (%(deal_id)s, %(event_type)s, %(event_handler_id)s, %(ts)s, %(domain)s, %(member_id)s)
+                RETURNING id
+            """, event_row)
+            buffer_id = cur.fetchone()['id']
+            conn.commit()
+            
+            time.sleep(batch_window_ms / 1000.0)
+            flushed_ids = flush_deal_buffer(conn, cur)
+            flushed = len(flushed_ids)
+            log_id = flushed_ids.get(buffer_id)
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'success': True,
-                'message': 'Данные сделки сохранены',
+                'message': 'Данные сделки сохранены' if log_id else 'Событие принято, сохранено пакетом',
                 'log_id': log_id,
+                'batch_size': flushed,
                 'deal_id': deal_id,
                 'event_type': event_type
             }, ensure_ascii=False),
@@ -227,7 +278,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
     except Exception as e:
         conn.rollback()
-        print(f"[ERROR] Ошибка сохранения в БД: {e}")
+        log('ERROR', 'db', f"Ошибка сохранения в БД: {e}")
         
         return {
             'statusCode': 500,
@@ -237,4 +288,371 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def ingest_deal_event(event_row: Dict[str, Any]) -> Dict[str, Any]:
+    '''Приём события без обращений к REST: одна строка в deal_event_buffer, ответ сразу после INSERT'''
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("""
+            INSERT INTO deal_event_buffer (deal_id, event_type, event_handler_id, ts, domain, member_id)
+            VALUES (%(deal_id)s, %(event_type)s, %(event_handler_id)s, %(ts)s, %(domain)s, %(member_id)s)
+            RETURNING id
+        """, event_row)
+        inbox_id = cur.fetchone()['id']
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log('ERROR', 'db', f"Ошибка записи события в буфер: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        cur.close()
+        conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'message': 'Событие принято',
+            'inbox_id': inbox_id,
+            'deal_id': event_row['deal_id'],
+            'event_type': event_row['event_type']
+        }, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+def flush_deal_buffer(conn, cur, max_seconds: float = 0) -> Dict[int, int]:
+    '''
+    Забирает накопленные события из deal_event_buffer (SKIP LOCKED - параллельные вызовы
+    не пересекаются) и сохраняет их пакетами по DEAL_BATCH_MAX_SIZE. Удаление из буфера и запись
+    снимков - одна транзакция на пакет. max_seconds - после этого времени новый пакет не берётся
+    (0 - без ограничения). Возвращает {ID в буфере: ID в deal_changes}
+    '''
+    batch_limit = int(os.environ.get('DEAL_BATCH_MAX_SIZE', '500'))
+    flushed: Dict[int, int] = {}
+    started = time.time()
+    
+    while not max_seconds or time.time() - started < max_seconds:
+        cur.execute("""
+            DELETE FROM deal_event_buffer
+            WHERE id IN (SELECT id FROM deal_event_buffer ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+            RETURNING id, deal_id, event_type, event_handler_id, ts, domain, member_id
+        """, (batch_limit,))
+        rows = sorted(cur.fetchall(), key=lambda row: row['id'])
+        if not rows:
+            break
+        
+        results = process_deal_events(cur, rows)
+        conn.commit()
+        flushed.update({row['id']: result['log_id'] for row, result in zip(rows, results)})
+        log('INFO', 'db', f"Пакет сделок сохранён: {len(rows)} событий, {len({row['deal_id'] for row in rows})} сделок")
+        
+        if len(rows) < batch_limit:
+            break
+    
+    return flushed
+
+def process_deal_events(cur, events: List[Dict[str, Any]], skip_failed: bool = False) -> List[Dict[str, Any]]:
+    '''
+    Снимки сделок для пакета событий: данные всех сделок - crm.deal.list по 50 ID,
+    авторы изменений - из справочника bitrix_users, предыдущее состояние - из deal_latest_state,
+    запись - один многострочный INSERT в deal_changes и upsert deal_latest_state.
+    Снимок хранится дельтой к предыдущей версии (изменённые поля - в changes_summary.fields),
+    воронка, ответственный, сумма и компания версии - всегда в отдельных колонках для фильтров,
+    полный снимок - раз в DEAL_KEYFRAME_INTERVAL версий и в первой версии сделки за месяц (секции журнала
+    удаляются помесячно); событие без изменений данных не записывается.
+    Транзакцией управляет вызывающий; сделки пакета блокируются до её конца (lock_deals).
+    skip_failed - не записывать события, для которых снимок не получен (их повторит очередь).
+    Возвращает по каждому событию {log_id, snapshot_ok, unchanged}
+    '''
+    keyframe_interval = max(int(os.environ.get('DEAL_KEYFRAME_INTERVAL', '20')), 1)
+    deal_ids = list(dict.fromkeys(str(event['deal_id']) for event in events))
+    # Блокировка до запроса снимков: параллельный вызов по той же сделке ждёт коммита
+    # и читает уже обновлённые deal_latest_state и версию, а не общую старую
+    lock_deals(cur, deal_ids)
+    snapshots = fetch_deal_snapshots(deal_ids)
+    
+    modifier_ids = {str(deal.get('MODIFY_BY_ID')) for deal in snapshots.values() if deal.get('MODIFY_BY_ID') and not deal.get('MODIFY_BY_NAME')}
+    user_names = lookup_user_names(cur, sorted(modifier_ids)) if modifier_ids else {}
+    
+    # Последнее сохранённое состояние каждой сделки пакета - по первичному ключу deal_latest_state.
+    # keyframe_stale - ключевой кадр в прошлом месяце: секцию его месяца может удалить очистка
+    # журнала, поэтому первая версия сделки в новом месяце всегда пишется полным снимком
+    cur.execute("""
+        SELECT deal_id, stage_id, deal_data, version, keyframe_version,
+               keyframe_at IS NULL OR date_trunc('month', keyframe_at) < date_trunc('month', CURRENT_TIMESTAMP) AS keyframe_stale
+        FROM deal_latest_state WHERE deal_id = ANY(%s)
+    """, (deal_ids,))
+    last_states = {row['deal_id']: dict(row) for row in cur.fetchall()}
+    
+    rows = []
+    results: List[Dict[str, Any]] = []
+    latest: Dict[str, Dict[str, Any]] = {}
+    for event in events:
+        deal_id = str(event['deal_id'])
+        event_type = event.get('event_type', '')
+        deal_full_data = snapshots.get(deal_id) or {'error': 'Нет данных от REST API', 'deal_id': deal_id}
+        
+        # Для удалённой сделки отсутствие данных в REST - ожидаемый результат
+        snapshot_ok = 'error' not in deal_full_data or event_type.upper() == 'ONCRMDEALDELETE'
+        results.append({'log_id': None, 'snapshot_ok': snapshot_ok, 'unchanged': False})
+        if skip_failed and not snapshot_ok:
+            continue
+        
+        last_state = last_states.get(deal_id) or {}
+        previous_stage = last_state.get('stage_id')
+        current_stage = deal_full_data.get('STAGE_ID', '')
+        
+        # Формируем summary изменений: все изменённые поля, стадия - отдельно для интерфейса
+        changes_summary: Dict[str, Any] = {}
+        version = None
+        is_keyframe = False
+        stored_data = deal_full_data
+        if 'error' not in deal_full_data:
+            previous_data = last_state.get('deal_data') or {}
+            changed, removed = diff_deal_fields(previous_data, deal_full_data)
+            if last_state.get('version') and not changed and not removed:
+                results[-1]['unchanged'] = True
+                continue
+            
+            # Первая версия целиком лежит в deal_data, дублировать её в summary незачем
+            if changed and previous_data:
+                changes_summary['fields'] = changed
+            if removed:
+                changes_summary['removed'] = removed
+            if previous_stage and previous_stage != current_stage:
+                changes_summary['stage'] = {'from': previous_stage, 'to': current_stage}
+            
+            version = (last_state.get('version') or 0) + 1
+            keyframe_version = last_state.get('keyframe_version')
+            is_keyframe = (not previous_data or not keyframe_version or last_state.get('keyframe_stale', True)
+                           or version - keyframe_version >= keyframe_interval)
+            stored_data = deal_full_data if is_keyframe else {}
+            
+            last_states[deal_id] = {
+                'stage_id': current_stage,
+                'deal_data': deal_full_data,
+                'version': version,
+                'keyframe_version': version if is_keyframe else keyframe_version,
+                'keyframe_stale': False if is_keyframe else last_state.get('keyframe_stale', True),
+                'keyframe_written': is_keyframe or bool(last_state.get('keyframe_written'))
+            }
+            latest[deal_id] = {'index': len(results) - 1, 'event_type': event_type, **last_states[deal_id]}
+        
+        modifier_id = deal_full_data.get('MODIFY_BY_ID', '')
+        modifier_name = deal_full_data.get('MODIFY_BY_NAME', '')  # Иногда Битрикс возвращает имя
+        if modifier_id and not modifier_name:
+            # Нет в справочнике - заглушка, имя проставит deal-changes-enrich после синхронизации
+            modifier_name = user_names.get(str(modifier_id)) or f"Пользователь #{modifier_id}"
+        
+        ts = str(event.get('ts') or '')
+        rows.append((len(results) - 1, (
+            deal_id,
+            event_type,
+            json.dumps(stored_data, ensure_ascii=False),
+            event.get('event_handler_id', ''),
+            event.get('domain', ''),
+            event.get('member_id', ''),
+            int(ts) if ts.isdigit() else None,
+            modifier_id,
+            modifier_name,
+            previous_stage,
+            current_stage,
+            json.dumps(changes_summary, ensure_ascii=False) if changes_summary else None,
+            version,
+            is_keyframe,
+            deal_full_data.get('CATEGORY_ID') or None,
+            deal_full_data.get('ASSIGNED_BY_ID') or None,
+            parse_amount(deal_full_data.get('OPPORTUNITY')),
+            deal_full_data.get('COMPANY_ID') if deal_full_data.get('COMPANY_ID') not in (None, '', '0') else None
+        )))
+    
+    if rows:
+        inserted = execute_values(cur, """
+            INSERT INTO deal_changes (
+                deal_id, event_type, deal_data, event_handler_id,
+                bitrix_domain, member_id, timestamp_bitrix,
+                modifier_user_id, modifier_user_name, 
+                previous_stage, current_stage, changes_summary,
+                version, is_keyframe,
+                category_id, assigned_by_id, opportunity, company_id
+            ) VALUES %s
+            RETURNING id
+        """, [values for _, values in rows], page_size=len(rows), fetch=True)
+        for (index, _), inserted_row in zip(rows, inserted):
+            results[index]['log_id'] = inserted_row['id']
+    
+    # Последнее состояние (полный снимок) - в той же транзакции, что и история.
+    # Версия только растёт: если строка уже на этой версии или новее, цепочка дельт разошлась -
+    # транзакция откатывается, события остаются в буфере/очереди
+    if latest:
+        updated = execute_values(cur, """
+            INSERT INTO deal_latest_state (deal_id, stage_id, deal_data, last_change_id, event_type, version, keyframe_version, keyframe_at)
+            VALUES %s
+            ON CONFLICT (deal_id) DO UPDATE SET
+                stage_id = EXCLUDED.stage_id, deal_data = EXCLUDED.deal_data,
+                last_change_id = EXCLUDED.last_change_id, event_type = EXCLUDED.event_type,
+                version = EXCLUDED.version, keyframe_version = EXCLUDED.keyframe_version,
+                keyframe_at = COALESCE(EXCLUDED.keyframe_at, deal_latest_state.keyframe_at), updated_at = NOW()
+            WHERE deal_latest_state.version IS NULL OR deal_latest_state.version < EXCLUDED.version
+            RETURNING deal_id
+        """, [
+            (deal_id, state['stage_id'], json.dumps(state['deal_data'], ensure_ascii=False),
+             results[state['index']]['log_id'], state['event_type'], state['version'], state['keyframe_version'],
+             state['keyframe_written'])
+            for deal_id, state in latest.items()
+        ], template='(%s, %s, %s::jsonb, %s, %s, %s, %s, CASE WHEN %s THEN CURRENT_TIMESTAMP END)', page_size=len(latest), fetch=True)
+        stale = set(latest) - {row['deal_id'] for row in updated}
+        if stale:
+            raise RuntimeError(f"Версия сделок уже записана другим вызовом: {', '.join(sorted(stale))}")
+    
+    # Карта сделка -> компания: по последнему событию каждой сделки
+    last_events = {str(event['deal_id']): event.get('event_type', '') for event in events}
+    for deal_id, event_type in last_events.items():
+        update_deal_company_map(cur, deal_id, event_type, snapshots.get(deal_id) or {})
+    
+    return results
+
+def lock_deals(cur, deal_ids: List[str]) -> None:
+    '''
+    Транзакционные advisory-блокировки по сделкам (снимаются при commit/rollback).
+    Берутся в порядке deal_id, чтобы пересекающиеся пакеты не ждали друг друга по кругу;
+    работают и для сделок, которых ещё нет в deal_latest_state
+    '''
+    cur.execute("""
+        SELECT pg_advisory_xact_lock(hashtext('deal_changes'), hashtext(deal_id))
+        FROM (SELECT DISTINCT unnest(%s::text[]) AS deal_id ORDER BY 1) deals
+    """, (deal_ids,))
+    cur.fetchall()
+
+def parse_amount(value: Any) -> Optional[float]:
+    '''OPPORTUNITY из REST (строка "15000.00") в число для колонки opportunity'''
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def diff_deal_fields(previous: Dict[str, Any], current: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    '''Изменённые поля {поле: {from, to}} и список полей, которых больше нет в снимке'''
+    changed = {
+        field: {'from': previous.get(field), 'to': value}
+        for field, value in current.items()
+        if field not in previous or previous[field] != value
+    }
+    removed = [field for field in previous if field not in current]
+    return changed, removed
+
+def fetch_deal_snapshots(deal_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    '''Полные данные сделок: crm.deal.list с filter[@ID] по 50 ID (все поля и UF_*); нет в ответе - нет в результате'''
+    webhook_url = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if not webhook_url:
+        log('ERROR', 'flow', "Секрет BITRIX24_WEBHOOK_URL не настроен!")
+        return {}
+    
+    snapshots: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(deal_ids), 50):
+        chunk = deal_ids[start:start + 50]
+        params = urllib.parse.urlencode(
+            [('filter[@ID][]', deal_id) for deal_id in chunk] + [('select[]', '*'), ('select[]', 'UF_*')]
+        )
+        try:
+            log('INFO', 'bitrix', f"Запрос к REST API: crm.deal.list, сделок: {len(chunk)}")
+            req = urllib.request.Request(f"{webhook_url}crm.deal.list.json", data=params.encode('utf-8'))
+            with urllib.request.urlopen(req, timeout=15) as response:
+                rest_data = json.loads(response.read().decode('utf-8'))
+            
+            if 'result' not in rest_data:
+                log('WARN', 'bitrix', f"REST API не вернул данные сделок: {rest_data}")
+                continue
+            for deal in rest_data['result']:
+                snapshots[str(deal['ID'])] = deal
+        except Exception as e:
+            log('ERROR', 'bitrix', f"Ошибка при запросе к REST API: {e}")
+    
+    return snapshots
+
+def lookup_user_names(cur, user_ids: List[str]) -> Dict[str, str]:
+    '''Имена пользователей из справочника bitrix_users (его пополняет deal-changes-enrich), без вызовов REST'''
+    cur.execute("SELECT user_id, full_name FROM bitrix_users WHERE user_id = ANY(%s) AND full_name != ''", (user_ids,))
+    return {row['user_id']: row['full_name'] for row in cur.fetchall()}
+
+def process_event_batch(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Пакет событий сделок из очереди одним вызовом функции: снимки сохраняются одним пакетом,
+    событие считается обработанным, только если снимок сделки получен и сохранён
+    '''
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    items = [item for item in events if str(item.get('id', '')).strip()]
+    try:
+        event_rows = [{
+            'deal_id': str(item['id']).strip(),
+            'event_type': item.get('event', ''),
+            'event_handler_id': 'offline',
+            'ts': '',
+            'domain': '',
+            'member_id': ''
+        } for item in items]
+        processed = process_deal_events(cur, event_rows, skip_failed=True) if event_rows else []
+        conn.commit()
+        results = [
+            {'key': item.get('key'), 'success': result['snapshot_ok'], 'log_id': result['log_id'],
+             'error': None if result['snapshot_ok'] else 'Нет данных от REST API'}
+            for item, result in zip(items, processed)
+        ]
+    except Exception as e:
+        conn.rollback()
+        log('ERROR', 'db', f"Ошибка обработки пакета событий: {e}")
+        results = [{'key': item.get('key'), 'success': False, 'error': str(e)} for item in items]
+    finally:
+        cur.close()
+        conn.close()
+    
+    # События без ID сделки обрабатывать нечем - подтверждаем
+    results.extend({'key': item.get('key'), 'success': True, 'error': None} for item in events if not str(item.get('id', '')).strip())
+    log('INFO', 'flow', f"Пакет событий: {len(events)}, успешно: {sum(1 for item in results if item['success'])}")
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'results': results}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+def update_deal_company_map(cur, deal_id: str, event_type: str, deal_full_data: Dict[str, Any]) -> None:
+    '''
+    Обновляет карту сделка -> компания (deal_company_map) по событию сделки.
+    Используется bitrix-webhook при бэкапе и восстановлении компаний вместо crm.deal.list
+    '''
+    if event_type.upper() == 'ONCRMDEALDELETE':
+        cur.execute(
+            "UPDATE deal_company_map SET deleted = TRUE, updated_at = CURRENT_TIMESTAMP WHERE deal_id = %s",
+            (str(deal_id),)
+        )
+        return
+    
+    # Ошибка REST - данных сделки нет, карту не трогаем
+    if not deal_full_data.get('ID'):
+        return
+    
+    company_id = str(deal_full_data.get('COMPANY_ID') or '')
+    cur.execute("""
+        INSERT INTO deal_company_map (deal_id, company_id, deal_data, date_modify, deleted, updated_at)
+        VALUES (%s, %s, %s::jsonb, %s, FALSE, CURRENT_TIMESTAMP)
+        ON CONFLICT (deal_id) DO UPDATE SET
+            company_id = EXCLUDED.company_id, deal_data = EXCLUDED.deal_data,
+            date_modify = EXCLUDED.date_modify, deleted = FALSE, updated_at = CURRENT_TIMESTAMP
+    """, (
+        str(deal_id),
+        company_id if company_id not in ('', '0') else None,
+        json.dumps(deal_full_data, ensure_ascii=False),
+        deal_full_data.get('DATE_MODIFY')
+    ))
@@ -0,0 +1,248 @@
+'''
+Business: Pull-режим приёма событий Битрикс24: офлайн-обработчики (event.bind event_type=offline)
+          и пакетная выборка очереди через event.offline.get / event.offline.clear.
+          События раздаются пакетами в bitrix-webhook (проверка ИНН), bitrix-deal-tracker и purchases-webhook,
+          из очереди удаляются только успешно обработанные, остальные помечаются event.offline.error
+Args: event с httpMethod, body {action: register | drain, limit, max_batches, retry_errors}
+Returns: Отчёт о регистрации обработчиков или о выборке очереди
+'''
+import json
+import os
+import random
+import time
+import urllib.request
+import urllib.parse
+from typing import Dict, Any, List, Callable, Tuple, Union
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+# Получатели событий: пакетный вход process_events каждой функции. Адреса - только из настроек
+# (URL функций bitrix-webhook, bitrix-deal-tracker и purchases-webhook из func2url.json)
+PULL_TARGETS = {
+    'check_inn': os.environ.get('PULL_CHECK_INN_URL', ''),
+    'deal_tracker': os.environ.get('PULL_DEAL_TRACKER_URL', ''),
+    'purchases': os.environ.get('PULL_PURCHASES_URL', '')
+}
+
+# Какие события в какие функции уходят (PULL_ROUTES - JSON для переопределения)
+PULL_ROUTES: Dict[str, List[str]] = json.loads(os.environ.get('PULL_ROUTES', '') or json.dumps({
+    'ONCRMCOMPANYADD': ['check_inn'],
+    'ONCRMCOMPANYUPDATE': ['check_inn'],
+    'ONCRMDEALADD': ['deal_tracker', 'purchases'],
+    'ONCRMDEALUPDATE': ['deal_tracker', 'purchases'],
+    'ONCRMDEALDELETE': ['deal_tracker']
+}))
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'POST')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET':
+        return response_json(200, {
+            'success': True,
+            'routes': PULL_ROUTES,
+            'targets': PULL_TARGETS
+        })
+    
+    if method != 'POST':
+        return response_json(405, {'error': 'Method not allowed'})
+    
+    body_data = json.loads(event.get('body') or '{}')
+    action = body_data.get('action', 'drain')
+    
+    if not os.environ.get('BITRIX24_WEBHOOK_URL', ''):
+        return response_json(500, {'success': False, 'error': 'BITRIX24_WEBHOOK_URL not configured'})
+    
+    # Регистрация офлайн-обработчиков (однократно при переходе на pull-режим)
+    if action == 'register':
+        return response_json(200, {'success': True, 'handlers': register_offline_handlers()})
+    
+    # Выборка очереди (вызывается по расписанию)
+    if action == 'drain':
+        # Без адреса получателя события ушли бы в event.offline.error - не начинаем выборку
+        missing = sorted({target for targets in PULL_ROUTES.values() for target in targets if not PULL_TARGETS.get(target)})
+        if missing:
+            return response_json(500, {'success': False, 'error': f"Pull targets not configured: {', '.join(missing)}"})
+        limit = min(int(body_data.get('limit', os.environ.get('PULL_BATCH_SIZE', '500'))), 1000)
+        max_batches = int(body_data.get('max_batches', os.environ.get('PULL_MAX_BATCHES', '10')))
+        report = drain_offline_events(limit, max_batches, bool(body_data.get('retry_errors')))
+        return response_json(200 if not report['errors'] else 502, {'success': not report['errors'], **report})
+    
+    return response_json(400, {'success': False, 'error': f'Unknown action: {action}'})
+
+def bitrix_call(method: str, params_list: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    '''Вызов REST Битрикс24 (POST, form-encoded); ошибка REST - исключение'''
+    url = f"{os.environ['BITRIX24_WEBHOOK_URL'].rstrip('/')}/{method}.json"
+    req = urllib.request.Request(url, data=urllib.parse.urlencode(params_list).encode('utf-8'))
+    with urllib.request.urlopen(req, timeout=20) as response:
+        result = json.loads(response.read().decode('utf-8'))
+    if 'result' not in result:
+        raise RuntimeError(f"{method}: {result.get('error_description', result.get('error'))}")
+    return result
+
+def register_offline_handlers() -> List[Dict[str, Any]]:
+    '''event.bind с event_type=offline для всех событий из PULL_ROUTES; уже привязанные пропускаются'''
+    bound = set()
+    try:
+        for item in bitrix_call('event.get', [])['result']:
+            if item.get('offline'):
+                bound.add(str(item.get('event', '')).upper())
+    except Exception as e:
+        log('WARN', 'bitrix', f"event.get error: {type(e).__name__}: {str(e)}")
+    
+    handlers = []
+    for event_name in PULL_ROUTES:
+        if event_name in bound:
+            handlers.append({'event': event_name, 'status': 'exists'})
+            continue
+        try:
+            bitrix_call('event.bind', [('event', event_name), ('event_type', 'offline')])
+            handlers.append({'event': event_name, 'status': 'bound'})
+        except Exception as e:
+            handlers.append({'event': event_name, 'status': 'error', 'error': str(e)})
+    
+    return handlers
+
+def drain_offline_events(limit: int, max_batches: int, retry_errors: bool) -> Dict[str, Any]:
+    '''
+    Выбирает очередь пакетами по limit событий (clear=0: события резервируются за process_id),
+    раздаёт их получателям и подтверждает: event.offline.clear - обработанные,
+    event.offline.error - необработанные (их выбирает вызов с retry_errors)
+    '''
+    started = time.time()
+    max_seconds = float(os.environ.get('PULL_MAX_SECONDS', '20'))
+    report: Dict[str, Any] = {'batches': 0, 'events': 0, 'cleared': 0, 'failed': 0, 'dispatched': {}, 'errors': []}
+    
+    while report['batches'] < max_batches and time.time() - started < max_seconds:
+        params = [('clear', 0), ('limit', limit)]
+        if retry_errors:
+            params.append(('error', 1))
+        try:
+            queue = bitrix_call('event.offline.get', params)['result']
+        except Exception as e:
+            report['errors'].append(str(e))
+            break
+        
+        events = queue.get('events') or []
+        if not events:
+            break
+        report['batches'] += 1
+        report['events'] += len(events)
+        
+        ok_ids, failed_ids = dispatch_events(events, report['dispatched'])
+        
+        try:
+            if ok_ids:
+                bitrix_call('event.offline.clear', [('process_id', queue['process_id'])] + [('message_id[]', item) for item in ok_ids])
+            if failed_ids:
+                bitrix_call('event.offline.error', [('process_id', queue['process_id'])] + [('message_id[]', item) for item in failed_ids])
+        except Exception as e:
+            report['errors'].append(str(e))
+            break
+        report['cleared'] += len(ok_ids)
+        report['failed'] += len(failed_ids)
+        
+        if len(events) < limit:
+            break
+    
+    report['elapsed_ms'] = int((time.time() - started) * 1000)
+    log('INFO', 'flow', lambda: f"Offline queue: {report['events']} events, {report['cleared']} cleared, {report['failed']} failed")
+    return report
+
+def dispatch_events(events: List[Dict[str, Any]], dispatched: Dict[str, int]) -> Tuple[List[str], List[str]]:
+    '''
+    Раскладывает события по получателям (одна запись на сущность: повторные события
+    одной сделки/компании в пакете схлопываются в последнее) и отправляет по одному запросу
+    на получателя. Возвращает MESSAGE_ID обработанных и необработанных событий
+    '''
+    batches: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    message_keys: Dict[str, List[Tuple[str, str]]] = {}
+    
+    for item in sorted(events, key=lambda row: int(row.get('ID', 0))):
+        message_id = str(item.get('MESSAGE_ID', ''))
+        event_name = str(item.get('EVENT_NAME', '')).upper()
+        fields = (item.get('EVENT_DATA') or {}).get('FIELDS') or {}
+        entity_id = str(fields.get('ID', '')).strip()
+        
+        # Событие без получателя или без ID сущности обрабатывать нечем
+        targets = PULL_ROUTES.get(event_name, []) if entity_id else []
+        message_keys[message_id] = []
+        for target in targets:
+            key = f"{target}:{entity_id}"
+            batches.setdefault(target, {})[key] = {'key': key, 'event': event_name, 'id': entity_id, 'ts': item.get('TIMESTAMP_X', '')}
+            message_keys[message_id].append((target, key))
+    
+    succeeded = set()
+    for target, items in batches.items():
+        dispatched[target] = dispatched.get(target, 0) + len(items)
+        for result in send_to_target(target, list(items.values())):
+            if result.get('success'):
+                succeeded.add((target, result.get('key')))
+            else:
+                log('WARN', 'flow', f"{target} failed {result.get('key')}: {result.get('error')}")
+    
+    ok_ids = [message_id for message_id, keys in message_keys.items() if all(key in succeeded for key in keys)]
+    failed_ids = [message_id for message_id, keys in message_keys.items() if not all(key in succeeded for key in keys)]
+    return ok_ids, failed_ids
+
+def send_to_target(target: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''POST {action: process_events, events} в функцию-получатель; при сбое все события пакета неуспешны'''
+    try:
+        req = urllib.request.Request(
+            PULL_TARGETS[target],
+            data=json.dumps({'action': 'process_events', 'events': items}, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'User-Agent': 'bitrix-event-pull'}
+        )
+        with urllib.request.urlopen(req, timeout=int(os.environ.get('PULL_TARGET_TIMEOUT', '25'))) as response:
+            return json.loads(response.read().decode('utf-8')).get('results', [])
+    except Exception as e:
+        log('ERROR', 'flow', f"{target} unavailable: {type(e).__name__}: {str(e)}")
+        return [{'key': item['key'], 'success': False, 'error': str(e)} for item in items]
+
+def response_json(status_code: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps(data, ensure_ascii=False, default=str)
+    }
@@ -1,7 +1,173 @@
 import json
+import os
+import random
 import urllib.parse
 import base64
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Callable, List, Union
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+def parse_form_body(body: str) -> Dict[str, Any]:
+    '''
+    Разбор x-www-form-urlencoded тела Битрикс24 за один проход: PHP-ключи со скобками
+    (auth[domain], data[FIELDS][ID], document_id[], data[FIELDS][UF_LIST][0]) раскладываются
+    во вложенные dict/list. Повтор ключа без скобок перезаписывает значение (как в PHP),
+    числовые индексы по порядку дают list, пропуск индекса превращает list в dict.
+    Тело декодируется одним вызовом unquote_plus (закодированные & и = защищены маркерами;
+    если маркеры уже есть в теле - сырыми или как %00/%01 - разбор попарный),
+    контейнеры запоминаются по префиксу ключа: соседние поля data[FIELDS][...] пишутся без обхода пути
+    '''
+    escaped = '%26' in body or '%3D' in body or '%3d' in body
+    if '\x00' in body or '\x01' in body or '%00' in body or '%01' in body:
+        pairs = [tuple(urllib.parse.unquote_plus(part) for part in pair.partition('=')[::2]) for pair in body.split('&') if pair]
+        escaped = False
+    else:
+        if escaped:
+            body = body.replace('%26', '\x00').replace('%3D', '\x01').replace('%3d', '\x01')
+        pairs = [pair.partition('=')[::2] for pair in urllib.parse.unquote_plus(body).split('&') if pair]
+    
+    result: Dict[str, Any] = {}
+    containers: Dict[str, Dict[str, Any]] = {}
+    for key, value in pairs:
+        if escaped:
+            key = key.replace('\x00', '&').replace('\x01', '=')
+            value = value.replace('\x00', '&').replace('\x01', '=')
+        
+        if not key.endswith(']') or key.find('[') <= 0:
+            if key in result:
+                containers.clear()
+            result[key] = value
+            continue
+        
+        cut = key.rfind('[')
+        prefix, last = key[:cut], key[cut + 1:-1]
+        container = containers.get(prefix)
+        if container is not None and last and not last.isdigit() and not isinstance(container.get(last), (dict, list)):
+            container[last] = value
+            continue
+        
+        bracket = key.find('[')
+        node: Any = result
+        name = key[:bracket]
+        for segment in key[bracket + 1:-1].split(']['):
+            child = form_node_get(node, name)
+            if isinstance(child, list) and segment and not (segment.isdigit() and int(segment) <= len(child)):
+                child = {str(index): item for index, item in enumerate(child)}
+                form_node_set(node, name, child)
+                containers.clear()
+            elif not isinstance(child, (dict, list)):
+                child = [] if not segment or segment == '0' else {}
+                form_node_set(node, name, child)
+            node, name = child, segment
+        if isinstance(form_node_get(node, name), (dict, list)):
+            containers.clear()
+        form_node_set(node, name, value)
+        if isinstance(node, dict) and '[]' not in prefix:
+            containers[prefix] = node
+    
+    return result
+
+def form_node_get(node: Any, name: str) -> Any:
+    '''Элемент контейнера по сегменту ключа; "[]" всегда создаёт новый элемент'''
+    if isinstance(node, list):
+        return node[int(name)] if name and int(name) < len(node) else None
+    return node.get(name)
+
+def form_node_set(node: Any, name: str, value: Any) -> None:
+    '''Запись в контейнер по сегменту ключа: в list - добавление в конец или замена по индексу'''
+    if isinstance(node, list):
+        if not name or int(name) == len(node):
+            node.append(value)
+        else:
+            node[int(name)] = value
+    else:
+        node[name] = value
+
+# Образцы тел Битрикс24 для замера разбора (GET ?benchmark=N)
+BENCHMARK_PAYLOADS = {
+    'deal_event': urllib.parse.urlencode([
+        ('event', 'ONCRMDEALUPDATE'), ('event_handler_id', '15'), ('data[FIELDS][ID]', '4821'), ('ts', '1736942400'),
+        ('auth[domain]', 'example.bitrix24.ru'), ('auth[client_endpoint]', 'https://example.bitrix24.ru/rest/'),
+        ('auth[server_endpoint]', 'https://oauth.bitrix.info/rest/'), ('auth[member_id]', 'a1b2c3d4e5f6'),
+        ('auth[application_token]', 'f00dbabe')
+    ]),
+    'bp_document': urllib.parse.urlencode([
+        ('document_id[]', 'crm'), ('document_id[]', 'CCrmDocumentDeal'), ('document_id[]', 'DEAL_4821'),
+        ('document_type[]', 'crm'), ('document_type[]', 'CCrmDocumentDeal'), ('document_type[]', 'DEAL'),
+        ('auth[domain]', 'example.bitrix24.ru'), ('auth[member_id]', 'a1b2c3d4e5f6')
+    ]),
+    'wide_fields': urllib.parse.urlencode(
+        [('event', 'ONCRMDEALUPDATE'), ('auth[domain]', 'example.bitrix24.ru')]
+        + [(f"data[FIELDS][UF_CRM_{index}]", f"значение {index}") for index in range(150)]
+        + [(f"data[FIELDS][UF_CRM_LIST][{index}]", str(index)) for index in range(50)]
+    )
+}
+
+def legacy_parse_form_body(body: str) -> Dict[str, Any]:
+    '''Прежний разбор (parse_qs + замены строк) - только для сравнения в замере'''
+    parsed = urllib.parse.parse_qs(body)
+    body_data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
+    if 'auth[domain]' in body_data:
+        auth = {}
+        data_fields = {}
+        for key, value in list(body_data.items()):
+            if key.startswith('auth['):
+                auth[key.replace('auth[', '').replace(']', '')] = value
+                del body_data[key]
+            elif key.startswith('data[FIELDS]['):
+                data_fields[key.replace('data[FIELDS][', '').replace(']', '')] = value
+                del body_data[key]
+        if auth:
+            body_data['auth'] = auth
+        if data_fields:
+            body_data['data'] = {'FIELDS': data_fields}
+    return body_data
+
+def run_parser_benchmark(iterations: int) -> List[Dict[str, Any]]:
+    '''Микро-замер: мкс на разбор одного тела, новым и прежним способом, по каждому образцу'''
+    report = []
+    for name, payload in BENCHMARK_PAYLOADS.items():
+        timings = {}
+        for label, parse in (('single_pass', parse_form_body), ('legacy', legacy_parse_form_body)):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                parse(payload)
+            timings[label] = round((time.perf_counter() - started) / iterations * 1_000_000, 2)
+        report.append({
+            'payload': name,
+            'bytes': len(payload),
+            'iterations': iterations,
+            'single_pass_us': timings['single_pass'],
+            'legacy_us': timings['legacy'],
+            'speedup': round(timings['legacy'] / timings['single_pass'], 2) if timings['single_pass'] else None
+        })
+    return report
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -29,6 +195,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     # Собираем всю информацию о запросе
     headers = event.get('headers', {})
     query_params = event.get('queryStringParameters', {})
+    
+    # Микро-замер разбора form-urlencoded тел: GET ?benchmark=<число итераций>
+    if method == 'GET' and (query_params or {}).get('benchmark'):
+        iterations = min(max(int(query_params['benchmark']), 1), 100000)
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': True, 'benchmark': run_parser_benchmark(iterations)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
     body_str = event.get('body', '')
     
     # Пытаемся распарсить тело запроса
@@ -45,28 +224,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if event.get('isBase64Encoded', False):
                 body_str = base64.b64decode(body_str).decode('utf-8')
             
-            # Парсим urlencoded строку
-            parsed = urllib.parse.parse_qs(body_str)
-            body_data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-            
-            # Парсим вложенные структуры auth и data
-            if 'auth[domain]' in body_data:
-                auth = {}
-                data_fields = {}
-                for key, value in list(body_data.items()):
-                    if key.startswith('auth['):
-                        auth_key = key.replace('auth[', '').replace(']', '')
-                        auth[auth_key] = value
-                        del body_data[key]
-                    elif key.startswith('data[FIELDS]['):
-                        field_key = key.replace('data[FIELDS][', '').replace(']', '')
-                        data_fields[field_key] = value
-                        del body_data[key]
-                
-                if auth:
-                    body_data['auth'] = auth
-                if data_fields:
-                    body_data['data'] = {'FIELDS': data_fields}
+            # Парсим urlencoded строку: auth[...], data[FIELDS][...] и массивы - во вложенные dict/list
+            body_data = parse_form_body(body_str)
         else:
             # Пытаемся как JSON
             try:
@@ -97,12 +256,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     }
     
     # Логируем в консоль
-    print(f"[INFO] Получен запрос: {method}")
-    print(f"[INFO] Headers: {json.dumps(headers, ensure_ascii=False)}")
-    print(f"[INFO] Событие Битрикс24: {body_data.get('event', 'не указано')}")
-    print(f"[INFO] ID сделки: {body_data.get('data', {}).get('FIELDS', {}).get('ID', 'не указано')}")
-    print(f"[INFO] Домен: {body_data.get('auth', {}).get('domain', 'не указано')}")
-    print(f"[INFO] Полные данные: {json.dumps(body_data, ensure_ascii=False)}")
+    log('INFO', 'flow', f"Получен запрос: {method}")
+    log('INFO', 'payload', lambda: f"Headers: {json.dumps(headers, ensure_ascii=False)}")
+    log('INFO', 'flow', f"Событие Битрикс24: {body_data.get('event', 'не указано')}")
+    log('INFO', 'flow', f"ID сделки: {body_data.get('data', {}).get('FIELDS', {}).get('ID', 'не указано')}")
+    log('INFO', 'flow', f"Домен: {body_data.get('auth', {}).get('domain', 'не указано')}")
+    log('INFO', 'payload', lambda: f"Полные данные: {json.dumps(body_data, ensure_ascii=False)}")
     
     return {
         'statusCode': 200,
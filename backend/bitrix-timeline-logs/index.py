@@ -5,11 +5,41 @@ Returns: Список шаблонов БП с актуальной статис
 '''
 import json
 import os
-from typing import Dict, Any, List
+import random
+from typing import Dict, Any, List, Callable, Union
 import requests
 import psycopg2
 from datetime import datetime
 
+DB_INSTANCES_LIMIT = 100
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -50,9 +80,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }, ensure_ascii=False)
         }
     except Exception as e:
-        print(f"[ERROR] Ошибка получения логов Timeline: {e}")
+        log('ERROR', 'flow', f"Ошибка получения логов Timeline: {e}")
         import traceback
-        traceback.print_exc()
+        log('ERROR', 'flow', traceback.format_exc)
         
         return {
             'statusCode': 500,
@@ -69,7 +99,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 def get_db_bp_stats() -> Dict[str, Any]:
     dsn = os.environ.get('DATABASE_URL')
     if not dsn:
-        print("[DEBUG] DATABASE_URL не найден, статистика из БД недоступна")
+        log('DEBUG', 'db', "DATABASE_URL не найден, статистика из БД недоступна")
         return {}
     
     try:
@@ -77,19 +107,20 @@ def get_db_bp_stats() -> Dict[str, Any]:
         cursor = conn.cursor()
         
         # Получаем статистику по БП "Дубли компании" (webhook_type = 'check_inn')
+        # Суммируем дневные счётчики вместо полного сканирования webhook_logs
         cursor.execute("""
             SELECT 
-                COUNT(*) as total_runs,
-                COUNT(CASE WHEN duplicate_found THEN 1 END) as duplicates_found,
-                MAX(created_at) as last_run,
-                MIN(created_at) as first_run
-            FROM t_p8980362_bitrix_webhook_handl.webhook_logs
+                COALESCE(SUM(total_requests), 0) as total_runs,
+                COALESCE(SUM(duplicates_found), 0) as duplicates_found,
+                MAX(last_at) as last_run,
+                MIN(first_at) as first_run
+            FROM t_p8980362_bitrix_webhook_handl.webhook_stats_daily
             WHERE webhook_type = 'check_inn'
         """)
         
         row = cursor.fetchone()
         
-        # Получаем детальные записи запусков
+        # Получаем последние записи запусков (полная история доступна в журнале вебхуков)
         cursor.execute("""
             SELECT 
                 id,
@@ -99,7 +130,8 @@ def get_db_bp_stats() -> Dict[str, Any]:
             FROM t_p8980362_bitrix_webhook_handl.webhook_logs
             WHERE webhook_type = 'check_inn'
             ORDER BY created_at DESC
-        """)
+            LIMIT %s
+        """, (DB_INSTANCES_LIMIT,))
         
         instances = []
         for instance_row in cursor.fetchall():
@@ -116,16 +148,16 @@ def get_db_bp_stats() -> Dict[str, Any]:
         if row:
             return {
                 'template_id': '4',
-                'total_runs': row[0] or 0,
-                'duplicates_found': row[1] or 0,
+                'total_runs': int(row[0] or 0),
+                'duplicates_found': int(row[1] or 0),
                 'last_run': row[2].isoformat() if row[2] else None,
                 'first_run': row[3].isoformat() if row[3] else None,
                 'instances': instances
             }
     except Exception as e:
-        print(f"[DEBUG] Ошибка получения статистики из БД: {e}")
+        log('WARN', 'db', f"Ошибка получения статистики из БД: {e}")
         import traceback
-        traceback.print_exc()
+        log('ERROR', 'flow', traceback.format_exc)
         return {}
     
     return {}
@@ -136,7 +168,7 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
         raise ValueError('BITRIX24_BP_WEBHOOK_URL или BITRIX24_WEBHOOK_URL не настроен')
     
     webhook_url = webhook_url.rstrip('/')
-    print(f"[DEBUG] Используем webhook: {webhook_url[:50]}...")
+    log('DEBUG', 'bitrix', f"Используем webhook: {webhook_url[:50]}...")
     
     # Получаем список шаблонов БП
     templates_response = requests.post(
@@ -154,7 +186,7 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
         raise Exception(f"Ошибка получения шаблонов: {templates_data.get('error_description', 'Неизвестная ошибка')}")
     
     templates = {t['ID']: t for t in templates_data.get('result', [])}
-    print(f"[DEBUG] Получено шаблонов БП: {len(templates)}")
+    log('DEBUG', 'flow', f"Получено шаблонов БП: {len(templates)}")
     
     # Используем bizproc.workflow.instance.list для получения ПОЛНОЙ истории (не только активных)
     instances_response = requests.post(
@@ -167,17 +199,17 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
         timeout=30
     )
     
-    print(f"[DEBUG] Запрос instance.list статус: {instances_response.status_code}")
+    log('DEBUG', 'bitrix', f"Запрос instance.list статус: {instances_response.status_code}")
     
     instances = []
     if instances_response.status_code == 200:
         instances_data = instances_response.json()
         instances = instances_data.get('result', [])
-        print(f"[DEBUG] Получено экземпляров БП из instance.list: {len(instances)}")
+        log('DEBUG', 'flow', f"Получено экземпляров БП из instance.list: {len(instances)}")
         if instances:
-            print(f"[DEBUG] Первый экземпляр: ID={instances[0].get('ID')}, TEMPLATE_ID={instances[0].get('TEMPLATE_ID')}, STARTED={instances[0].get('STARTED')}")
+            log('DEBUG', 'flow', f"Первый экземпляр: ID={instances[0].get('ID')}, TEMPLATE_ID={instances[0].get('TEMPLATE_ID')}, STARTED={instances[0].get('STARTED')}")
     else:
-        print(f"[DEBUG] Ошибка instance.list: {instances_response.text[:300]}")
+        log('WARN', 'flow', lambda: f"Ошибка instance.list: {instances_response.text[:300]}")
     
     # Получаем задачи БП для дополнительной проверки истории
     tasks_response = requests.post(
@@ -193,15 +225,15 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
     if tasks_response.status_code == 200:
         tasks_data = tasks_response.json()
         tasks = tasks_data.get('result', [])
-        print(f"[DEBUG] Получено задач БП: {len(tasks)}")
+        log('DEBUG', 'flow', f"Получено задач БП: {len(tasks)}")
         if tasks:
-            print(f"[DEBUG] Первая задача: WORKFLOW_TEMPLATE_ID={tasks[0].get('WORKFLOW_TEMPLATE_ID')}, WORKFLOW_STARTED={tasks[0].get('WORKFLOW_STARTED')}")
+            log('DEBUG', 'flow', f"Первая задача: WORKFLOW_TEMPLATE_ID={tasks[0].get('WORKFLOW_TEMPLATE_ID')}, WORKFLOW_STARTED={tasks[0].get('WORKFLOW_STARTED')}")
     
     # Получаем статистику из БД для БП "Дубли компании"
     db_stats = get_db_bp_stats()
-    print(f"[DEBUG] Статистика из БД: {db_stats}")
+    log('DEBUG', 'payload', lambda: f"Статистика из БД: {db_stats}")
     if db_stats:
-        print(f"[DEBUG] БД instances count: {len(db_stats.get('instances', []))}")
+        log('DEBUG', 'db', f"БД instances count: {len(db_stats.get('instances', []))}")
     
     # Находим реальный ID шаблона "Дубли компании" в Битрикс24
     duplicates_template_id = None
@@ -209,7 +241,7 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
         template_name = tdata.get('NAME', '').lower()
         if 'дубл' in template_name:
             duplicates_template_id = tid
-            print(f"[DEBUG] Используем реальный ID шаблона Дубли компании: {duplicates_template_id}")
+            log('DEBUG', 'flow', f"Используем реальный ID шаблона Дубли компании: {duplicates_template_id}")
             break
     
     # Считаем статистику запусков для каждого шаблона из instance.list
@@ -266,11 +298,11 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
             'instances': db_instances + existing_stats.get('instances', []),
             'db_duplicates_found': db_stats.get('duplicates_found', 0)
         }
-        print(f"[DEBUG] Добавлено {len(db_instances)} записей из БД для шаблона {duplicates_template_id}")
+        log('DEBUG', 'db', f"Добавлено {len(db_instances)} записей из БД для шаблона {duplicates_template_id}")
     
-    print(f"[DEBUG] Общая статистика по шаблонам: {template_stats}")
+    log('DEBUG', 'payload', lambda: f"Общая статистика по шаблонам: {template_stats}")
     for tid, stats in template_stats.items():
-        print(f"[DEBUG] Шаблон {tid}: {stats['total']} запусков, последний: {stats['last_started']}")
+        log('DEBUG', 'flow', f"Шаблон {tid}: {stats['total']} запусков, последний: {stats['last_started']}")
     
     # Формируем список всех шаблонов со статистикой
     logs = []
@@ -318,6 +350,6 @@ def get_timeline_logs(limit: int) -> List[Dict[str, Any]]:
             }
         logs.append(log)
     
-    print(f"[DEBUG] Сформировано логов: {len(logs)}")
+    log('DEBUG', 'flow', f"Сформировано логов: {len(logs)}")
     
     return logs
\ No newline at end of file
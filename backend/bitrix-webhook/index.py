@@ -1,12 +1,153 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
+import random
+import base64
+import hashlib
+import math
+import re
+import time
+from typing import Dict, Any, List, Optional, Callable, Tuple, Union
 from datetime import datetime, timezone, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import urllib.request
 import urllib.parse
 
+PARTITIONED_LOG_TABLES = ['webhook_logs', 'purchase_webhooks', 'deal_changes']
+
+# Размер страницы списочных методов Битрикс24 (он же размер листа при сверке зеркал)
+RECONCILE_PAGE_SIZE = 50
+
+# Организационно-правовые формы, которые отбрасываются при сравнении названий
+LEGAL_FORM_PHRASES = re.compile(
+    r'(общество с ограниченной ответственностью|(публичное |закрытое |открытое |непубличное )?акционерное общество'
+    r'|индивидуальный предприниматель|некоммерческая организация)'
+)
+LEGAL_FORM_WORDS = {'ооо', 'оао', 'зао', 'пао', 'нао', 'ао', 'ип', 'нко', 'ано', 'фгуп', 'гуп', 'муп', 'тоо', 'llc', 'ltd', 'inc'}
+NON_WORD_CHARS = re.compile(r'[\W_]+')
+NON_DIGIT_CHARS = re.compile(r'\D+')
+
+# Bloom-фильтр ИНН из локального зеркала companies, живёт между вызовами тёплого контейнера
+INN_FILTER: Dict[str, Any] = {
+    'bits': None,
+    'bits_count': 0,
+    'hashes_count': 0,
+    'capacity': 0,
+    'items': 0,
+    'watermark': None,
+    'built_at': None,
+    'refreshed_at': 0.0,
+    'lookups': 0,
+    'negatives': 0,
+    'negative_mismatches': 0
+}
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+# Строки моложе этого возраста курсор since_id не проходит (дольше длится транзакция записи - нужен больший запас)
+CURSOR_SETTLE_SECONDS = int(os.environ.get('CURSOR_SETTLE_SECONDS', '60'))
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+def parse_form_body(body: str) -> Dict[str, Any]:
+    '''
+    Разбор x-www-form-urlencoded тела Битрикс24 за один проход: PHP-ключи со скобками
+    (auth[domain], data[FIELDS][ID], document_id[], data[FIELDS][UF_LIST][0]) раскладываются
+    во вложенные dict/list. Повтор ключа без скобок перезаписывает значение (как в PHP),
+    числовые индексы по порядку дают list, пропуск индекса превращает list в dict.
+    Тело декодируется одним вызовом unquote_plus (закодированные & и = защищены маркерами;
+    если маркеры уже есть в теле - сырыми или как %00/%01 - разбор попарный),
+    контейнеры запоминаются по префиксу ключа: соседние поля data[FIELDS][...] пишутся без обхода пути
+    '''
+    escaped = '%26' in body or '%3D' in body or '%3d' in body
+    if '\x00' in body or '\x01' in body or '%00' in body or '%01' in body:
+        pairs = [tuple(urllib.parse.unquote_plus(part) for part in pair.partition('=')[::2]) for pair in body.split('&') if pair]
+        escaped = False
+    else:
+        if escaped:
+            body = body.replace('%26', '\x00').replace('%3D', '\x01').replace('%3d', '\x01')
+        pairs = [pair.partition('=')[::2] for pair in urllib.parse.unquote_plus(body).split('&') if pair]
+    
+    result: Dict[str, Any] = {}
+    containers: Dict[str, Dict[str, Any]] = {}
+    for key, value in pairs:
+        if escaped:
+            key = key.replace('\x00', '&').replace('\x01', '=')
+            value = value.replace('\x00', '&').replace('\x01', '=')
+        
+        if not key.endswith(']') or key.find('[') <= 0:
+            if key in result:
+                containers.clear()
+            result[key] = value
+            continue
+        
+        cut = key.rfind('[')
+        prefix, last = key[:cut], key[cut + 1:-1]
+        container = containers.get(prefix)
+        if container is not None and last and not last.isdigit() and not isinstance(container.get(last), (dict, list)):
+            container[last] = value
+            continue
+        
+        bracket = key.find('[')
+        node: Any = result
+        name = key[:bracket]
+        for segment in key[bracket + 1:-1].split(']['):
+            child = form_node_get(node, name)
+            if isinstance(child, list) and segment and not (segment.isdigit() and int(segment) <= len(child)):
+                child = {str(index): item for index, item in enumerate(child)}
+                form_node_set(node, name, child)
+                containers.clear()
+            elif not isinstance(child, (dict, list)):
+                child = [] if not segment or segment == '0' else {}
+                form_node_set(node, name, child)
+            node, name = child, segment
+        if isinstance(form_node_get(node, name), (dict, list)):
+            containers.clear()
+        form_node_set(node, name, value)
+        if isinstance(node, dict) and '[]' not in prefix:
+            containers[prefix] = node
+    
+    return result
+
+def form_node_get(node: Any, name: str) -> Any:
+    '''Элемент контейнера по сегменту ключа; "[]" всегда создаёт новый элемент'''
+    if isinstance(node, list):
+        return node[int(name)] if name and int(name) < len(node) else None
+    return node.get(name)
+
+def form_node_set(node: Any, name: str, value: Any) -> None:
+    '''Запись в контейнер по сегменту ключа: в list - добавление в конец или замена по индексу'''
+    if isinstance(node, list):
+        if not name or int(name) == len(node):
+            node.append(value)
+        else:
+            node[int(name)] = value
+    else:
+        node[name] = value
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Обрабатывает вебхуки из Битрикс24, проверяет дубликаты ИНН и удаляет последние записи
@@ -52,26 +193,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         source_info = f"IP: {source_ip} | UA: {user_agent[:100]}"
         
         if method == 'DELETE':
-            cur.execute("DELETE FROM webhook_logs")
-            deleted_count = cur.rowcount
+            # TRUNCATE всех секций; точное число строк потребовало бы полного сканирования - не считаем
+            cur.execute("TRUNCATE webhook_logs")
+            cur.execute("DELETE FROM webhook_stats_daily")
             conn.commit()
             return response_json(200, {
                 'success': True,
-                'message': f'Deleted {deleted_count} log entries',
-                'deleted_count': deleted_count
+                'message': 'All log entries deleted'
             })
         
         if method == 'POST':
             body_str = event.get('body', '{}')
             if not body_str or body_str.strip() == '':
                 body_str = '{}'
-            body_data = json.loads(body_str)
+            content_type = headers.get('Content-Type', headers.get('content-type', ''))
+            if 'application/x-www-form-urlencoded' in content_type:
+                # Исходящий вебхук/робот Битрикс24: PHP-ключи auth[...], document_id[] - во вложенные dict/list
+                if event.get('isBase64Encoded', False):
+                    body_str = base64.b64decode(body_str).decode('utf-8')
+                body_data = parse_form_body(body_str)
+            else:
+                body_data = json.loads(body_str)
             bitrix_id: str = body_data.get('bitrix_id', '').strip()
             
             # Проверяем, если это запрос на авторизацию
             action = body_data.get('action', '')
-            print(f"[DEBUG] POST body_data: {body_data}")
-            print(f"[DEBUG] action: {action}")
+            log('DEBUG', 'payload', lambda: f"POST body_data: {body_data}")
+            log('DEBUG', 'flow', f"action: {action}")
             
             if action == 'login':
                 username = body_data.get('username', '').strip()
@@ -82,8 +230,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
                 
                 if username == admin_username and password == admin_password:
-                    import hashlib
-                    import time
                     token = hashlib.sha256(f"{username}{time.time()}".encode()).hexdigest()
                     
                     return response_json(200, {
@@ -98,13 +244,37 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     })
             
             if action == 'restore':
-                original_data = body_data.get('original_data', {})
-                print(f"[DEBUG] Restoring company with data: {original_data}")
-                restore_result = restore_deleted_company(original_data)
-                print(f"[DEBUG] Restore result: {restore_result}")
+                # Снимок берётся из каталога по catalog_id (или по ID лога удаления);
+                # original_data - старый формат, когда снимок присылал браузер
+                catalog_entry = None
+                if body_data.get('catalog_id') or body_data.get('log_id'):
+                    if not str(body_data.get('catalog_id') or body_data.get('log_id')).strip().isdigit():
+                        return response_json(400, {'success': False, 'error': 'catalog_id и log_id должны быть числами'})
+                    # Запись каталога блокируется до коммита: параллельное восстановление ждёт
+                    # и видит restored_at, вторая компания в Битрикс24 не создаётся
+                    catalog_entry = get_deleted_company(cur, body_data.get('catalog_id'), body_data.get('log_id'), lock=True)
+                    if not catalog_entry:
+                        return response_json(404, {'success': False, 'error': 'Удалённая компания не найдена в каталоге'})
+                    if catalog_entry['restored_at']:
+                        return response_json(409, {
+                            'success': False,
+                            'error': f"Компания уже восстановлена с ID {catalog_entry['restored_company_id']}"
+                        })
+                    original_data = catalog_entry['snapshot']
+                else:
+                    original_data = body_data.get('original_data', {})
+                
+                log('DEBUG', 'flow', lambda: f"Restoring company with data: {original_data}")
+                restore_result = restore_deleted_company(original_data, cur)
+                log('DEBUG', 'flow', lambda: f"Restore result: {restore_result}")
                 
                 if restore_result.get('success'):
-                    log_webhook(cur, 'restore_company', original_data.get('inn', ''), restore_result.get('company_id', ''), body_data, 'success', False, f"Company restored: {restore_result.get('company_id')}", source_info, method)
+                    if catalog_entry:
+                        cur.execute(
+                            "UPDATE deleted_companies SET restored_at = CURRENT_TIMESTAMP, restored_company_id = %s WHERE id = %s",
+                            (restore_result.get('company_id'), catalog_entry['id'])
+                        )
+                    log_webhook(cur, 'restore_company', original_data.get('RQ_INN', original_data.get('inn', '')), restore_result.get('company_id', ''), body_data, 'success', False, f"Company restored: {restore_result.get('company_id')}", source_info, method)
                     conn.commit()
                     return response_json(200, {
                         'success': True,
@@ -112,13 +282,75 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'company_id': restore_result.get('company_id')
                     })
                 else:
-                    log_webhook(cur, 'restore_company', original_data.get('inn', ''), '', body_data, 'error', False, f"Failed to restore: {restore_result.get('error')}", source_info, method)
+                    log_webhook(cur, 'restore_company', original_data.get('RQ_INN', original_data.get('inn', '')), '', body_data, 'error', False, f"Failed to restore: {restore_result.get('error')}", source_info, method)
                     conn.commit()
                     return response_json(400, {
                         'success': False,
                         'error': restore_result.get('error')
                     })
             
+            # Пересборка дневных счётчиков статистики из webhook_logs
+            if action == 'rebuild_stats':
+                days_count = rebuild_webhook_stats(cur)
+                conn.commit()
+                return response_json(200, {
+                    'success': True,
+                    'rows_rebuilt': days_count,
+                    'stats': get_webhook_stats(cur)
+                })
+            
+            # Дайджест уведомлений о компаниях без ИНН (вызывается по расписанию)
+            if action == 'send_inn_digest':
+                digest_result = send_missing_inn_digest(cur, force=True)
+                conn.commit()
+                return response_json(200 if digest_result.get('success') else 400, digest_result)
+            
+            # Обслуживание секций журналов: создание будущих месяцев и удаление устаревших
+            if action == 'maintain_partitions':
+                retention_months = int(body_data.get('retention_months', os.environ.get('LOG_RETENTION_MONTHS', '12')))
+                maintenance_result = maintain_log_partitions(cur, retention_months)
+                conn.commit()
+                return response_json(200, {
+                    'success': True,
+                    'retention_months': retention_months,
+                    **maintenance_result
+                })
+            
+            # Пакет событий компаний из очереди event.offline.get (bitrix-event-pull):
+            # проверка ИНН по каждой компании, результат - по ключу события
+            if action == 'process_events':
+                results = []
+                for item in body_data.get('events', []):
+                    company_id = str(item.get('id', '')).strip()
+                    try:
+                        check_response = check_company_inn(
+                            cur, conn, company_id,
+                            {'bitrix_id': company_id, 'event': item.get('event', ''), 'source': 'offline_queue'},
+                            source_info, method
+                        )
+                        check_body = json.loads(check_response['body'])
+                        # 404 - компания уже удалена, skip_log - тестовый ID: событие обработано, повтор не нужен
+                        processed = check_response['statusCode'] in (200, 404) or bool(check_body.get('skip_log'))
+                        results.append({'key': item.get('key'), 'success': processed, 'error': None if processed else check_body.get('error')})
+                    except Exception as e:
+                        conn.rollback()
+                        log('ERROR', 'flow', f"Event {item.get('key')} failed: {type(e).__name__}: {str(e)}")
+                        results.append({'key': item.get('key'), 'success': False, 'error': str(e)})
+                
+                return response_json(200, {'success': True, 'results': results})
+            
+            # Сверка зеркал companies/requisites/deals с Битрикс24 (вызывается по расписанию)
+            if action == 'reconcile_mirrors':
+                entities = body_data.get('entities') or list(RECONCILE_ENTITIES.keys())
+                unknown = [entity for entity in entities if entity not in RECONCILE_ENTITIES]
+                if unknown:
+                    return response_json(400, {'success': False, 'error': f"Неизвестные зеркала: {', '.join(unknown)}"})
+                
+                max_calls = int(body_data.get('max_calls', os.environ.get('RECONCILE_MAX_CALLS', '150')))
+                reconcile_result = reconcile_mirrors(cur, entities, max_calls)
+                conn.commit()
+                return response_json(200, {'success': True, **reconcile_result})
+            
             # Проверяем, если это запрос на очистку мусорных реквизитов
             if action == 'clean_orphans':
                 inn_to_clean = body_data.get('inn', '').strip()
@@ -155,6 +387,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'message': f"Удалено компаний: {delete_result.get('deleted_count', 0)}"
                 })
             
+            # Массовая проверка: список ID компаний и/или ИНН (импорт из таблиц и 1С)
+            if action == 'bulk_check':
+                company_ids = [str(item).strip() for item in body_data.get('company_ids', []) if str(item).strip()]
+                inns = [str(item).strip() for item in body_data.get('inns', []) if str(item).strip()]
+                max_items = int(os.environ.get('BULK_CHECK_MAX_ITEMS', '5000'))
+                
+                if not company_ids and not inns:
+                    return response_json(400, {'success': False, 'error': 'Не указаны company_ids или inns'})
+                if len(company_ids) + len(inns) > max_items:
+                    return response_json(400, {'success': False, 'error': f'Не больше {max_items} элементов за запрос'})
+                
+                bulk_result = bulk_check_companies(cur, company_ids, inns)
+                conn.commit()
+                
+                # Для больших списков - NDJSON: строка на элемент, последняя строка - итог
+                ndjson_threshold = int(os.environ.get('BULK_NDJSON_THRESHOLD', '500'))
+                if body_data.get('format') == 'ndjson' or (body_data.get('format') != 'json' and len(bulk_result['items']) > ndjson_threshold):
+                    return response_ndjson(200, bulk_result['items'] + [{'summary': bulk_result['summary']}])
+                
+                return response_json(200, {'success': True, **bulk_result})
+            
         elif method == 'GET':
             query_params = event.get('queryStringParameters', {}) or {}
             
@@ -171,266 +424,914 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'result': diagnostic_result
                 })
             
+            # Поиск по журналу: компания, ИНН, тип, событие, вхождение JSON в request_body
+            if action == 'search_logs':
+                contains = query_params.get('contains', '').strip()
+                if contains:
+                    try:
+                        if not isinstance(json.loads(contains), (dict, list)):
+                            raise ValueError('contains must be a JSON object or array')
+                    except ValueError as e:
+                        return response_json(400, {'success': False, 'error': f'Некорректный contains: {e}'})
+                
+                found_logs = search_webhook_logs(
+                    cur,
+                    company_id=query_params.get('company_id', '').strip(),
+                    inn=query_params.get('inn', '').strip(),
+                    webhook_type=query_params.get('webhook_type', '').strip(),
+                    event_name=query_params.get('event', '').strip(),
+                    contains=contains,
+                    limit=min(int(query_params.get('limit', '100')), 500)
+                )
+                return response_json(200, {
+                    'success': True,
+                    'logs': [serialize_log(row) for row in found_logs],
+                    'total': len(found_logs)
+                })
+            
+            # Каталог удалённых компаний: поиск по ИНН/названию, постранично
+            if action == 'deleted_companies':
+                return response_json(200, {
+                    'success': True,
+                    **search_deleted_companies(
+                        cur,
+                        query_params.get('search', '').strip(),
+                        min(int(query_params.get('limit', '50')), 200),
+                        int(query_params.get('offset', '0'))
+                    )
+                })
+            
+            # Метрики фильтра ИНН: размер, память, оценка доли ложноположительных
+            if action == 'inn_filter_stats':
+                ensure_inn_filter(cur)
+                return response_json(200, {
+                    'success': True,
+                    'inn_filter': inn_filter_metrics()
+                })
+            
             bitrix_id: str = query_params.get('bitrix_id', query_params.get('id', '')).strip()
             body_data = {'bitrix_id': bitrix_id, 'method': 'GET'}
         else:
             return response_json(405, {'error': 'Method not allowed'})
         
         if not bitrix_id:
-            cur.execute("SELECT * FROM webhook_logs ORDER BY created_at DESC LIMIT 100")
-            logs = cur.fetchall()
-            
-            cur.execute("""
-                SELECT 
-                    COALESCE(COUNT(*), 0) as total_requests,
-                    COALESCE(SUM(CASE WHEN duplicate_found = true THEN 1 ELSE 0 END), 0) as duplicates_found,
-                    COALESCE(SUM(CASE WHEN response_status = 'success' THEN 1 ELSE 0 END), 0) as successful
-                FROM webhook_logs
-            """)
-            stats_row = cur.fetchone()
-            stats = dict(stats_row) if stats_row else {'total_requests': 0, 'duplicates_found': 0, 'successful': 0}
+            # since_id/since_ts - только новые записи после курсора (опрос дашборда)
+            since_id = query_params.get('since_id', '') if method == 'GET' else ''
+            since_ts = query_params.get('since_ts', '') if method == 'GET' else ''
+            settled_sql = "*, created_at < NOW() - make_interval(secs => %s) AS settled"
+            if since_id.isdigit():
+                # По возрастанию id: при переполнении страницы следующий опрос продолжит с курсора
+                cur.execute(f"SELECT {settled_sql} FROM webhook_logs WHERE id > %s ORDER BY id ASC LIMIT 100", (CURSOR_SETTLE_SECONDS, int(since_id)))
+            elif since_ts:
+                cur.execute(
+                    f"SELECT {settled_sql} FROM webhook_logs WHERE (created_at, id) > (%s::timestamp, %s) ORDER BY created_at ASC, id ASC LIMIT 100",
+                    (CURSOR_SETTLE_SECONDS, *parse_since_ts(since_ts))
+                )
+            else:
+                cur.execute(f"SELECT {settled_sql} FROM webhook_logs ORDER BY created_at DESC LIMIT 100", (CURSOR_SETTLE_SECONDS,))
+            logs = [dict(log) for log in cur.fetchall()]
+            next_id = next_since_id(logs, since_id)
+            next_ts = next_since_ts(logs, 'created_at', since_ts)
+            if since_id.isdigit() or since_ts:
+                logs.reverse()
+            for row in logs:
+                row.pop('settled', None)
             
-            return response_json(200, {
+            response_data: Dict[str, Any] = {
                 'logs': [serialize_log(log) for log in logs] if logs else [],
-                'stats': stats
-            })
+                'has_more': bool(since_id.isdigit() or since_ts) and len(logs) == 100,
+                'cursor': {
+                    'since_id': next_id,
+                    'since_ts': next_ts
+                },
+                'incremental': bool(since_id.isdigit() or since_ts)
+            }
+            
+            # Без новых записей счётчики не изменились - не пересылаем их
+            if logs or not response_data['incremental']:
+                response_data['stats'] = get_webhook_stats(cur)
             
-        # Проверка на тестовые/невалидные ID (999999 и подобные)
-        if bitrix_id in ['999999', '0', ''] or not bitrix_id.isdigit():
-            error_msg = f"Invalid or test company ID: {bitrix_id}"
-            print(f"[DEBUG] Skipping invalid company ID: {bitrix_id}")
-            # Не логируем тестовые запросы как ошибки
-            return response_json(400, {
-                'error': error_msg,
-                'skip_log': True,
-                'message': 'Test or invalid company ID'
+            return response_json(200, response_data)
+            
+        return check_company_inn(cur, conn, bitrix_id, body_data, source_info, method)
+    
+    finally:
+        cur.close()
+        conn.close()
+    
+    return response_json(405, {'error': 'Method not allowed'})
+
+def check_company_inn(cur, conn, bitrix_id: str, body_data: Dict[str, Any], source_info: str, method: str) -> Dict[str, Any]:
+    '''
+    Проверка компании на дубль ИНН (вебхук ONCRMCOMPANYADD/UPDATE или событие из очереди):
+    компания без ИНН - задача ответственному, дубль - удаление новой компании со снимком в каталог.
+    Возвращает HTTP-ответ; транзакция фиксируется внутри
+    '''
+    # Проверка на тестовые/невалидные ID (999999 и подобные)
+    if bitrix_id in ['999999', '0', ''] or not bitrix_id.isdigit():
+        error_msg = f"Invalid or test company ID: {bitrix_id}"
+        log('DEBUG', 'flow', f"Skipping invalid company ID: {bitrix_id}")
+        # Не логируем тестовые запросы как ошибки
+        return response_json(400, {
+            'error': error_msg,
+            'skip_log': True,
+            'message': 'Test or invalid company ID'
+        })
+    
+    company_data = get_bitrix_company(bitrix_id, cur)
+    
+    if not company_data.get('success'):
+        error_msg = f"Failed to get company data: {company_data.get('error')}"
+        
+        # Если компания не найдена (404/Not found) - это нормально, не логируем как ошибку
+        if 'Not found' in error_msg or 'HTTP 400' in error_msg:
+            log('DEBUG', 'bitrix', f"Company {bitrix_id} not found in Bitrix24 (deleted or test)")
+            return response_json(404, {
+                'error': 'Company not found',
+                'message': 'Company may have been deleted or does not exist'
             })
         
-        company_data = get_bitrix_company(bitrix_id)
+        # Только реальные ошибки API логируем
+        log_webhook(cur, 'check_inn', '', bitrix_id, body_data, 'error', False, error_msg, source_info, method)
+        conn.commit()
+        return response_json(400, {'error': error_msg})
+    
+    company_info = company_data.get('company', {})
+    inn: str = company_info.get('RQ_INN', '').strip()
+    title: str = company_info.get('TITLE', '')
+    
+    if not inn:
+        action_msg = 'Company has no INN'
         
-        if not company_data.get('success'):
-            error_msg = f"Failed to get company data: {company_data.get('error')}"
-            
-            # Если компания не найдена (404/Not found) - это нормально, не логируем как ошибку
-            if 'Not found' in error_msg or 'HTTP 400' in error_msg:
-                print(f"[DEBUG] Company {bitrix_id} not found in Bitrix24 (deleted or test)")
-                return response_json(404, {
-                    'error': 'Company not found',
-                    'message': 'Company may have been deleted or does not exist'
-                })
-            
-            # Только реальные ошибки API логируем
-            log_webhook(cur, 'check_inn', '', bitrix_id, body_data, 'error', False, error_msg, source_info, method)
-            conn.commit()
-            return response_json(400, {'error': error_msg})
+        # Одна открытая задача на компанию, уведомление автору - в дайджесте
+        task_result = ensure_missing_inn_task(cur, bitrix_id, title, company_info)
+        if task_result.get('existing'):
+            action_msg += f" | Open task already exists: {task_result.get('task_id')}"
+            response_msg = 'Company has no INN, open task already exists'
+        elif task_result.get('success'):
+            action_msg += f" | Task created: {task_result.get('task_id')}"
+            response_msg = 'Company has no INN, task created for responsible user'
+            send_missing_inn_digest(cur)
+        else:
+            action_msg += f" | Failed to create task: {task_result.get('error')}"
+            response_msg = 'Company has no INN, failed to create task'
         
-        company_info = company_data.get('company', {})
-        inn: str = company_info.get('RQ_INN', '').strip()
-        title: str = company_info.get('TITLE', '')
+        # Компания без ИНН тоже попадает в зеркало - по ней работает нечёткий поиск дублей
+        save_company_mirror(cur, bitrix_id, '', title, company_info)
+        log_webhook(cur, 'check_inn', '', bitrix_id, body_data, 'no_inn', False, action_msg, source_info, method)
+        conn.commit()
+        return response_json(200, {
+            'duplicate': False, 
+            'message': response_msg,
+            'task_created': task_result.get('success', False) and not task_result.get('existing', False),
+            'task_existing': task_result.get('existing', False),
+            'task_id': task_result.get('task_id')
+        })
+    
+    # ИНН заполнен - закрываем задачу "Заполнить ИНН", если она была
+    close_missing_inn_task(cur, bitrix_id)
+    
+    # Быстрый ответ по фильтру: ИНН точно нет в локальном зеркале компаний.
+    # Без INN_FILTER_TRUSTED=1 (зеркало может быть неполным) фильтр работает в теневом режиме
+    ensure_inn_filter(cur)
+    inn_maybe_known = inn_filter_might_contain(inn)
+    if not inn_maybe_known and os.environ.get('INN_FILTER_TRUSTED', '') == '1':
+        save_company_mirror(cur, bitrix_id, inn, title, company_info)
+        log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'success', False, 'No duplicate (INN filter: definitely unique), company saved', source_info, method)
+        conn.commit()
         
-        if not inn:
-            action_msg = 'Company has no INN'
-            
-            # Создаём задачу и отправляем уведомление автору
-            task_result = create_task_for_missing_inn(bitrix_id, title, company_info)
-            if task_result.get('success'):
-                action_msg += f" | Task created: {task_result.get('task_id')}"
-            else:
-                action_msg += f" | Failed to create task: {task_result.get('error')}"
-            
-            log_webhook(cur, 'check_inn', '', bitrix_id, body_data, 'no_inn', False, action_msg, source_info, method)
-            conn.commit()
-            return response_json(200, {
-                'duplicate': False, 
-                'message': 'Company has no INN, task created for responsible user',
-                'task_created': task_result.get('success', False),
-                'task_id': task_result.get('task_id')
-            })
+        return response_json(200, {
+            'duplicate': False,
+            'inn': inn,
+            'bitrix_id': bitrix_id,
+            'inn_filter': 'definitely_unique',
+            'message': 'ИНН уникален, компания сохранена'
+        })
+    
+    search_result = find_duplicate_companies_by_inn(inn)
+    
+    # Подробная информация о поиске для отображения в дашборде
+    search_details = {
+        'search_success': search_result.get('success'),
+        'total_found': len(search_result.get('companies', [])),
+        'found_companies': search_result.get('companies', []),
+        'search_method': 'crm.company.list with filter[RQ_INN]',
+        'inn_searched': inn
+    }
+    
+    if search_result.get('success') and len(search_result.get('companies', [])) > 0:
+        bitrix_companies = search_result['companies']
+        
+        log('DEBUG', 'flow', f"Found {len(bitrix_companies)} companies with INN {inn}")
+        log('DEBUG', 'flow', lambda: f"Company IDs: {[c['ID'] for c in bitrix_companies]}")
+        log('DEBUG', 'flow', f"Current company ID: {bitrix_id}")
         
-        search_result = find_duplicate_companies_by_inn(inn)
+        # КРИТИЧНО: Отфильтровываем текущую компанию из списка найденных
+        # Сравниваем как строки, т.к. ID из Битрикс может быть строкой
+        existing_ids = [c['ID'] for c in bitrix_companies if str(c['ID']) != str(bitrix_id)]
         
-        # Подробная информация о поиске для отображения в дашборде
-        search_details = {
-            'search_success': search_result.get('success'),
-            'total_found': len(search_result.get('companies', [])),
-            'found_companies': search_result.get('companies', []),
-            'search_method': 'crm.company.list with filter[RQ_INN]',
-            'inn_searched': inn
+        search_details['other_companies_count'] = len(existing_ids)
+        search_details['other_companies_ids'] = existing_ids
+        search_details['current_company_id'] = bitrix_id
+        search_details['comparison_details'] = {
+            'bitrix_id': bitrix_id,
+            'bitrix_id_type': str(type(bitrix_id).__name__),
+            'found_ids_with_types': [{'id': c['ID'], 'type': str(type(c['ID']).__name__), 'title': c.get('TITLE', 'N/A')} for c in bitrix_companies]
         }
         
-        if search_result.get('success') and len(search_result.get('companies', [])) > 0:
-            bitrix_companies = search_result['companies']
-            
-            print(f"[DEBUG] Found {len(bitrix_companies)} companies with INN {inn}")
-            print(f"[DEBUG] Company IDs: {[c['ID'] for c in bitrix_companies]}")
-            print(f"[DEBUG] Current company ID: {bitrix_id}")
-            
-            # КРИТИЧНО: Отфильтровываем текущую компанию из списка найденных
-            # Сравниваем как строки, т.к. ID из Битрикс может быть строкой
-            existing_ids = [c['ID'] for c in bitrix_companies if str(c['ID']) != str(bitrix_id)]
-            
-            search_details['other_companies_count'] = len(existing_ids)
-            search_details['other_companies_ids'] = existing_ids
-            search_details['current_company_id'] = bitrix_id
-            search_details['comparison_details'] = {
-                'bitrix_id': bitrix_id,
-                'bitrix_id_type': str(type(bitrix_id).__name__),
-                'found_ids_with_types': [{'id': c['ID'], 'type': str(type(c['ID']).__name__), 'title': c.get('TITLE', 'N/A')} for c in bitrix_companies]
-            }
-            
-            print(f"[DEBUG] Other company IDs (excluding current): {existing_ids}")
-            print(f"[DEBUG] Total companies found: {len(bitrix_companies)}, Others: {len(existing_ids)}")
-            print(f"[DEBUG] Comparison: bitrix_id={bitrix_id} (type: {type(bitrix_id)})")
-            print(f"[DEBUG] All found IDs: {[(c['ID'], type(c['ID'])) for c in bitrix_companies]}")
-            
-            # Дубликат ТОЛЬКО если найдены ДРУГИЕ компании (не текущая)
-            if len(existing_ids) == 0:
-                # Найдена только текущая компания - НЕ дубликат
-                action_msg = f"Only current company {bitrix_id} found with INN {inn}, not a duplicate (total: {len(bitrix_companies)})"
-                action_msg += f" | Search details: {json.dumps(search_details, ensure_ascii=False)}"
-                print(f"[DEBUG] {action_msg}")
-                
-                # Добавляем детали поиска в request_body для отображения в дашборде
-                body_data_with_search = body_data.copy()
-                body_data_with_search['search_details'] = search_details
-                
-                log_webhook(cur, 'check_inn', inn, bitrix_id, body_data_with_search, 'success', False, action_msg, source_info, method)
-                
-                cur.execute(
-                    "INSERT INTO companies (bitrix_id, inn, title) VALUES (%s, %s, %s) ON CONFLICT (bitrix_id) DO UPDATE SET inn = EXCLUDED.inn, title = EXCLUDED.title, updated_at = CURRENT_TIMESTAMP",
-                    (bitrix_id, inn, title)
-                )
-                conn.commit()
-                
-                return response_json(200, {
-                    'duplicate': False,
-                    'inn': inn,
-                    'bitrix_id': bitrix_id,
-                    'message': 'ИНН уникален, компания сохранена'
-                })
-            
-            # Найдены другие компании с таким же ИНН - это дубликат
-            old_company_id = existing_ids[0]
-            other_companies_info = [{'id': c['ID'], 'title': c.get('TITLE', 'N/A'), 'date_create': c.get('DATE_CREATE', 'N/A')} 
-                                   for c in bitrix_companies if str(c['ID']) != str(bitrix_id)]
-            
-            action_taken = f"Duplicate INN found! Existing: {old_company_id} | Other companies: {json.dumps(other_companies_info, ensure_ascii=False)}"
-            deleted = False
-            
-            search_details['duplicate_detected'] = True
-            search_details['existing_company_id'] = old_company_id
-            search_details['other_companies_full'] = other_companies_info
-            
-            print(f"[DEBUG] Duplicate detected! Current: {bitrix_id}, Existing: {old_company_id}")
-            print(f"[DEBUG] Other companies: {other_companies_info}")
-            
-            # КРИТИЧНО: Проверяем что старая компания РЕАЛЬНО существует в Битриксе прямо сейчас
-            old_company_exists = False
-            try:
-                old_company_check = get_bitrix_company(old_company_id)
-                if old_company_check.get('success') and old_company_check.get('company'):
-                    old_company_exists = True
-                    print(f"[DEBUG] Old company {old_company_id} verified - exists in Bitrix")
-                else:
-                    print(f"[DEBUG] Old company {old_company_id} NOT found in Bitrix - will NOT delete new company")
-            except Exception as e:
-                print(f"[DEBUG] Error checking old company {old_company_id}: {e}")
+        log('DEBUG', 'flow', lambda: f"Other company IDs (excluding current): {existing_ids}")
+        log('DEBUG', 'flow', f"Total companies found: {len(bitrix_companies)}, Others: {len(existing_ids)}")
+        log('DEBUG', 'flow', f"Comparison: bitrix_id={bitrix_id} (type: {type(bitrix_id)})")
+        log('DEBUG', 'flow', lambda: f"All found IDs: {[(c['ID'], type(c['ID'])) for c in bitrix_companies]}")
+        
+        if existing_ids and not inn_maybe_known:
+            # Фильтр сказал "уникален", а в Битрикс24 есть другие компании - зеркало неполное
+            INN_FILTER['negative_mismatches'] += 1
+        
+        # Дубликат ТОЛЬКО если найдены ДРУГИЕ компании (не текущая)
+        if len(existing_ids) == 0:
+            # Найдена только текущая компания - НЕ дубликат
+            action_msg = f"Only current company {bitrix_id} found with INN {inn}, not a duplicate (total: {len(bitrix_companies)})"
+            action_msg += f" | Search details: {json.dumps(search_details, ensure_ascii=False)}"
+            log('DEBUG', 'flow', action_msg)
             
-            # Только если старая компания существует - удаляем новую
-            if not old_company_exists:
-                action_taken = f"Duplicate INN, but old company {old_company_id} doesn't exist - keeping new company {bitrix_id}"
-                print(f"[DEBUG] {action_taken}")
-                
-                log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'duplicate_but_old_missing', False, action_taken, source_info, method)
-                conn.commit()
-                
-                return response_json(200, {
-                    'duplicate': False,
-                    'inn': inn,
-                    'new_company_id': bitrix_id,
-                    'old_company_missing': True,
-                    'old_company_id': old_company_id,
-                    'message': action_taken
-                })
+            # Добавляем детали поиска в request_body для отображения в дашборде
+            body_data_with_search = body_data.copy()
+            body_data_with_search['search_details'] = search_details
             
-            # КРИТИЧНО: Сохраняем ПОЛНЫЙ объект компании со ВСЕМИ полями
-            # company_info уже содержит ВСЕ поля + дела (добавлены в get_bitrix_company)
-            company_backup = dict(company_info)
-            company_backup['ID'] = bitrix_id  # Сохраняем оригинальный ID
-            company_backup['bitrix_id'] = bitrix_id  # Дублируем для совместимости
+            log_webhook(cur, 'check_inn', inn, bitrix_id, body_data_with_search, 'success', False, action_msg, source_info, method)
             
-            print(f"[DEBUG] Company backup created with {len(company_backup)} fields")
-            print(f"[DEBUG] Deals in backup: {len(company_backup.get('DEALS', []))} deals")
+            save_company_mirror(cur, bitrix_id, inn, title, company_info)
+            conn.commit()
             
-            delete_result = delete_bitrix_company(bitrix_id)
-            if delete_result.get('success'):
-                action_taken = f"Auto-deleted NEW duplicate company {bitrix_id} (INN already exists in {old_company_id})"
-                deleted = True
+            return response_json(200, {
+                'duplicate': False,
+                'inn': inn,
+                'bitrix_id': bitrix_id,
+                'message': 'ИНН уникален, компания сохранена'
+            })
+        
+        # Найдены другие компании с таким же ИНН - это дубликат
+        old_company_id = existing_ids[0]
+        other_companies_info = [{'id': c['ID'], 'title': c.get('TITLE', 'N/A'), 'date_create': c.get('DATE_CREATE', 'N/A')} 
+                               for c in bitrix_companies if str(c['ID']) != str(bitrix_id)]
+        
+        action_taken = f"Duplicate INN found! Existing: {old_company_id} | Other companies: {json.dumps(other_companies_info, ensure_ascii=False)}"
+        deleted = False
+        
+        search_details['duplicate_detected'] = True
+        search_details['existing_company_id'] = old_company_id
+        search_details['other_companies_full'] = other_companies_info
+        
+        log('DEBUG', 'flow', f"Duplicate detected! Current: {bitrix_id}, Existing: {old_company_id}")
+        log('DEBUG', 'flow', lambda: f"Other companies: {other_companies_info}")
+        
+        # КРИТИЧНО: Проверяем что старая компания РЕАЛЬНО существует в Битриксе прямо сейчас
+        old_company_exists = False
+        try:
+            old_company_check = get_bitrix_company(old_company_id, cur, with_deals=False)
+            if old_company_check.get('success') and old_company_check.get('company'):
+                old_company_exists = True
+                log('DEBUG', 'bitrix', f"Old company {old_company_id} verified - exists in Bitrix")
             else:
-                action_taken = f"Failed to delete new company {bitrix_id}: {delete_result.get('error')}"
-            
-            # Сохраняем данные для восстановления в request_body
-            body_data_with_backup = body_data.copy()
-            body_data_with_backup['deleted_company_data'] = company_backup
+                log('DEBUG', 'bitrix', f"Old company {old_company_id} NOT found in Bitrix - will NOT delete new company")
+        except Exception as e:
+            log('WARN', 'flow', f"Error checking old company {old_company_id}: {e}")
+        
+        # Только если старая компания существует - удаляем новую
+        if not old_company_exists:
+            action_taken = f"Duplicate INN, but old company {old_company_id} doesn't exist - keeping new company {bitrix_id}"
+            log('DEBUG', 'flow', action_taken)
             
-            log_webhook(cur, 'check_inn', inn, bitrix_id, body_data_with_backup, 'duplicate_found', True, action_taken, source_info, method)
+            log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'duplicate_but_old_missing', False, action_taken, source_info, method)
             conn.commit()
             
             return response_json(200, {
-                'duplicate': True,
+                'duplicate': False,
                 'inn': inn,
                 'new_company_id': bitrix_id,
-                'existing_company_id': old_company_id,
-                'bitrix_companies': bitrix_companies,
-                'action': 'deleted' if deleted else 'delete_failed',
-                'deleted': deleted,
-                'message': action_taken,
-                'company_backup': company_backup
+                'old_company_missing': True,
+                'old_company_id': old_company_id,
+                'message': action_taken
             })
         
-        cur.execute(
-            "INSERT INTO companies (bitrix_id, inn, title) VALUES (%s, %s, %s) ON CONFLICT (bitrix_id) DO UPDATE SET inn = EXCLUDED.inn, title = EXCLUDED.title, updated_at = CURRENT_TIMESTAMP",
-            (bitrix_id, inn, title)
-        )
+        # КРИТИЧНО: Сохраняем ПОЛНЫЙ объект компании со ВСЕМИ полями
+        # company_info уже содержит ВСЕ поля + дела (добавлены в get_bitrix_company)
+        company_backup = dict(company_info)
+        company_backup['ID'] = bitrix_id  # Сохраняем оригинальный ID
+        company_backup['bitrix_id'] = bitrix_id  # Дублируем для совместимости
+        
+        log('DEBUG', 'flow', f"Company backup created with {len(company_backup)} fields")
+        log('DEBUG', 'flow', f"Deals in backup: {len(company_backup.get('DEALS', []))} deals")
+        
+        delete_result = delete_bitrix_company(bitrix_id)
+        if delete_result.get('success'):
+            action_taken = f"Auto-deleted NEW duplicate company {bitrix_id} (INN already exists in {old_company_id})"
+            deleted = True
+        else:
+            action_taken = f"Failed to delete new company {bitrix_id}: {delete_result.get('error')}"
         
-        log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'success', False, 'No duplicate, company saved', source_info, method)
+        log_id = log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'duplicate_found', True, action_taken, source_info, method)
+        
+        # Снимок для восстановления - в каталог удалённых компаний (не в request_body лога)
+        catalog_id = None
+        if deleted:
+            cur.execute(
+                """
+                INSERT INTO deleted_companies (bitrix_id, inn, title, existing_company_id, webhook_log_id, snapshot)
+                VALUES (%s, %s, %s, %s, %s, %s::jsonb)
+                RETURNING id
+                """,
+                (bitrix_id, inn, title, str(old_company_id), log_id, json.dumps(company_backup, ensure_ascii=False))
+            )
+            catalog_id = cur.fetchone()['id']
         conn.commit()
         
         return response_json(200, {
-            'duplicate': False,
+            'duplicate': True,
             'inn': inn,
-            'bitrix_id': bitrix_id,
-            'message': 'ИНН уникален, компания сохранена'
+            'new_company_id': bitrix_id,
+            'existing_company_id': old_company_id,
+            'bitrix_companies': bitrix_companies,
+            'action': 'deleted' if deleted else 'delete_failed',
+            'deleted': deleted,
+            'message': action_taken,
+            'deleted_company_id': catalog_id
         })
     
-    finally:
-        cur.close()
-        conn.close()
+    save_company_mirror(cur, bitrix_id, inn, title, company_info)
     
-    return response_json(405, {'error': 'Method not allowed'})
+    log_webhook(cur, 'check_inn', inn, bitrix_id, body_data, 'success', False, 'No duplicate, company saved', source_info, method)
+    conn.commit()
+    
+    return response_json(200, {
+        'duplicate': False,
+        'inn': inn,
+        'bitrix_id': bitrix_id,
+        'message': 'ИНН уникален, компания сохранена'
+    })
+
+def log_webhook(cur, webhook_type: str, inn: str, bitrix_id: str, request_body: Dict, status: str, duplicate: bool, action: str, source_info: str = '', method: str = 'POST') -> int:
+    cur.execute(
+        "INSERT INTO webhook_logs (webhook_type, inn, bitrix_company_id, request_body, response_status, duplicate_found, action_taken, source_info, request_method) VALUES (%s, %s, %s, %s::jsonb, %s, %s, %s, %s, %s) RETURNING id",
+        (webhook_type, inn, bitrix_id, json.dumps(request_body, ensure_ascii=False), status, duplicate, action, source_info, method)
+    )
+    log_id = cur.fetchone()['id']
+    
+    # Обновляем дневные счётчики в той же транзакции, что и сам лог
+    cur.execute("""
+        INSERT INTO webhook_stats_daily (day, webhook_type, total_requests, duplicates_found, successful, first_at, last_at)
+        VALUES (CURRENT_DATE, %s, 1, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (day, webhook_type) DO UPDATE SET
+            total_requests = webhook_stats_daily.total_requests + 1,
+            duplicates_found = webhook_stats_daily.duplicates_found + EXCLUDED.duplicates_found,
+            successful = webhook_stats_daily.successful + EXCLUDED.successful,
+            last_at = EXCLUDED.last_at
+    """, (webhook_type, 1 if duplicate else 0, 1 if status == 'success' else 0))
+    
+    return log_id
+
+def get_webhook_stats(cur) -> Dict[str, Any]:
+    '''Суммирует дневные счётчики: O(дней), а не O(записей в webhook_logs)'''
+    cur.execute("""
+        SELECT 
+            COALESCE(SUM(total_requests), 0) as total_requests,
+            COALESCE(SUM(duplicates_found), 0) as duplicates_found,
+            COALESCE(SUM(successful), 0) as successful
+        FROM webhook_stats_daily
+    """)
+    stats_row = cur.fetchone()
+    if not stats_row:
+        return {'total_requests': 0, 'duplicates_found': 0, 'successful': 0}
+    return {key: int(value) for key, value in stats_row.items()}
+
+def rebuild_webhook_stats(cur) -> int:
+    '''Пересобирает дневные счётчики из webhook_logs (бэкфилл после ручных правок таблицы)'''
+    cur.execute("DELETE FROM webhook_stats_daily")
+    cur.execute("""
+        INSERT INTO webhook_stats_daily (day, webhook_type, total_requests, duplicates_found, successful, first_at, last_at)
+        SELECT
+            created_at::date,
+            webhook_type,
+            COUNT(*),
+            COUNT(*) FILTER (WHERE duplicate_found = true),
+            COUNT(*) FILTER (WHERE response_status = 'success'),
+            MIN(created_at),
+            MAX(created_at)
+        FROM webhook_logs
+        GROUP BY created_at::date, webhook_type
+    """)
+    return cur.rowcount
+
+def serialize_log(log: Dict) -> Dict:
+    result = dict(log)
+    # request_body хранится в JSONB, дашборд ждёт строку JSON
+    if isinstance(result.get('request_body'), (dict, list)):
+        result['request_body'] = json.dumps(result['request_body'], ensure_ascii=False)
+    if 'created_at' in result and result['created_at']:
+        # Конвертируем UTC в Екатеринбург (UTC+5)
+        ekb_tz = timezone(timedelta(hours=5))
+        if result['created_at'].tzinfo is None:
+            # Если время без timezone, считаем его UTC
+            utc_time = result['created_at'].replace(tzinfo=timezone.utc)
+        else:
+            utc_time = result['created_at']
+        
+        ekb_time = utc_time.astimezone(ekb_tz)
+        result['created_at'] = ekb_time.strftime('%Y-%m-%d %H:%M:%S')
+    return result
+
+def search_webhook_logs(cur, company_id: str = '', inn: str = '', webhook_type: str = '', event_name: str = '', contains: str = '', limit: int = 100) -> List[Dict[str, Any]]:
+    '''
+    Поиск по webhook_logs через индексы: bitrix_company_id/inn/request_event (B-tree)
+    и вхождение JSON в request_body (GIN jsonb_path_ops)
+    '''
+    conditions = []
+    params: List[Any] = []
+    if company_id:
+        # Компания может быть указана колонкой или только в теле запроса
+        conditions.append("(bitrix_company_id = %s OR request_body @> %s::jsonb)")
+        params.extend([company_id, json.dumps({'bitrix_id': company_id})])
+    if inn:
+        conditions.append("inn = %s")
+        params.append(inn)
+    if webhook_type:
+        conditions.append("webhook_type = %s")
+        params.append(webhook_type)
+    if event_name:
+        conditions.append("request_event = %s")
+        params.append(event_name)
+    if contains:
+        conditions.append("request_body @> %s::jsonb")
+        params.append(contains)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cur.execute(f"SELECT * FROM webhook_logs {where_sql} ORDER BY created_at DESC LIMIT %s", params + [limit])
+    return cur.fetchall()
+
+def get_deleted_company(cur, catalog_id: Optional[Any], log_id: Optional[Any], lock: bool = False) -> Optional[Dict[str, Any]]:
+    '''Запись каталога по ID (или по ID лога удаления); lock - FOR UPDATE до конца транзакции'''
+    lock_sql = ' FOR UPDATE' if lock else ''
+    if catalog_id:
+        cur.execute(f"SELECT * FROM deleted_companies WHERE id = %s{lock_sql}", (int(catalog_id),))
+    else:
+        cur.execute(f"SELECT * FROM deleted_companies WHERE webhook_log_id = %s ORDER BY id DESC LIMIT 1{lock_sql}", (int(log_id),))
+    return cur.fetchone()
+
+def search_deleted_companies(cur, search: str, limit: int, offset: int) -> Dict[str, Any]:
+    '''
+    Поиск в каталоге удалённых компаний без снимков (они нужны только при восстановлении).
+    Цифры ищутся по префиксу ИНН или ID компании, остальное - по подстроке названия
+    '''
+    conditions = []
+    params: List[Any] = []
+    if search.isdigit():
+        conditions.append("(inn LIKE %s OR bitrix_id = %s)")
+        params.extend([f"{search}%", search])
+    elif search:
+        conditions.append("title ILIKE %s")
+        params.append(f"%{search}%")
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cur.execute(f"SELECT COUNT(*) AS total FROM deleted_companies {where_sql}", params)
+    total = cur.fetchone()['total']
+    
+    cur.execute(
+        f"""
+        SELECT id, bitrix_id, inn, title, existing_company_id, webhook_log_id,
+               deleted_at, restored_at, restored_company_id
+        FROM deleted_companies {where_sql}
+        ORDER BY deleted_at DESC, id DESC
+        LIMIT %s OFFSET %s
+        """,
+        params + [limit, offset]
+    )
+    items = []
+    for row in cur.fetchall():
+        item = dict(row)
+        item['deleted_at'] = serialize_log({'created_at': row['deleted_at']})['created_at']
+        item['restored_at'] = row['restored_at'].isoformat() if row['restored_at'] else None
+        items.append(item)
+    
+    return {'items': items, 'total': total, 'limit': limit, 'offset': offset}
+
+def inn_filter_positions(inn: str, bits_count: int, hashes_count: int) -> List[int]:
+    '''Позиции битов для ИНН: двойное хеширование по blake2b'''
+    digest = hashlib.blake2b(inn.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bits_count for i in range(hashes_count)]
+
+def inn_filter_add(inn: str) -> None:
+    '''
+    Добавляет ИНН в фильтр. items растёт, только если выставлен хоть один новый бит:
+    повторное добавление (сохранение зеркала, догрузка по watermark) не завышает заполненность
+    '''
+    if INN_FILTER['bits'] is None or not inn:
+        return
+    bits = INN_FILTER['bits']
+    added = False
+    for position in inn_filter_positions(inn, INN_FILTER['bits_count'], INN_FILTER['hashes_count']):
+        mask = 1 << (position & 7)
+        if not bits[position >> 3] & mask:
+            bits[position >> 3] |= mask
+            added = True
+    if added:
+        INN_FILTER['items'] += 1
+
+def inn_filter_might_contain(inn: str) -> bool:
+    '''False - ИНН точно нет в зеркале; True - возможно есть (нужна полная проверка)'''
+    if INN_FILTER['bits'] is None:
+        return True
+    INN_FILTER['lookups'] += 1
+    bits = INN_FILTER['bits']
+    for position in inn_filter_positions(inn, INN_FILTER['bits_count'], INN_FILTER['hashes_count']):
+        if not bits[position >> 3] & (1 << (position & 7)):
+            INN_FILTER['negatives'] += 1
+            return False
+    return True
+
+def build_inn_filter(cur) -> None:
+    '''Строит фильтр с нуля по всем ИНН из companies с запасом ёмкости x2'''
+    fp_rate = float(os.environ.get('INN_FILTER_FP_RATE', '0.001'))
+    cur.execute("SELECT COUNT(*) AS total, MAX(updated_at) AS watermark FROM companies WHERE inn <> ''")
+    row = cur.fetchone()
+    capacity = max(1000, int(row['total']) * 2)
+    bits_count = int(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+    
+    INN_FILTER['capacity'] = capacity
+    INN_FILTER['bits_count'] = bits_count
+    INN_FILTER['hashes_count'] = max(1, round(bits_count / capacity * math.log(2)))
+    INN_FILTER['bits'] = bytearray((bits_count + 7) // 8)
+    INN_FILTER['items'] = 0
+    INN_FILTER['watermark'] = row['watermark']
+    
+    cur.execute("SELECT inn FROM companies WHERE inn <> ''")
+    for company in cur.fetchall():
+        inn_filter_add(company['inn'].strip())
+    
+    INN_FILTER['built_at'] = datetime.now(timezone.utc).isoformat()
+    INN_FILTER['refreshed_at'] = time.time()
+    log('INFO', 'db', f"INN filter built: {INN_FILTER['items']} INNs, {len(INN_FILTER['bits'])} bytes")
+
+def ensure_inn_filter(cur) -> None:
+    '''
+    Строит фильтр при холодном старте, далее раз в INN_FILTER_REFRESH_SECONDS
+    догружает только компании, изменённые после последнего watermark. updated_at - время начала
+    транзакции записи, поэтому окно перекрывается на CURSOR_SETTLE_SECONDS назад: строка, закоммиченная
+    позже с более ранним updated_at, не теряется (повторное добавление ИНН ничего не меняет)
+    '''
+    if INN_FILTER['bits'] is None:
+        build_inn_filter(cur)
+        return
+    
+    if time.time() - INN_FILTER['refreshed_at'] < int(os.environ.get('INN_FILTER_REFRESH_SECONDS', '60')):
+        return
+    
+    if INN_FILTER['watermark'] is None:
+        cur.execute("SELECT inn, updated_at FROM companies WHERE inn <> '' ORDER BY updated_at")
+    else:
+        cur.execute(
+            "SELECT inn, updated_at FROM companies WHERE inn <> '' AND updated_at > %s - make_interval(secs => %s) ORDER BY updated_at",
+            (INN_FILTER['watermark'], CURSOR_SETTLE_SECONDS)
+        )
+    for company in cur.fetchall():
+        inn_filter_add(company['inn'].strip())
+        INN_FILTER['watermark'] = max(INN_FILTER['watermark'] or company['updated_at'], company['updated_at'])
+    INN_FILTER['refreshed_at'] = time.time()
+    
+    # Переполненный фильтр теряет точность - пересобираем с новой ёмкостью
+    if INN_FILTER['items'] > INN_FILTER['capacity']:
+        build_inn_filter(cur)
+
+def inn_filter_metrics() -> Dict[str, Any]:
+    bits_count = INN_FILTER['bits_count']
+    hashes_count = INN_FILTER['hashes_count']
+    items = INN_FILTER['items']
+    estimated_fp_rate = (1 - math.exp(-hashes_count * items / bits_count)) ** hashes_count if bits_count else 0.0
+    
+    return {
+        'trusted': os.environ.get('INN_FILTER_TRUSTED', '') == '1',
+        'items': items,
+        'capacity': INN_FILTER['capacity'],
+        'bits_count': bits_count,
+        'hashes_count': hashes_count,
+        'memory_bytes': len(INN_FILTER['bits']) if INN_FILTER['bits'] is not None else 0,
+        'estimated_fp_rate': estimated_fp_rate,
+        'lookups': INN_FILTER['lookups'],
+        'negatives': INN_FILTER['negatives'],
+        'negative_mismatches': INN_FILTER['negative_mismatches'],
+        'built_at': INN_FILTER['built_at'],
+        'watermark': INN_FILTER['watermark'].isoformat() if INN_FILTER['watermark'] else None
+    }
+
+def save_company_mirror(cur, bitrix_id: str, inn: str, title: str, company_info: Dict[str, Any]) -> None:
+    '''
+    Обновляет компанию в локальном зеркале companies: ИНН, название, основной телефон и email
+    вместе с нормализованными ключами для нечёткого поиска дублей и DATE_MODIFY для сверки
+    '''
+    phone = ''
+    if isinstance(company_info.get('PHONE'), list) and company_info['PHONE']:
+        phone = str(company_info['PHONE'][0].get('VALUE', ''))[:100]
+    email = ''
+    if isinstance(company_info.get('EMAIL'), list) and company_info['EMAIL']:
+        email = str(company_info['EMAIL'][0].get('VALUE', ''))[:255]
+    
+    cur.execute(
+        """
+        INSERT INTO companies (bitrix_id, inn, title, phone, email, title_norm, phone_norm, email_norm, date_modify)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (bitrix_id) DO UPDATE SET
+            inn = EXCLUDED.inn, title = EXCLUDED.title, phone = EXCLUDED.phone, email = EXCLUDED.email,
+            title_norm = EXCLUDED.title_norm, phone_norm = EXCLUDED.phone_norm, email_norm = EXCLUDED.email_norm,
+            date_modify = EXCLUDED.date_modify, updated_at = CURRENT_TIMESTAMP
+        """,
+        (bitrix_id, inn, title, phone, email, normalize_company_title(title), normalize_phone(phone), normalize_email(email), company_info.get('DATE_MODIFY'))
+    )
+    if inn:
+        inn_filter_add(inn)
+
+def normalize_company_title(title: str) -> str:
+    '''Нижний регистр, ё->е, без кавычек/пунктуации и организационно-правовой формы'''
+    text = LEGAL_FORM_PHRASES.sub(' ', (title or '').lower().replace('ё', 'е'))
+    return ' '.join(word for word in NON_WORD_CHARS.sub(' ', text).split() if word not in LEGAL_FORM_WORDS)
+
+def normalize_phone(phone: str) -> str:
+    '''Последние 10 цифр: +7 (912) 000-00-00 и 8 912 0000000 дают один ключ'''
+    digits = NON_DIGIT_CHARS.sub('', phone or '')
+    return digits[-10:] if len(digits) >= 10 else ''
+
+def normalize_email(email: str) -> str:
+    email = (email or '').strip().lower()
+    return email if '@' in email else ''
+
+def title_trigrams(normalized_title: str) -> set:
+    padded = f"  {normalized_title} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def prepare_fuzzy_company(bitrix_id: str, inn: str, title: str, phone: str, email: str) -> Dict[str, Any]:
+    return {
+        'bitrix_id': str(bitrix_id),
+        'inn': (inn or '').strip(),
+        'title': title or '',
+        'normalized_title': normalize_company_title(title),
+        'phone_key': normalize_phone(phone),
+        'email_key': normalize_email(email)
+    }
+
+def find_fuzzy_duplicates(cur, targets: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Нечёткий поиск дублей для targets по зеркалу companies.
+    Блоки: триграммы нормализованного названия (GIN pg_trgm), телефон и email (B-tree).
+    Оцениваются только кандидаты, попавшие с целью хотя бы в один общий блок
+    '''
+    started = time.time()
+    threshold = float(os.environ.get('FUZZY_TITLE_THRESHOLD', '0.6'))
+    block_limit = int(os.environ.get('FUZZY_MAX_BLOCK_SIZE', '200'))
+    
+    target_ids = [target['bitrix_id'] for target in targets]
+    matches = []
+    candidates_scored = 0
+    
+    for target in targets:
+        target_trigrams = title_trigrams(target['normalized_title']) if target['normalized_title'] else set()
+        
+        # Пустые ключи передаём как NULL - такое сравнение не совпадает ни с чем
+        cur.execute(
+            """
+            SELECT bitrix_id, inn, title, title_norm, phone_norm, email_norm
+            FROM companies
+            WHERE ((title_norm %% %s) OR phone_norm = %s OR email_norm = %s)
+              AND bitrix_id <> ALL(%s)
+            LIMIT %s
+            """,
+            (target['normalized_title'] or None, target['phone_key'] or None, target['email_key'] or None, target_ids, block_limit)
+        )
+        
+        for candidate in cur.fetchall():
+            candidates_scored += 1
+            
+            reasons = []
+            title_score = 0.0
+            if target_trigrams and candidate['title_norm']:
+                candidate_trigrams = title_trigrams(candidate['title_norm'])
+                title_score = len(target_trigrams & candidate_trigrams) / len(target_trigrams | candidate_trigrams)
+                if title_score >= threshold:
+                    reasons.append('title')
+            if target['phone_key'] and target['phone_key'] == candidate['phone_norm']:
+                reasons.append('phone')
+            if target['email_key'] and target['email_key'] == candidate['email_norm']:
+                reasons.append('email')
+            if not reasons:
+                continue
+            
+            matches.append({
+                'company_id': target['bitrix_id'],
+                'company_title': target['title'],
+                'candidate_id': candidate['bitrix_id'],
+                'candidate_title': candidate['title'],
+                'candidate_inn': candidate['inn'],
+                'same_inn': bool(target['inn']) and target['inn'] == candidate['inn'],
+                'title_score': round(title_score, 3),
+                'reasons': reasons
+            })
+    
+    matches.sort(key=lambda item: (len(item['reasons']), item['title_score']), reverse=True)
+    
+    return {
+        'matches': matches[:int(os.environ.get('FUZZY_MAX_MATCHES', '100'))],
+        'total_matches': len(matches),
+        'candidates_scored': candidates_scored,
+        'elapsed_ms': int((time.time() - started) * 1000)
+    }
+
+def maintain_log_partitions(cur, retention_months: int, months_ahead: int = 2) -> Dict[str, Any]:
+    '''
+    Создаёт месячные секции журналов на months_ahead месяцев вперёд и удаляет секции
+    старше retention_months (0 - хранить всё). Дневные счётчики чистятся вместе с секциями.
+    '''
+    created = []
+    dropped = []
+    
+    for table in PARTITIONED_LOG_TABLES:
+        for month_offset in range(months_ahead + 1):
+            cur.execute(
+                "SELECT ensure_monthly_partition(%s, (date_trunc('month', CURRENT_DATE) + make_interval(months => %s))::date) AS name",
+                (table, month_offset)
+            )
+            row = cur.fetchone()
+            if row and row['name']:
+                created.append(row['name'])
+        
+        if retention_months > 0:
+            cur.execute("SELECT drop_expired_partitions(%s, %s) AS name", (table, retention_months))
+            dropped.extend(row['name'] for row in cur.fetchall())
+    
+    if retention_months > 0:
+        cur.execute(
+            "DELETE FROM webhook_stats_daily WHERE day < (date_trunc('month', CURRENT_DATE) - make_interval(months => %s))::date",
+            (retention_months,)
+        )
+    
+    return {'created_partitions': created, 'dropped_partitions': dropped}
+
+def get_bitrix_company(company_id: str, cur, with_deals: bool = True) -> Dict[str, Any]:
+    '''Карточка компании с реквизитами (через кеш company_cards) и, по желанию, делами'''
+    card_result = get_company_card(cur, company_id)
+    if not card_result.get('success') or not with_deals:
+        return card_result
+    
+    company = dict(card_result['company'])
+    
+    # Получаем дела по компании
+    deals = get_company_deals(company_id, cur)
+    company['DEALS'] = deals
+    log('DEBUG', 'flow', f"Found {len(deals)} deals for company {company_id}")
+    
+    return {'success': True, 'company': company, 'cache': card_result.get('cache')}
+
+def get_company_card(cur, company_id: str, date_modify: Optional[str] = None,
+                     requisites_stamp: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Карточка компании + реквизиты из кеша company_cards.
+    Актуальность проверяется по DATE_MODIFY компании (crm.company.list) и отпечатку реквизитов
+    (crm.requisite.list с ID, DATE_MODIFY): правка реквизита DATE_MODIFY компании не меняет.
+    Полная карточка запрашивается, только если изменилось одно из двух.
+    date_modify и requisites_stamp можно передать, если они уже получены пакетно
+    '''
+    if date_modify is None:
+        listing = get_companies_date_modify([company_id])
+        if listing is not None:
+            if str(company_id) not in listing:
+                cur.execute("DELETE FROM company_cards WHERE bitrix_id = %s", (str(company_id),))
+                return {'success': False, 'error': 'Not found'}
+            date_modify = listing[str(company_id)].get('DATE_MODIFY')
+    
+    if requisites_stamp is None and date_modify:
+        stamps = get_requisites_stamps([company_id])
+        if stamps is not None:
+            requisites_stamp = stamps.get(str(company_id), requisites_stamp_of([]))
+    
+    cur.execute("SELECT card, date_modify, requisites_stamp FROM company_cards WHERE bitrix_id = %s", (str(company_id),))
+    cached = cur.fetchone()
+    if cached and date_modify and requisites_stamp and cached['date_modify'] == date_modify \
+            and cached['requisites_stamp'] == requisites_stamp:
+        log('DEBUG', 'db', f"Company card {company_id} from cache (DATE_MODIFY {date_modify})")
+        return {'success': True, 'company': cached['card'], 'cache': 'hit'}
+    
+    card_result = fetch_bitrix_company_card(company_id)
+    if card_result.get('success'):
+        company = card_result['company']
+        cur.execute(
+            """
+            INSERT INTO company_cards (bitrix_id, date_modify, requisites_stamp, card, fetched_at)
+            VALUES (%s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (bitrix_id) DO UPDATE SET
+                date_modify = EXCLUDED.date_modify, requisites_stamp = EXCLUDED.requisites_stamp,
+                card = EXCLUDED.card, fetched_at = CURRENT_TIMESTAMP
+            """,
+            (str(company_id), company.get('DATE_MODIFY'), requisites_stamp_of(company.get('REQUISITES') or []),
+             json.dumps(company, ensure_ascii=False))
+        )
+        card_result['cache'] = 'stale' if cached else 'miss'
+    
+    return card_result
+
+def get_companies_date_modify(company_ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    '''
+    Существующие компании из списка: {ID: {ID, TITLE, DATE_CREATE, DATE_MODIFY}}.
+    Один crm.company.list на 50 ID; None - если Битрикс24 недоступен
+    '''
+    bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if not bitrix_webhook:
+        return None
+    
+    url = f"{bitrix_webhook.rstrip('/')}/crm.company.list.json"
+    companies: Dict[str, Dict[str, Any]] = {}
+    ids = [str(company_id) for company_id in company_ids]
+    
+    try:
+        for start in range(0, len(ids), 50):
+            params_list = [('filter[@ID][]', company_id) for company_id in ids[start:start + 50]]
+            for field in ['ID', 'TITLE', 'DATE_CREATE', 'DATE_MODIFY']:
+                params_list.append(('select[]', field))
+            
+            req = urllib.request.Request(url, data=urllib.parse.urlencode(params_list).encode('utf-8'))
+            with urllib.request.urlopen(req, timeout=10) as response:
+                result = json.loads(response.read().decode('utf-8'))
+            
+            if 'result' not in result:
+                log('WARN', 'bitrix', f"crm.company.list error: {result.get('error_description', result.get('error'))}")
+                return None
+            for company in result['result']:
+                companies[str(company['ID'])] = company
+    except Exception as e:
+        log('WARN', 'bitrix', f"Error revalidating companies: {type(e).__name__}: {str(e)}")
+        return None
+    
+    return companies
+
+def requisites_stamp_of(requisites: List[Dict[str, Any]]) -> str:
+    '''Отпечаток набора реквизитов: меняется при добавлении, удалении и правке любого из них'''
+    pairs = sorted(f"{requisite.get('ID')}:{requisite.get('DATE_MODIFY')}" for requisite in requisites)
+    return hashlib.sha1('|'.join(pairs).encode('utf-8')).hexdigest()
 
-def log_webhook(cur, webhook_type: str, inn: str, bitrix_id: str, request_body: Dict, status: str, duplicate: bool, action: str, source_info: str = '', method: str = 'POST'):
-    cur.execute(
-        "INSERT INTO webhook_logs (webhook_type, inn, bitrix_company_id, request_body, response_status, duplicate_found, action_taken, source_info, request_method) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-        (webhook_type, inn, bitrix_id, json.dumps(request_body), status, duplicate, action, source_info, method)
-    )
+def get_requisites_stamps(company_ids: List[str]) -> Optional[Dict[str, str]]:
+    '''
+    Отпечатки реквизитов компаний {ID: stamp}. У компании без реквизитов - отпечаток пустого набора.
+    None - если Битрикс24 недоступен
+    '''
+    requisites_by_company = get_companies_requisites(company_ids)
+    if requisites_by_company is None:
+        return None
+    return {company_id: requisites_stamp_of(requisites) for company_id, requisites in requisites_by_company.items()}
 
-def serialize_log(log: Dict) -> Dict:
-    result = dict(log)
-    if 'created_at' in result and result['created_at']:
-        # Конвертируем UTC в Екатеринбург (UTC+5)
-        ekb_tz = timezone(timedelta(hours=5))
-        if result['created_at'].tzinfo is None:
-            # Если время без timezone, считаем его UTC
-            utc_time = result['created_at'].replace(tzinfo=timezone.utc)
-        else:
-            utc_time = result['created_at']
-        
-        ekb_time = utc_time.astimezone(ekb_tz)
-        result['created_at'] = ekb_time.strftime('%Y-%m-%d %H:%M:%S')
-    return result
+def get_companies_requisites(company_ids: List[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    '''
+    Краткие реквизиты компаний {ID: [{ID, ENTITY_ID, DATE_MODIFY, RQ_INN}]} через crm.requisite.list
+    по 50 компаний в запросе, постранично, в порядке ID реквизита. None - если Битрикс24 недоступен
+    '''
+    bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if not bitrix_webhook:
+        return None
+    
+    url = f"{bitrix_webhook.rstrip('/')}/crm.requisite.list.json"
+    ids = [str(company_id) for company_id in company_ids]
+    requisites_by_company: Dict[str, List[Dict[str, Any]]] = {company_id: [] for company_id in ids}
+    
+    try:
+        for chunk_start in range(0, len(ids), 50):
+            start = 0
+            while start is not None:
+                params_list = [('filter[@ENTITY_ID][]', company_id) for company_id in ids[chunk_start:chunk_start + 50]]
+                params_list += [
+                    ('filter[ENTITY_TYPE_ID]', '4'),
+                    ('select[]', 'ID'),
+                    ('select[]', 'ENTITY_ID'),
+                    ('select[]', 'DATE_MODIFY'),
+                    ('select[]', 'RQ_INN'),
+                    ('start', start)
+                ]
+                req = urllib.request.Request(url, data=urllib.parse.urlencode(params_list).encode('utf-8'))
+                with urllib.request.urlopen(req, timeout=20) as response:
+                    result = json.loads(response.read().decode('utf-8'))
+                
+                if 'result' not in result:
+                    log('WARN', 'bitrix', f"crm.requisite.list error: {result.get('error_description', result.get('error'))}")
+                    return None
+                for requisite in result['result']:
+                    requisites_by_company.setdefault(str(requisite.get('ENTITY_ID')), []).append(requisite)
+                start = result.get('next')
+    except Exception as e:
+        log('WARN', 'bitrix', f"Error revalidating requisites: {type(e).__name__}: {str(e)}")
+        return None
+    
+    for requisites in requisites_by_company.values():
+        requisites.sort(key=lambda requisite: int(requisite.get('ID') or 0))
+    return requisites_by_company
 
-def get_bitrix_company(company_id: str) -> Dict[str, Any]:
+def fetch_bitrix_company_card(company_id: str) -> Dict[str, Any]:
+    '''Полная карточка компании из Битрикс24 со ВСЕМИ полями и реквизитами'''
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
     
     if not bitrix_webhook:
@@ -440,45 +1341,39 @@ def get_bitrix_company(company_id: str) -> Dict[str, Any]:
         # Получаем ВСЕ поля компании
         params = urllib.parse.urlencode({'ID': company_id})
         url = f"{bitrix_webhook.rstrip('/')}/crm.company.get.json?{params}"
-        print(f"[DEBUG] Requesting Bitrix24 company with ALL fields: {url}")
+        log('DEBUG', 'bitrix', lambda: f"Requesting Bitrix24 company with ALL fields: {url}")
         
         with urllib.request.urlopen(url, timeout=10) as response:
             response_text = response.read().decode('utf-8')
-            print(f"[DEBUG] Bitrix24 company response: {response_text[:500]}")
+            log('DEBUG', 'payload', lambda: f"Bitrix24 company response: {response_text[:500]}")
             result = json.loads(response_text)
             
             if result.get('result'):
                 company = result['result']
-                inn = company.get('RQ_INN', '').strip()
-                
-                if not inn:
-                    print(f"[DEBUG] No INN in company fields, checking requisites...")
-                    inn = get_company_inn_from_requisites(company_id)
-                    print(f"[DEBUG] INN from requisites: {inn}")
-                    company['RQ_INN'] = inn
                 
                 # Получаем ПОЛНЫЕ реквизиты (не только ИНН)
                 requisites = get_company_requisites(company_id)
                 company['REQUISITES'] = requisites
-                print(f"[DEBUG] Found {len(requisites)} requisites for company {company_id}")
+                log('DEBUG', 'flow', f"Found {len(requisites)} requisites for company {company_id}")
                 
-                # Получаем дела по компании
-                deals = get_company_deals(company_id)
-                company['DEALS'] = deals
-                print(f"[DEBUG] Found {len(deals)} deals for company {company_id}")
+                inn = company.get('RQ_INN', '').strip()
+                if not inn:
+                    inn = get_inn_from_requisites(requisites)
+                    log('DEBUG', 'flow', f"INN from requisites: {inn}")
+                    company['RQ_INN'] = inn
                 
                 return {'success': True, 'company': company}
             else:
                 error_msg = result.get('error_description', result.get('error', 'Company not found'))
-                print(f"[DEBUG] Bitrix24 error: {error_msg}")
+                log('WARN', 'bitrix', f"Bitrix24 error: {error_msg}")
                 return {'success': False, 'error': error_msg}
     
     except urllib.error.HTTPError as e:
         error_body = e.read().decode('utf-8') if e.fp else 'No error body'
-        print(f"[DEBUG] HTTPError {e.code}: {error_body}")
+        log('WARN', 'bitrix', f"HTTPError {e.code}: {error_body}")
         return {'success': False, 'error': f'HTTP {e.code}: {error_body}'}
     except Exception as e:
-        print(f"[DEBUG] Exception: {type(e).__name__}: {str(e)}")
+        log('WARN', 'flow', f"Exception: {type(e).__name__}: {str(e)}")
         return {'success': False, 'error': str(e)}
 
 def get_company_requisites(company_id: str) -> List[Dict[str, Any]]:
@@ -495,32 +1390,30 @@ def get_company_requisites(company_id: str) -> List[Dict[str, Any]]:
         }
         params = urllib.parse.urlencode(params_dict)
         url = f"{bitrix_webhook.rstrip('/')}/crm.requisite.list.json?{params}"
-        print(f"[DEBUG] Requesting requisites: {url}")
+        log('DEBUG', 'bitrix', lambda: f"Requesting requisites: {url}")
         
         with urllib.request.urlopen(url, timeout=10) as response:
             response_text = response.read().decode('utf-8')
-            print(f"[DEBUG] Requisites response: {response_text[:1000]}")
+            log('DEBUG', 'payload', lambda: f"Requisites response: {response_text[:1000]}")
             result = json.loads(response_text)
             
             if result.get('result'):
                 requisites = result['result']
-                print(f"[DEBUG] Found {len(requisites)} full requisites")
+                log('DEBUG', 'flow', f"Found {len(requisites)} full requisites")
                 return requisites
         
         return []
     
     except Exception as e:
-        print(f"[DEBUG] Error getting requisites: {type(e).__name__}: {str(e)}")
+        log('WARN', 'flow', f"Error getting requisites: {type(e).__name__}: {str(e)}")
         return []
 
-def get_company_inn_from_requisites(company_id: str) -> str:
-    '''Получает только ИНН из реквизитов (для быстрой проверки)'''
-    requisites = get_company_requisites(company_id)
-    
+def get_inn_from_requisites(requisites: List[Dict[str, Any]]) -> str:
+    '''Первый заполненный ИНН из уже полученных реквизитов'''
     for req in requisites:
         inn = req.get('RQ_INN', '').strip()
         if inn:
-            print(f"[DEBUG] Found INN in requisite ID={req.get('ID')}: {inn}")
+            log('DEBUG', 'flow', f"Found INN in requisite ID={req.get('ID')}: {inn}")
             return inn
     
     return ''
@@ -528,7 +1421,7 @@ def get_company_inn_from_requisites(company_id: str) -> str:
 def find_duplicate_companies_by_inn(inn: str) -> Dict[str, Any]:
     '''
     КРИТИЧНО: Ищет активные компании с заданным ИНН в Битрикс24
-    Проверяет каждую найденную компанию на существование через crm.company.get
+    Проверяет найденные компании на существование одним crm.company.list
     '''
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
     
@@ -545,7 +1438,7 @@ def find_duplicate_companies_by_inn(inn: str) -> Dict[str, Any]:
         })
         
         req_url = f"{url}?{filter_params}"
-        print(f"[DEBUG] Searching requisites with INN {inn}: {req_url}")
+        log('DEBUG', 'bitrix', lambda: f"Searching requisites with INN {inn}: {req_url}")
         
         with urllib.request.urlopen(req_url, timeout=10) as response:
             result = json.loads(response.read().decode('utf-8'))
@@ -554,52 +1447,119 @@ def find_duplicate_companies_by_inn(inn: str) -> Dict[str, Any]:
                 return {'success': True, 'companies': []}  # Нет реквизитов = нет компаний
             
             requisites = result['result']
-            print(f"[DEBUG] Found {len(requisites)} requisites with INN {inn}")
+            log('DEBUG', 'flow', f"Found {len(requisites)} requisites with INN {inn}")
             
             # Собираем уникальные ID компаний из реквизитов
             company_ids = list(set([req.get('ENTITY_ID') for req in requisites if req.get('ENTITY_ID')]))
-            print(f"[DEBUG] Unique company IDs from requisites: {company_ids}")
+            log('DEBUG', 'flow', lambda: f"Unique company IDs from requisites: {company_ids}")
+            
+            # КРИТИЧНО: Проверяем существование всех компаний одним crm.company.list
+            existing = get_companies_date_modify(company_ids)
+            if existing is None:
+                return {'success': False, 'error': 'Failed to verify companies via crm.company.list', 'companies': []}
             
-            # КРИТИЧНО: Проверяем каждую компанию на реальное существование
             verified_companies = []
             for company_id in company_ids:
-                # Проверяем существование компании через crm.company.get
-                check_result = get_bitrix_company(str(company_id))
-                if check_result.get('success') and check_result.get('company'):
-                    company_data = check_result['company']
+                company_data = existing.get(str(company_id))
+                if company_data:
                     verified_companies.append({
                         'ID': company_id,
                         'TITLE': company_data.get('TITLE', 'N/A'),
                         'DATE_CREATE': company_data.get('DATE_CREATE', 'N/A')
                     })
-                    print(f"[DEBUG] Company {company_id} VERIFIED (exists and active)")
+                    log('DEBUG', 'flow', f"Company {company_id} VERIFIED (exists and active)")
                 else:
-                    print(f"[DEBUG] Company {company_id} SKIPPED (deleted or not found): {check_result.get('error')}")
+                    log('DEBUG', 'flow', f"Company {company_id} SKIPPED (deleted or not found)")
             
-            print(f"[DEBUG] Verified {len(verified_companies)} out of {len(company_ids)} companies")
+            log('DEBUG', 'flow', f"Verified {len(verified_companies)} out of {len(company_ids)} companies")
             return {'success': True, 'companies': verified_companies}
     
     except Exception as e:
-        print(f"[ERROR] find_duplicate_companies_by_inn failed: {e}")
+        log('ERROR', 'flow', f"find_duplicate_companies_by_inn failed: {e}")
         return {'success': False, 'error': str(e), 'companies': []}
 
-def create_task_for_missing_inn(company_id: str, company_title: str, company_info: Dict[str, Any]) -> Dict[str, Any]:
+def ensure_missing_inn_task(cur, company_id: str, company_title: str, company_info: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Возвращает открытую задачу "Заполнить ИНН" по компании из реестра missing_inn_tasks,
+    создаёт новую только если открытой ещё нет. Сначала занимается строка реестра
+    (уникальный индекс по открытой задаче компании: параллельная проверка ждёт коммита и получает
+    уже занятую строку), задача в Битрикс24 создаётся только после успешного захвата.
+    Уведомление уходит ответственному в дайджесте.
+    '''
+    responsible_id = str(company_info.get('ASSIGNED_BY_ID', company_info.get('CREATED_BY_ID', '1')))
+    cur.execute("""
+        INSERT INTO missing_inn_tasks (company_id, company_title, responsible_id)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (company_id) WHERE status = 'open' DO NOTHING
+        RETURNING id
+    """, (company_id, company_title, responsible_id))
+    claimed = cur.fetchone()
+    if not claimed:
+        cur.execute(
+            "SELECT task_id FROM missing_inn_tasks WHERE company_id = %s AND status = 'open'",
+            (company_id,)
+        )
+        existing = cur.fetchone()
+        task_id = existing['task_id'] if existing else None
+        log('DEBUG', 'flow', f"Open missing-INN task {task_id} already exists for company {company_id}")
+        return {'success': True, 'task_id': task_id, 'existing': True}
+    
+    task_result = create_task_for_missing_inn(company_id, company_title, responsible_id)
+    if not task_result.get('success'):
+        # Задача не создана - освобождаем строку, следующая проверка попробует снова
+        cur.execute("DELETE FROM missing_inn_tasks WHERE id = %s", (claimed['id'],))
+        return task_result
+    
+    cur.execute(
+        "UPDATE missing_inn_tasks SET task_id = %s WHERE id = %s",
+        (str(task_result['task_id']), claimed['id'])
+    )
+    
+    return {'success': True, 'task_id': task_result['task_id'], 'existing': False}
+
+def close_missing_inn_task(cur, company_id: str) -> Optional[str]:
+    '''Закрывает открытую задачу "Заполнить ИНН", если у компании появился ИНН. Возвращает ID задачи'''
+    cur.execute(
+        "SELECT id, task_id FROM missing_inn_tasks WHERE company_id = %s AND status = 'open'",
+        (company_id,)
+    )
+    open_task = cur.fetchone()
+    if not open_task:
+        return None
+    
+    bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if bitrix_webhook and open_task['task_id']:
+        try:
+            url = f"{bitrix_webhook.rstrip('/')}/tasks.task.complete.json"
+            data = urllib.parse.urlencode({'taskId': open_task['task_id']}).encode('utf-8')
+            with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+                result = json.loads(response.read().decode('utf-8'))
+                if not result.get('result'):
+                    log('WARN', 'bitrix', f"Task {open_task['task_id']} complete error: {result.get('error_description', result.get('error'))}")
+        except Exception as e:
+            log('WARN', 'bitrix', f"Exception completing task {open_task['task_id']}: {type(e).__name__}: {str(e)}")
+    
+    # В реестре закрываем в любом случае: ИНН заполнен, повторно задачу не создаём
+    cur.execute(
+        "UPDATE missing_inn_tasks SET status = 'closed', closed_at = CURRENT_TIMESTAMP WHERE id = %s",
+        (open_task['id'],)
+    )
+    log('INFO', 'flow', f"Missing-INN task {open_task['task_id']} closed for company {company_id}")
+    return open_task['task_id']
+
+def create_task_for_missing_inn(company_id: str, company_title: str, responsible_id: str) -> Dict[str, Any]:
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
     
     if not bitrix_webhook:
         return {'success': False, 'error': 'BITRIX24_WEBHOOK_URL not configured'}
     
     try:
-        # Получаем ID автора компании (кто создал)
-        assigned_by_id = company_info.get('ASSIGNED_BY_ID', company_info.get('CREATED_BY_ID', '1'))
-        
         # Формируем описание задачи
         task_title = f"Заполнить реквизиты компании: {company_title}"
         task_description = f"Требуется заполнить ИНН для компании [{company_title}](https://your-bitrix24.ru/crm/company/details/{company_id}/)\n\n"
         task_description += "Без заполненного ИНН не работает автоматическая проверка дубликатов компаний."
         
         # Срок выполнения = текущее время сервера
-        from datetime import datetime
         deadline = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
         
         # Создаём задачу
@@ -608,7 +1568,7 @@ def create_task_for_missing_inn(company_id: str, company_title: str, company_inf
         task_data = {
             'fields[TITLE]': task_title,
             'fields[DESCRIPTION]': task_description,
-            'fields[RESPONSIBLE_ID]': assigned_by_id,
+            'fields[RESPONSIBLE_ID]': responsible_id,
             'fields[DEADLINE]': deadline,
             'fields[UF_CRM_TASK]': [f'CO_{company_id}'],  # Привязка к компании
         }
@@ -621,62 +1581,98 @@ def create_task_for_missing_inn(company_id: str, company_title: str, company_inf
             
             if result.get('result') and result['result'].get('task'):
                 task_id = result['result']['task']['id']
-                print(f"[DEBUG] Task created: {task_id}")
-                
-                # Отправляем уведомление автору
-                notify_result = send_notification_to_user(assigned_by_id, task_title, company_id, company_title)
-                
-                return {
-                    'success': True, 
-                    'task_id': task_id,
-                    'notification_sent': notify_result.get('success', False)
-                }
+                log('DEBUG', 'flow', f"Task created: {task_id}")
+                return {'success': True, 'task_id': task_id}
             else:
                 error_msg = result.get('error_description', result.get('error', 'Unknown error'))
-                print(f"[DEBUG] Task creation error: {error_msg}")
+                log('WARN', 'flow', f"Task creation error: {error_msg}")
                 return {'success': False, 'error': error_msg}
     
     except Exception as e:
-        print(f"[DEBUG] Exception creating task: {type(e).__name__}: {str(e)}")
+        log('WARN', 'flow', f"Exception creating task: {type(e).__name__}: {str(e)}")
         return {'success': False, 'error': str(e)}
 
-def send_notification_to_user(user_id: str, message: str, company_id: str, company_title: str) -> Dict[str, Any]:
+def send_missing_inn_digest(cur, force: bool = False) -> Dict[str, Any]:
+    '''
+    Отправляет ответственным по одному уведомлению со списком их компаний без ИНН.
+    Все уведомления уходят одним вызовом batch (до 50 команд). Без force отправка
+    происходит, только если самая старая неотправленная запись старше MISSING_INN_DIGEST_MINUTES.
+    '''
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
-    
     if not bitrix_webhook:
-        return {'success': False, 'error': 'BITRIX24_WEBHOOK_URL not configured'}
+        return {'success': False, 'error': 'BITRIX24_WEBHOOK_URL not configured', 'notified_users': 0}
     
-    try:
-        url = f"{bitrix_webhook.rstrip('/')}/im.notify.json"
-        
-        notification_message = f"⚠️ Необходимо заполнить реквизиты компании [{company_title}]\n"
-        notification_message += f"Компания создана без ИНН. Для корректной работы системы проверки дубликатов требуется заполнить реквизиты."
-        
-        params = {
-            'to': user_id,
-            'message': notification_message,
+    if not force:
+        digest_minutes = int(os.environ.get('MISSING_INN_DIGEST_MINUTES', '60'))
+        cur.execute("""
+            SELECT 1 FROM missing_inn_tasks
+            WHERE notified_at IS NULL AND status = 'open'
+              AND created_at <= CURRENT_TIMESTAMP - make_interval(mins => %s)
+            LIMIT 1
+        """, (digest_minutes,))
+        if not cur.fetchone():
+            return {'success': True, 'notified_users': 0, 'skipped': True}
+    
+    cur.execute("""
+        SELECT responsible_id, array_agg(id ORDER BY created_at) AS ids,
+               array_agg(company_id ORDER BY created_at) AS company_ids,
+               array_agg(company_title ORDER BY created_at) AS titles
+        FROM missing_inn_tasks
+        WHERE notified_at IS NULL AND status = 'open'
+        GROUP BY responsible_id
+        LIMIT 50
+    """)
+    pending = cur.fetchall()
+    if not pending:
+        return {'success': True, 'notified_users': 0}
+    
+    batch_params = {'halt': '0'}
+    for row in pending:
+        lines = [f"- {title or 'Без названия'} (ID {company_id})" for company_id, title in zip(row['company_ids'], row['titles'])]
+        message = f"⚠️ Необходимо заполнить реквизиты компаний ({len(lines)}):\n" + '\n'.join(lines)
+        message += "\nКомпании созданы без ИНН. Для корректной работы системы проверки дубликатов требуется заполнить реквизиты."
+        batch_params[f"cmd[user_{row['responsible_id']}]"] = 'im.notify?' + urllib.parse.urlencode({
+            'to': row['responsible_id'],
+            'message': message,
             'type': 'SYSTEM'
-        }
-        
-        data = urllib.parse.urlencode(params).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        
-        with urllib.request.urlopen(req, timeout=10) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            
-            if result.get('result'):
-                print(f"[DEBUG] Notification sent to user {user_id}")
-                return {'success': True}
-            else:
-                error_msg = result.get('error_description', result.get('error', 'Unknown error'))
-                print(f"[DEBUG] Notification error: {error_msg}")
-                return {'success': False, 'error': error_msg}
+        })
     
+    try:
+        url = f"{bitrix_webhook.rstrip('/')}/batch.json"
+        data = urllib.parse.urlencode(batch_params).encode('utf-8')
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+            result = json.loads(response.read().decode('utf-8'))
     except Exception as e:
-        print(f"[DEBUG] Exception sending notification: {type(e).__name__}: {str(e)}")
-        return {'success': False, 'error': str(e)}
+        log('WARN', 'bitrix', f"Exception sending missing-INN digest: {type(e).__name__}: {str(e)}")
+        return {'success': False, 'error': str(e), 'notified_users': 0}
+    
+    batch_result = result.get('result', {}) or {}
+    succeeded = batch_result.get('result', {}) or {}
+    failed = batch_result.get('result_error', {}) or {}
+    
+    notified_ids = []
+    for row in pending:
+        if succeeded.get(f"user_{row['responsible_id']}"):
+            notified_ids.extend(row['ids'])
+    
+    if notified_ids:
+        cur.execute(
+            "UPDATE missing_inn_tasks SET notified_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+            (notified_ids,)
+        )
+    
+    if failed:
+        log('WARN', 'bitrix', lambda: f"Missing-INN digest errors: {json.dumps(failed, ensure_ascii=False)}")
+    log('INFO', 'flow', f"Missing-INN digest sent: {len(pending) - len(failed)} users, {len(notified_ids)} companies")
+    
+    return {
+        'success': True,
+        'notified_users': len(pending) - len(failed),
+        'notified_companies': len(notified_ids),
+        'failed_users': list(failed.keys())
+    }
 
-def restore_deleted_company(company_data: Dict[str, Any]) -> Dict[str, Any]:
+def restore_deleted_company(company_data: Dict[str, Any], cur) -> Dict[str, Any]:
     '''Восстанавливает компанию с ПОЛНЫМ копированием ВСЕХ полей, реквизитов и дел'''
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
     
@@ -687,8 +1683,8 @@ def restore_deleted_company(company_data: Dict[str, Any]) -> Dict[str, Any]:
         url = f"{bitrix_webhook.rstrip('/')}/crm.company.add.json"
         
         original_id = company_data.get('ID', company_data.get('bitrix_id'))
-        print(f"[DEBUG] Restoring company {original_id} with full data copy")
-        print(f"[DEBUG] Company data keys: {list(company_data.keys())[:20]}...")
+        log('DEBUG', 'flow', f"Restoring company {original_id} with full data copy")
+        log('DEBUG', 'flow', lambda: f"Company data keys: {list(company_data.keys())[:20]}...")
         
         # Список полей-исключений (системные, не для копирования)
         skip_fields = {'ID', 'bitrix_id', 'inn', 'DEALS', 'REQUISITES', 'DATE_CREATE', 'DATE_MODIFY', 
@@ -737,7 +1733,7 @@ def restore_deleted_company(company_data: Dict[str, Any]) -> Dict[str, Any]:
                     if item.get('VALUE_TYPE'):
                         fields[f'fields[{field_name}][{idx}][VALUE_TYPE]'] = item['VALUE_TYPE']
         
-        print(f"[DEBUG] Prepared {len(fields)} fields for restore")
+        log('DEBUG', 'flow', f"Prepared {len(fields)} fields for restore")
         
         data = urllib.parse.urlencode(fields).encode('utf-8')
         req = urllib.request.Request(url, data=data)
@@ -747,34 +1743,45 @@ def restore_deleted_company(company_data: Dict[str, Any]) -> Dict[str, Any]:
             
             if result.get('result'):
                 new_company_id = result['result']
-                print(f"[DEBUG] Company restored with new ID: {new_company_id} (original was {original_id})")
+                log('DEBUG', 'flow', f"Company restored with new ID: {new_company_id} (original was {original_id})")
                 
                 # КРИТИЧНО: Восстанавливаем реквизиты (включая ИНН)
                 requisites = company_data.get('REQUISITES', [])
                 if requisites:
-                    print(f"[DEBUG] Restoring {len(requisites)} requisites to new company {new_company_id}")
+                    log('DEBUG', 'flow', f"Restoring {len(requisites)} requisites to new company {new_company_id}")
                     restore_requisites_result = restore_company_requisites(requisites, new_company_id)
-                    print(f"[DEBUG] Requisites restore result: {restore_requisites_result}")
+                    log('DEBUG', 'flow', lambda: f"Requisites restore result: {restore_requisites_result}")
                 else:
-                    print(f"[DEBUG] WARNING: No requisites found in backup data")
+                    log('WARN', 'flow', "No requisites found in backup data")
                 
-                # Восстанавливаем дела, переназначая их на новую компанию
+                # Восстанавливаем дела, переназначая их на новую компанию.
+                # Если в бэкапе сделок нет - берём их из локальной карты по исходному ID
                 deals = company_data.get('DEALS', [])
+                if not deals and original_id:
+                    cur.execute(
+                        "SELECT deal_data FROM deal_company_map WHERE company_id = %s AND deleted = FALSE",
+                        (str(original_id),)
+                    )
+                    deals = [row['deal_data'] for row in cur.fetchall()]
                 if deals:
-                    print(f"[DEBUG] Restoring {len(deals)} deals to new company {new_company_id}")
+                    log('DEBUG', 'flow', f"Restoring {len(deals)} deals to new company {new_company_id}")
                     restore_deals_result = restore_company_deals(deals, new_company_id)
-                    print(f"[DEBUG] Deals restore result: {restore_deals_result}")
+                    log('DEBUG', 'flow', lambda: f"Deals restore result: {restore_deals_result}")
+                    cur.execute(
+                        "UPDATE deal_company_map SET company_id = %s, updated_at = CURRENT_TIMESTAMP WHERE deal_id = ANY(%s)",
+                        (str(new_company_id), restore_deals_result.get('restored_ids', []))
+                    )
                 
                 return {'success': True, 'company_id': str(new_company_id), 'original_id': original_id}
             else:
                 error_msg = result.get('error_description', result.get('error', 'Unknown error'))
-                print(f"[DEBUG] Restore error: {error_msg}")
+                log('WARN', 'flow', f"Restore error: {error_msg}")
                 return {'success': False, 'error': error_msg}
     
     except Exception as e:
-        print(f"[DEBUG] Exception restoring company: {type(e).__name__}: {str(e)}")
+        log('WARN', 'flow', f"Exception restoring company: {type(e).__name__}: {str(e)}")
         import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log('ERROR', 'flow', traceback.format_exc)
         return {'success': False, 'error': str(e)}
 
 def restore_company_requisites(requisites: List[Dict[str, Any]], new_company_id: str) -> Dict[str, Any]:
@@ -805,7 +1812,7 @@ def restore_company_requisites(requisites: List[Dict[str, Any]], new_company_id:
                     continue
                 params[f'fields[{key}]'] = str(value)
             
-            print(f"[DEBUG] Creating requisite with {len(params)} fields")
+            log('DEBUG', 'flow', f"Creating requisite with {len(params)} fields")
             
             data = urllib.parse.urlencode(params).encode('utf-8')
             request = urllib.request.Request(url, data=data)
@@ -816,19 +1823,19 @@ def restore_company_requisites(requisites: List[Dict[str, Any]], new_company_id:
                 if result.get('result'):
                     new_req_id = result['result']
                     restored_count += 1
-                    print(f"[DEBUG] Requisite created with ID: {new_req_id}")
+                    log('DEBUG', 'flow', f"Requisite created with ID: {new_req_id}")
                 else:
                     error_msg = result.get('error_description', result.get('error', 'Unknown error'))
                     errors.append(f"Requisite creation failed: {error_msg}")
-                    print(f"[DEBUG] Error creating requisite: {error_msg}")
+                    log('WARN', 'flow', f"Error creating requisite: {error_msg}")
         
         except Exception as e:
             errors.append(f"Requisite exception: {str(e)}")
-            print(f"[DEBUG] Exception creating requisite: {type(e).__name__}: {str(e)}")
+            log('WARN', 'flow', f"Exception creating requisite: {type(e).__name__}: {str(e)}")
     
-    print(f"[DEBUG] Restored {restored_count}/{len(requisites)} requisites")
+    log('DEBUG', 'flow', f"Restored {restored_count}/{len(requisites)} requisites")
     if errors:
-        print(f"[DEBUG] Errors: {errors}")
+        log('WARN', 'flow', lambda: f"Errors: {errors}")
     
     return {'success': True, 'restored_count': restored_count, 'total': len(requisites), 'errors': errors}
 
@@ -840,6 +1847,7 @@ def restore_company_deals(deals: List[Dict[str, Any]], new_company_id: str) -> D
         return {'success': False, 'restored_count': 0}
     
     restored_count = 0
+    restored_ids = []
     errors = []
     
     for deal in deals:
@@ -858,45 +1866,462 @@ def restore_company_deals(deals: List[Dict[str, Any]], new_company_id: str) -> D
                 
                 if result.get('result'):
                     restored_count += 1
+                    restored_ids.append(str(deal['ID']))
                 else:
                     errors.append(f"Deal {deal['ID']}: {result.get('error_description', 'Unknown error')}")
         
         except Exception as e:
             errors.append(f"Deal {deal['ID']}: {str(e)}")
     
-    print(f"[DEBUG] Restored {restored_count}/{len(deals)} deals")
+    log('DEBUG', 'flow', f"Restored {restored_count}/{len(deals)} deals")
     if errors:
-        print(f"[DEBUG] Errors: {errors}")
+        log('WARN', 'flow', lambda: f"Errors: {errors}")
     
-    return {'success': True, 'restored_count': restored_count, 'total': len(deals), 'errors': errors}
+    return {'success': True, 'restored_count': restored_count, 'restored_ids': restored_ids, 'total': len(deals), 'errors': errors}
 
-def get_company_deals(company_id: str) -> List[Dict[str, Any]]:
-    '''Получает все дела по компании'''
+def get_company_deals(company_id: str, cur) -> List[Dict[str, Any]]:
+    '''
+    Все сделки компании. Если карта deal_company_map по компании свежая
+    (полная сверка не старше DEAL_MAP_MAX_AGE_HOURS, дальше её держит deal-tracker) -
+    один индексный запрос в БД, иначе crm.deal.list постранично с обновлением карты
+    '''
+    max_age_hours = int(os.environ.get('DEAL_MAP_MAX_AGE_HOURS', '24'))
+    cur.execute(
+        "SELECT 1 FROM company_deal_sync WHERE company_id = %s AND synced_at > CURRENT_TIMESTAMP - make_interval(hours => %s)",
+        (str(company_id), max_age_hours)
+    )
+    if cur.fetchone():
+        cur.execute(
+            "SELECT deal_data FROM deal_company_map WHERE company_id = %s AND deleted = FALSE ORDER BY deal_id",
+            (str(company_id),)
+        )
+        deals = [row['deal_data'] for row in cur.fetchall()]
+        log('DEBUG', 'db', f"Found {len(deals)} deals for company {company_id} in deal_company_map")
+        return deals
+    
+    deals = fetch_company_deals(company_id)
+    if deals is None:
+        return []
+    
+    for deal in deals:
+        cur.execute(
+            """
+            INSERT INTO deal_company_map (deal_id, company_id, deal_data, date_modify, deleted, updated_at)
+            VALUES (%s, %s, %s::jsonb, %s, FALSE, CURRENT_TIMESTAMP)
+            ON CONFLICT (deal_id) DO UPDATE SET
+                company_id = EXCLUDED.company_id, deal_data = EXCLUDED.deal_data,
+                date_modify = EXCLUDED.date_modify, deleted = FALSE, updated_at = CURRENT_TIMESTAMP
+            """,
+            (str(deal['ID']), str(company_id), json.dumps(deal, ensure_ascii=False), deal.get('DATE_MODIFY'))
+        )
+    # Сделки, которые карта ещё считает сделками компании, но Битрикс24 уже нет
+    cur.execute(
+        "UPDATE deal_company_map SET company_id = NULL, updated_at = CURRENT_TIMESTAMP WHERE company_id = %s AND NOT (deal_id = ANY(%s))",
+        (str(company_id), [str(deal['ID']) for deal in deals])
+    )
+    cur.execute(
+        "INSERT INTO company_deal_sync (company_id, synced_at) VALUES (%s, CURRENT_TIMESTAMP) ON CONFLICT (company_id) DO UPDATE SET synced_at = CURRENT_TIMESTAMP",
+        (str(company_id),)
+    )
+    
+    return deals
+
+def fetch_company_deals(company_id: str) -> Optional[List[Dict[str, Any]]]:
+    '''Все сделки компании через crm.deal.list (постранично, по 50); None - при ошибке REST'''
     bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
     
     if not bitrix_webhook:
-        print(f"[DEBUG] BITRIX24_WEBHOOK_URL not configured")
-        return []
+        log('DEBUG', 'flow', "BITRIX24_WEBHOOK_URL not configured")
+        return None
     
+    deals: List[Dict[str, Any]] = []
+    start = 0
     try:
-        filter_params = urllib.parse.urlencode({'filter[COMPANY_ID]': company_id})
-        url = f"{bitrix_webhook.rstrip('/')}/crm.deal.list.json?{filter_params}"
-        print(f"[DEBUG] Getting deals for company {company_id}: {url}")
+        while start is not None:
+            filter_params = urllib.parse.urlencode([
+                ('filter[COMPANY_ID]', company_id),
+                ('select[]', '*'),
+                ('select[]', 'UF_*'),
+                ('start', start)
+            ])
+            url = f"{bitrix_webhook.rstrip('/')}/crm.deal.list.json?{filter_params}"
+            log('DEBUG', 'bitrix', lambda: f"Getting deals for company {company_id}: {url}")
+            
+            with urllib.request.urlopen(url, timeout=10) as response:
+                result = json.loads(response.read().decode('utf-8'))
+            
+            if 'result' not in result:
+                log('WARN', 'bitrix', lambda: f"crm.deal.list error: {result}")
+                return None
+            
+            deals.extend(result['result'])
+            start = result.get('next')
         
-        with urllib.request.urlopen(url, timeout=10) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        log('DEBUG', 'flow', f"Found {len(deals)} deals")
+        return deals
+    
+    except Exception as e:
+        log('WARN', 'flow', f"Exception getting deals: {type(e).__name__}: {str(e)}")
+        return None
+
+def reconcile_mirrors(cur, entities: List[str], max_calls: int) -> Dict[str, Any]:
+    '''
+    Сверка локальных зеркал (companies, requisites, deals) с Битрикс24 без полной перезагрузки.
+    Для каждого зеркала цикл из двух проходов, прогресс хранится в mirror_reconcile_state,
+    так что каждый вызов продолжает с места, где закончился предыдущий (лимит max_calls запросов).
+    Транспорт - только списки select=[ID, DATE_MODIFY]; полные данные запрашиваются по изменившимся ID
+    '''
+    started = time.time()
+    budget = {'max_calls': max_calls, 'calls': 0, 'bytes': 0}
+    report: Dict[str, Any] = {}
+    
+    for entity in entities:
+        if budget['calls'] >= budget['max_calls']:
+            break
+        report[entity] = reconcile_entity(cur, entity, budget)
+    
+    full_bytes = [item['full_resync_bytes_estimate'] for item in report.values()]
+    full_bytes_total = sum(full_bytes) if full_bytes and None not in full_bytes else None
+    full_calls = sum(item['full_resync_calls_estimate'] for item in report.values())
+    
+    return {
+        'entities': report,
+        'complete': len(report) == len(entities) and all(item['cycle_complete'] for item in report.values()),
+        'transfer': {
+            'calls': budget['calls'],
+            'bytes': budget['bytes'],
+            'full_resync_calls_estimate': full_calls,
+            'full_resync_bytes_estimate': full_bytes_total,
+            'calls_saved': max(0, full_calls - budget['calls']),
+            'bytes_saved': max(0, full_bytes_total - budget['bytes']) if full_bytes_total is not None else None
+        },
+        'elapsed_ms': int((time.time() - started) * 1000)
+    }
+
+def reconcile_entity(cur, entity: str, budget: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Цикл сверки одного зеркала:
+    1. scan - записи с DATE_MODIFY не раньше водяного знака прошлого цикла (в первом цикле - все),
+       постранично по ID; расхождения (ID, DATE_MODIFY) с зеркалом догружаются. После прохода всё,
+       что менялось в Битрикс24, совпадает с зеркалом.
+    2. tree - удалённые в Битрикс24 записи: дерево диапазонов ID. Контрольная сумма диапазона -
+       количество записей и 50 последних изменённых (ID, DATE_MODIFY): в Битрикс24 это одна страница
+       списка с total, локально - два индексных запроса. Совпавшие диапазоны пропускаются,
+       несовпавшие делятся пополам до диапазонов из одной страницы, где сравниваются все ID.
+    '''
+    config = RECONCILE_ENTITIES[entity]
+    report: Dict[str, Any] = {
+        'phase': None, 'listed': 0, 'ranges_checked': 0, 'ranges_matched': 0, 'leaves_compared': 0,
+        'changed': 0, 'deleted': 0, 'cycle_complete': False,
+        'full_resync_calls_estimate': 0, 'full_resync_bytes_estimate': None, 'errors': []
+    }
+    
+    cur.execute("SELECT * FROM mirror_reconcile_state WHERE entity = %s", (entity,))
+    state = dict(cur.fetchone() or {'watermark': None, 'scan_after_id': None, 'scan_watermark': None, 'pending_ranges': None, 'avg_entity_bytes': None})
+    if state['scan_after_id'] is None and state['pending_ranges'] is None:
+        state['scan_after_id'] = 0
+        state['scan_watermark'] = state['watermark']
+    
+    fetch_stats = {'bytes': 0, 'entities': 0}
+    
+    # Проход 1: изменённые с прошлого цикла (с запасом RECONCILE_OVERLAP_MINUTES на задержки событий)
+    if state['scan_after_id'] is not None:
+        report['phase'] = 'scan'
+        since_filter = []
+        if state['watermark']:
+            overlap = timedelta(minutes=int(os.environ.get('RECONCILE_OVERLAP_MINUTES', '10')))
+            since = datetime.fromisoformat(state['watermark']) - overlap
+            since_filter = [('filter[>=DATE_MODIFY]', since.isoformat())]
+        
+        while budget['calls'] < budget['max_calls']:
+            page = reconcile_bitrix_call(config['method'], config['filter'] + since_filter + [
+                ('filter[>ID]', state['scan_after_id']), ('order[ID]', 'ASC'),
+                ('select[]', 'ID'), ('select[]', 'DATE_MODIFY'), ('start', -1)
+            ], budget)
+            if page is None:
+                report['errors'].append(f"{config['method']} failed after ID {state['scan_after_id']}")
+                break
             
-            if result.get('result'):
-                deals = result['result']
-                print(f"[DEBUG] Found {len(deals)} deals")
-                return deals
-            else:
-                print(f"[DEBUG] No deals found or error: {result}")
-                return []
+            remote_rows = {int(row['ID']): row.get('DATE_MODIFY') for row in page['result']}
+            report['listed'] += len(remote_rows)
+            if remote_rows:
+                cur.execute(
+                    f"SELECT id_num, date_modify FROM {config['table']} WHERE {config['where']} AND id_num = ANY(%s)",
+                    (list(remote_rows.keys()),)
+                )
+                local_rows = {row['id_num']: row['date_modify'] for row in cur.fetchall()}
+                changed_ids = [str(item_id) for item_id, date_modify in remote_rows.items() if local_rows.get(item_id) != date_modify]
+                if not reconcile_apply(cur, config, changed_ids, [], budget, report, fetch_stats):
+                    break
+                state['scan_after_id'] = max(remote_rows.keys())
+                state['scan_watermark'] = max([state['scan_watermark'] or ''] + [value or '' for value in remote_rows.values()]) or None
+            
+            if len(remote_rows) < RECONCILE_PAGE_SIZE:
+                state['scan_after_id'] = None
+                break
+        
+        # Проход 1 завершён - дерево начинается с корня: от 1 до максимального ID (определяется в проходе 2)
+        if state['scan_after_id'] is None:
+            state['pending_ranges'] = [[1, None]]
+    
+    # Проход 2: дерево диапазонов ID
+    if state['scan_after_id'] is None and state['pending_ranges'] and budget['calls'] < budget['max_calls']:
+        report['phase'] = 'tree'
+        stack = [tuple(item) for item in reversed(state['pending_ranges'])]
+        
+        while stack and budget['calls'] < budget['max_calls']:
+            lo, hi = stack.pop()
+            if hi is None:
+                # Корень: от 1 до максимального ID с любой из сторон
+                root = reconcile_bitrix_call(config['method'], config['filter'] + [
+                    ('order[ID]', 'DESC'), ('select[]', 'ID'), ('start', 0)
+                ], budget)
+                if root is None:
+                    report['errors'].append(f"{config['method']} unavailable")
+                    stack.append((lo, hi))
+                    break
+                cur.execute(f"SELECT COALESCE(MAX(id_num), 0) AS max_id FROM {config['table']} WHERE {config['where']}")
+                hi = max(int(root['result'][0]['ID']) if root['result'] else 0, cur.fetchone()['max_id']) + 1
+                stack.append((lo, hi))
+                continue
+            
+            remote = reconcile_bitrix_call(config['method'], config['filter'] + [
+                ('filter[>=ID]', lo), ('filter[<ID]', hi),
+                ('order[DATE_MODIFY]', 'DESC'), ('order[ID]', 'DESC'),
+                ('select[]', 'ID'), ('select[]', 'DATE_MODIFY'), ('start', 0)
+            ], budget)
+            if remote is None:
+                report['errors'].append(f"{config['method']} failed on range {lo}-{hi}")
+                stack.append((lo, hi))
+                break
+            report['ranges_checked'] += 1
+            remote_total = int(remote.get('total', len(remote['result'])))
+            remote_rows = [(int(row['ID']), row.get('DATE_MODIFY')) for row in remote['result']]
+            
+            cur.execute(
+                f"SELECT COUNT(*) AS total FROM {config['table']} WHERE {config['where']} AND id_num >= %s AND id_num < %s",
+                (lo, hi)
+            )
+            local_total = cur.fetchone()['total']
+            cur.execute(
+                f"""
+                SELECT id_num, date_modify FROM {config['table']}
+                WHERE {config['where']} AND id_num >= %s AND id_num < %s
+                ORDER BY date_modify DESC, id_num DESC
+                LIMIT %s
+                """,
+                (lo, hi, RECONCILE_PAGE_SIZE)
+            )
+            local_rows = [(row['id_num'], row['date_modify']) for row in cur.fetchall()]
+            
+            if range_checksum(remote_total, remote_rows) == range_checksum(local_total, local_rows):
+                report['ranges_matched'] += 1
+                continue
+            
+            # Весь диапазон уместился в одну страницу - сравниваем поштучно
+            if remote_total <= len(remote_rows):
+                report['leaves_compared'] += 1
+                remote_map = dict(remote_rows)
+                cur.execute(
+                    f"SELECT id_num, date_modify FROM {config['table']} WHERE {config['where']} AND id_num >= %s AND id_num < %s",
+                    (lo, hi)
+                )
+                local_map = {row['id_num']: row['date_modify'] for row in cur.fetchall()}
+                changed_ids = [str(item_id) for item_id, date_modify in remote_map.items() if local_map.get(item_id) != date_modify]
+                deleted_ids = [str(item_id) for item_id in local_map if item_id not in remote_map]
+                if not reconcile_apply(cur, config, changed_ids, deleted_ids, budget, report, fetch_stats):
+                    stack.append((lo, hi))
+                    break
+                continue
+            
+            mid = (lo + hi) // 2
+            stack.append((mid, hi))
+            stack.append((lo, mid))
+        
+        state['pending_ranges'] = [list(item) for item in reversed(stack)] or None
+        if state['pending_ranges'] is None:
+            # Цикл завершён: следующий проход 1 начнётся с максимального DATE_MODIFY этого цикла
+            report['cycle_complete'] = True
+            state['watermark'] = state['scan_watermark'] or state['watermark']
+    
+    if fetch_stats['entities']:
+        state['avg_entity_bytes'] = int(fetch_stats['bytes'] / fetch_stats['entities'])
     
+    # Полная перезагрузка = все записи зеркала целиком, страницами по 50
+    cur.execute(f"SELECT COUNT(*) AS total FROM {config['table']} WHERE {config['where']}")
+    mirror_total = cur.fetchone()['total']
+    report['full_resync_calls_estimate'] = math.ceil(mirror_total / RECONCILE_PAGE_SIZE)
+    if state['avg_entity_bytes']:
+        report['full_resync_bytes_estimate'] = mirror_total * state['avg_entity_bytes']
+    
+    cur.execute(
+        """
+        INSERT INTO mirror_reconcile_state (entity, watermark, scan_after_id, scan_watermark, pending_ranges, avg_entity_bytes, last_report, cycle_completed_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s::jsonb, %s, %s::jsonb, CASE WHEN %s THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+        ON CONFLICT (entity) DO UPDATE SET
+            watermark = EXCLUDED.watermark, scan_after_id = EXCLUDED.scan_after_id, scan_watermark = EXCLUDED.scan_watermark,
+            pending_ranges = EXCLUDED.pending_ranges, avg_entity_bytes = EXCLUDED.avg_entity_bytes, last_report = EXCLUDED.last_report,
+            cycle_completed_at = COALESCE(EXCLUDED.cycle_completed_at, mirror_reconcile_state.cycle_completed_at), updated_at = CURRENT_TIMESTAMP
+        """,
+        (
+            entity, state['watermark'], state['scan_after_id'], state['scan_watermark'],
+            json.dumps(state['pending_ranges']) if state['pending_ranges'] is not None else None,
+            state['avg_entity_bytes'], json.dumps(report, ensure_ascii=False), report['cycle_complete']
+        )
+    )
+    log('INFO', 'flow', lambda: f"Reconcile {entity}: phase {report['phase']}, {report['listed']} listed, {report['ranges_checked']} ranges, {report['changed']} changed, {report['deleted']} deleted")
+    
+    return report
+
+def reconcile_apply(cur, config: Dict[str, Any], changed_ids: List[str], deleted_ids: List[str], budget: Dict[str, Any], report: Dict[str, Any], fetch_stats: Dict[str, int]) -> bool:
+    '''Догружает изменившиеся записи по 50 ID и применяет изменения к зеркалу; False - ошибка REST'''
+    fetched: List[Dict[str, Any]] = []
+    for start in range(0, len(changed_ids), RECONCILE_PAGE_SIZE):
+        bytes_before = budget['bytes']
+        page = reconcile_bitrix_call(config['method'], config['filter'] + [
+            ('filter[@ID][]', item_id) for item_id in changed_ids[start:start + RECONCILE_PAGE_SIZE]
+        ] + [('select[]', field) for field in config['select']], budget)
+        if page is None:
+            report['errors'].append(f"{config['method']} failed on refetch")
+            return False
+        fetch_stats['bytes'] += budget['bytes'] - bytes_before
+        fetch_stats['entities'] += len(page['result'])
+        fetched.extend(page['result'])
+    
+    # Удалены между листингом и догрузкой
+    fetched_ids = {str(item['ID']) for item in fetched}
+    deleted_ids = deleted_ids + [item_id for item_id in changed_ids if item_id not in fetched_ids]
+    
+    if fetched:
+        config['apply'](cur, fetched)
+    if deleted_ids:
+        config['delete'](cur, deleted_ids)
+    report['changed'] += len(fetched)
+    report['deleted'] += len(deleted_ids)
+    return True
+
+def range_checksum(total: int, rows: List[Tuple[int, Optional[str]]]) -> str:
+    '''Контрольная сумма диапазона: количество + последние изменённые (ID, DATE_MODIFY)'''
+    digest = hashlib.md5(str(total).encode('utf-8'))
+    for item_id, date_modify in sorted(rows, key=lambda row: (row[1] or '', row[0]), reverse=True):
+        digest.update(f"|{item_id}:{date_modify or ''}".encode('utf-8'))
+    return digest.hexdigest()
+
+def reconcile_bitrix_call(method: str, params_list: List[Tuple[str, Any]], budget: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''Вызов списочного метода Битрикс24 с учётом числа запросов и переданных байт; None - при ошибке'''
+    bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if not bitrix_webhook:
+        return None
+    
+    # Не чаще RECONCILE_CALLS_PER_SECOND запросов в секунду (лимит REST Битрикс24 - 2 в секунду)
+    min_interval = 1.0 / float(os.environ.get('RECONCILE_CALLS_PER_SECOND', '2'))
+    wait = budget.get('last_call_at', 0) + min_interval - time.time()
+    if wait > 0:
+        time.sleep(wait)
+    
+    url = f"{bitrix_webhook.rstrip('/')}/{method}.json"
+    try:
+        req = urllib.request.Request(url, data=urllib.parse.urlencode(params_list).encode('utf-8'))
+        with urllib.request.urlopen(req, timeout=15) as response:
+            raw = response.read()
     except Exception as e:
-        print(f"[DEBUG] Exception getting deals: {type(e).__name__}: {str(e)}")
-        return []
+        log('WARN', 'bitrix', f"{method} error: {type(e).__name__}: {str(e)}")
+        return None
+    finally:
+        budget['last_call_at'] = time.time()
+        budget['calls'] += 1
+    
+    budget['bytes'] += len(raw)
+    result = json.loads(raw.decode('utf-8'))
+    if 'result' not in result:
+        log('WARN', 'bitrix', f"{method} error: {result.get('error_description', result.get('error'))}")
+        return None
+    return result
+
+def apply_reconciled_companies(cur, companies: List[Dict[str, Any]]) -> None:
+    '''Изменившиеся компании - в зеркало companies; ИНН берём из зеркала реквизитов, иначе оставляем прежний'''
+    company_ids = [str(company['ID']) for company in companies]
+    cur.execute(
+        "SELECT DISTINCT ON (company_id) company_id, inn FROM company_requisites WHERE company_id = ANY(%s) AND inn <> '' ORDER BY company_id, id_num",
+        (company_ids,)
+    )
+    inns = {row['company_id']: row['inn'] for row in cur.fetchall()}
+    cur.execute("SELECT bitrix_id, inn FROM companies WHERE bitrix_id = ANY(%s)", (company_ids,))
+    known_inns = {row['bitrix_id']: row['inn'] for row in cur.fetchall()}
+    
+    for company in companies:
+        company_id = str(company['ID'])
+        inn = inns.get(company_id) or known_inns.get(company_id) or ''
+        save_company_mirror(cur, company_id, inn, company.get('TITLE', ''), company)
+
+def delete_reconciled_companies(cur, company_ids: List[str]) -> None:
+    cur.execute("DELETE FROM companies WHERE bitrix_id = ANY(%s)", (company_ids,))
+    cur.execute("DELETE FROM company_cards WHERE bitrix_id = ANY(%s)", (company_ids,))
+
+def apply_reconciled_requisites(cur, requisites: List[Dict[str, Any]]) -> None:
+    '''Реквизиты - в зеркало company_requisites, изменившийся ИНН переносится в companies'''
+    for requisite in requisites:
+        company_id = str(requisite.get('ENTITY_ID', ''))
+        inn = str(requisite.get('RQ_INN') or '').strip()[:12]
+        cur.execute(
+            """
+            INSERT INTO company_requisites (requisite_id, company_id, inn, date_modify, requisite, updated_at)
+            VALUES (%s, %s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (requisite_id) DO UPDATE SET
+                company_id = EXCLUDED.company_id, inn = EXCLUDED.inn, date_modify = EXCLUDED.date_modify,
+                requisite = EXCLUDED.requisite, updated_at = CURRENT_TIMESTAMP
+            """,
+            (str(requisite['ID']), company_id, inn, requisite.get('DATE_MODIFY'), json.dumps(requisite, ensure_ascii=False))
+        )
+        if inn:
+            cur.execute(
+                "UPDATE companies SET inn = %s, updated_at = CURRENT_TIMESTAMP WHERE bitrix_id = %s AND inn <> %s",
+                (inn, company_id, inn)
+            )
+            inn_filter_add(inn)
+
+def delete_reconciled_requisites(cur, requisite_ids: List[str]) -> None:
+    cur.execute("DELETE FROM company_requisites WHERE requisite_id = ANY(%s)", (requisite_ids,))
+
+def apply_reconciled_deals(cur, deals: List[Dict[str, Any]]) -> None:
+    '''Изменившиеся сделки - в карту deal_company_map (как это делает bitrix-deal-tracker по событиям)'''
+    for deal in deals:
+        company_id = str(deal.get('COMPANY_ID') or '')
+        cur.execute(
+            """
+            INSERT INTO deal_company_map (deal_id, company_id, deal_data, date_modify, deleted, updated_at)
+            VALUES (%s, %s, %s::jsonb, %s, FALSE, CURRENT_TIMESTAMP)
+            ON CONFLICT (deal_id) DO UPDATE SET
+                company_id = EXCLUDED.company_id, deal_data = EXCLUDED.deal_data,
+                date_modify = EXCLUDED.date_modify, deleted = FALSE, updated_at = CURRENT_TIMESTAMP
+            """,
+            (str(deal['ID']), company_id if company_id not in ('', '0') else None, json.dumps(deal, ensure_ascii=False), deal.get('DATE_MODIFY'))
+        )
+
+def delete_reconciled_deals(cur, deal_ids: List[str]) -> None:
+    cur.execute(
+        "UPDATE deal_company_map SET deleted = TRUE, updated_at = CURRENT_TIMESTAMP WHERE deal_id = ANY(%s)",
+        (deal_ids,)
+    )
+
+# Зеркала для сверки: списочный метод Битрикс24, локальная таблица и обработчики расхождений
+RECONCILE_ENTITIES: Dict[str, Dict[str, Any]] = {
+    'companies': {
+        'method': 'crm.company.list', 'filter': [], 'select': ['*', 'UF_*', 'PHONE', 'EMAIL'],
+        'table': 'companies', 'where': 'TRUE',
+        'apply': apply_reconciled_companies, 'delete': delete_reconciled_companies
+    },
+    'requisites': {
+        'method': 'crm.requisite.list', 'filter': [('filter[ENTITY_TYPE_ID]', '4')], 'select': ['*'],
+        'table': 'company_requisites', 'where': 'TRUE',
+        'apply': apply_reconciled_requisites, 'delete': delete_reconciled_requisites
+    },
+    'deals': {
+        'method': 'crm.deal.list', 'filter': [], 'select': ['*', 'UF_*'],
+        'table': 'deal_company_map', 'where': 'deleted = FALSE',
+        'apply': apply_reconciled_deals, 'delete': delete_reconciled_deals
+    }
+}
 
 def delete_bitrix_company(company_id: str) -> Dict[str, Any]:
     '''Удаляет компанию из Битрикс24'''
@@ -916,17 +2341,194 @@ def delete_bitrix_company(company_id: str) -> Dict[str, Any]:
             result = json.loads(response.read().decode('utf-8'))
             
             if result.get('result'):
-                print(f"[DEBUG] Company {company_id} deleted successfully")
+                log('DEBUG', 'flow', f"Company {company_id} deleted successfully")
                 return {'success': True, 'data': result}
             else:
                 error_msg = result.get('error_description', 'Unknown error')
-                print(f"[DEBUG] Delete error: {error_msg}")
+                log('WARN', 'flow', f"Delete error: {error_msg}")
                 return {'success': False, 'error': error_msg}
     
     except Exception as e:
-        print(f"[DEBUG] Exception deleting company: {type(e).__name__}: {str(e)}")
+        log('WARN', 'flow', f"Exception deleting company: {type(e).__name__}: {str(e)}")
         return {'success': False, 'error': str(e)}
 
+def bulk_check_companies(cur, company_ids: List[str], inns: List[str]) -> Dict[str, Any]:
+    '''
+    Массовая проверка уникальности ИНН.
+    Существование компаний - один crm.company.list на 50 ID, их ИНН - один crm.requisite.list
+    на 50 ID (RQ_INN вместе с отпечатком реквизитов); кеш карточек используется только при
+    совпадении DATE_MODIFY и отпечатка, полные карточки не запрашиваются.
+    Все ИНН ищутся одним crm.requisite.list с фильтром @RQ_INN (пачками)
+    '''
+    started = time.time()
+    items: List[Dict[str, Any]] = []
+    
+    # 1. ИНН по ID компаний
+    company_inns: Dict[str, str] = {}
+    valid_ids = [company_id for company_id in dict.fromkeys(company_ids) if company_id.isdigit()]
+    existing_input = get_companies_date_modify(valid_ids) if valid_ids else {}
+    requisites_by_company = get_companies_requisites(list(existing_input)) if existing_input else {}
+    if existing_input and requisites_by_company is not None:
+        cur.execute(
+            "SELECT bitrix_id, card, date_modify, requisites_stamp FROM company_cards WHERE bitrix_id = ANY(%s)",
+            (list(existing_input),)
+        )
+        cached_cards = {row['bitrix_id']: row for row in cur.fetchall()}
+        for company_id in existing_input:
+            requisites = requisites_by_company.get(company_id, [])
+            cached = cached_cards.get(company_id)
+            if cached and cached['date_modify'] == existing_input[company_id].get('DATE_MODIFY') \
+                    and cached['requisites_stamp'] == requisites_stamp_of(requisites):
+                company_inns[company_id] = (cached['card'].get('RQ_INN') or '').strip()
+            else:
+                company_inns[company_id] = get_inn_from_requisites(requisites)
+    
+    # 2. Все ИНН - одним пакетным поиском реквизитов
+    lookup_inns = [inn for inn in dict.fromkeys(inns + list(company_inns.values())) if is_valid_inn(inn)]
+    companies_by_inn = find_companies_by_inns(lookup_inns)
+    
+    for company_id in company_ids:
+        item: Dict[str, Any] = {'input': company_id, 'type': 'company_id'}
+        if not company_id.isdigit():
+            item['status'] = 'invalid'
+        elif existing_input is None or requisites_by_company is None or companies_by_inn is None:
+            item['status'] = 'error'
+        elif company_id not in company_inns:
+            item['status'] = 'not_found'
+        elif not company_inns[company_id]:
+            item['status'] = 'no_inn'
+        else:
+            inn = company_inns[company_id]
+            others = [other for other in companies_by_inn.get(inn, []) if other['ID'] != company_id]
+            item.update({'inn': inn, 'status': 'duplicate' if others else 'unique', 'companies': others})
+        items.append(item)
+    
+    for inn in inns:
+        item = {'input': inn, 'type': 'inn', 'inn': inn}
+        if not is_valid_inn(inn):
+            item['status'] = 'invalid'
+        elif companies_by_inn is None:
+            item['status'] = 'error'
+        else:
+            found = companies_by_inn.get(inn, [])
+            item.update({'status': 'exists' if found else 'unique', 'companies': found})
+        items.append(item)
+    
+    # Повторы внутри самого списка (например, две строки импорта с одним ИНН)
+    inn_counts: Dict[str, int] = {}
+    for item in items:
+        if item.get('inn'):
+            inn_counts[item['inn']] = inn_counts.get(item['inn'], 0) + 1
+    for item in items:
+        if item.get('inn') and inn_counts[item['inn']] > 1:
+            item['repeated_in_batch'] = True
+    
+    summary: Dict[str, Any] = {'total': len(items)}
+    for item in items:
+        summary[item['status']] = summary.get(item['status'], 0) + 1
+    summary['elapsed_ms'] = int((time.time() - started) * 1000)
+    log('INFO', 'flow', lambda: f"Bulk check: {json.dumps(summary)}")
+    
+    return {'items': items, 'summary': summary}
+
+def is_valid_inn(inn: str) -> bool:
+    return inn.isdigit() and len(inn) in (10, 12)
+
+def find_companies_by_inns(inns: List[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    '''
+    {ИНН: [существующие компании]} через crm.requisite.list с фильтром @RQ_INN
+    (по 100 ИНН в запросе, постранично). None - если Битрикс24 недоступен
+    '''
+    bitrix_webhook = os.environ.get('BITRIX24_WEBHOOK_URL', '')
+    if not bitrix_webhook:
+        return None
+    if not inns:
+        return {}
+    
+    url = f"{bitrix_webhook.rstrip('/')}/crm.requisite.list.json"
+    company_ids_by_inn: Dict[str, set] = {}
+    
+    try:
+        for chunk_start in range(0, len(inns), 100):
+            start = 0
+            while start is not None:
+                params_list = [('filter[@RQ_INN][]', inn) for inn in inns[chunk_start:chunk_start + 100]]
+                params_list += [
+                    ('filter[ENTITY_TYPE_ID]', '4'),
+                    ('select[]', 'ENTITY_ID'),
+                    ('select[]', 'RQ_INN'),
+                    ('start', start)
+                ]
+                req = urllib.request.Request(url, data=urllib.parse.urlencode(params_list).encode('utf-8'))
+                with urllib.request.urlopen(req, timeout=20) as response:
+                    result = json.loads(response.read().decode('utf-8'))
+                
+                if 'result' not in result:
+                    log('WARN', 'bitrix', f"crm.requisite.list error: {result.get('error_description', result.get('error'))}")
+                    return None
+                for requisite in result['result']:
+                    inn = str(requisite.get('RQ_INN', '')).strip()
+                    if requisite.get('ENTITY_ID'):
+                        company_ids_by_inn.setdefault(inn, set()).add(str(requisite['ENTITY_ID']))
+                start = result.get('next')
+    except Exception as e:
+        log('WARN', 'bitrix', f"Error searching requisites by INN list: {type(e).__name__}: {str(e)}")
+        return None
+    
+    # Реквизиты удалённых компаний не считаем
+    all_ids = sorted({company_id for ids in company_ids_by_inn.values() for company_id in ids})
+    existing = get_companies_date_modify(all_ids) if all_ids else {}
+    if existing is None:
+        return None
+    
+    return {
+        inn: [
+            {'ID': company_id, 'TITLE': existing[company_id].get('TITLE', '')}
+            for company_id in sorted(ids) if company_id in existing
+        ]
+        for inn, ids in company_ids_by_inn.items()
+    }
+
+def response_ndjson(status_code: int, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/x-ndjson',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows) + '\n'
+    }
+
+def next_since_id(rows: List[Dict[str, Any]], since_id: str) -> int:
+    '''
+    Курсор since_id для следующего опроса. id выдаются до коммита, поэтому строка с меньшим id
+    может стать видимой позже строки с большим: курсор не сдвигается дальше первой строки моложе
+    CURSOR_SETTLE_SECONDS (колонка settled), такие строки придут повторно - клиент сливает их по id
+    '''
+    current = int(since_id) if since_id.isdigit() else 0
+    unsettled = [row['id'] for row in rows if not row['settled']]
+    if unsettled:
+        return max(min(unsettled) - 1, current)
+    return max([row['id'] for row in rows], default=current)
+
+def parse_since_ts(since_ts: str) -> Tuple[str, int]:
+    '''Курсор since_ts "время|id" -> (время, id); старый курсор без id - (время, 0)'''
+    ts, _, row_id = since_ts.partition('|')
+    return ts, int(row_id) if row_id.isdigit() else 0
+
+def next_since_ts(rows: List[Dict[str, Any]], ts_field: str, since_ts: str) -> Optional[str]:
+    '''
+    Курсор since_ts для следующего опроса: старший ключ (время, id) среди строк старше
+    CURSOR_SETTLE_SECONDS. Время ставится в начале транзакции записи, поэтому более свежие строки
+    (и ещё не видимые строки с тем же временем) курсор не проходит - они придут повторно
+    '''
+    settled = [(row[ts_field], row['id']) for row in rows if row['settled'] and isinstance(row.get(ts_field), datetime)]
+    if not settled:
+        return since_ts or None
+    ts, row_id = max(settled)
+    return f"{ts.isoformat()}|{row_id}"
+
 def response_json(status_code: int, data: Dict) -> Dict[str, Any]:
     return {
         'statusCode': status_code,
@@ -944,15 +2546,18 @@ def diagnose_inn_duplicates(inn: str, cur) -> Dict[str, Any]:
     1. Находит активные компании через crm.company.list
     2. Для каждой компании получает ВСЕ реквизиты с RQ_NAME
     3. Формирует таблицу: по одной строке на каждый реквизит
+    4. Ищет нечёткие дубли этих компаний в локальном зеркале companies
     '''
     result = {
         'inn': inn,
         'bitrix_companies': [],
         'requisites_in_db': [],
+        'fuzzy_duplicates': {'matches': [], 'total_matches': 0},
         'summary': {
             'total_bitrix': 0,
             'total_requisites': 0,
-            'orphaned_requisites': 0
+            'orphaned_requisites': 0,
+            'fuzzy_matches': 0
         }
     }
     
@@ -962,14 +2567,12 @@ def diagnose_inn_duplicates(inn: str, cur) -> Dict[str, Any]:
     
     try:
         # 1. Получаем компании с ИНН через crm.company.list
-        params_dict = {
-            'filter[RQ_INN]': inn,
-        }
-        for field in ['ID', 'TITLE', 'DATE_CREATE', 'COMPANY_TYPE', 'PHONE', 'EMAIL']:
-            params_dict[f'select[]'] = field
+        params_list = [('filter[RQ_INN]', inn)]
+        for field in ['ID', 'TITLE', 'DATE_CREATE', 'DATE_MODIFY', 'COMPANY_TYPE', 'PHONE', 'EMAIL']:
+            params_list.append(('select[]', field))
         
         url = f"{bitrix_webhook.rstrip('/')}/crm.company.list.json"
-        data = urllib.parse.urlencode(params_dict).encode('utf-8')
+        data = urllib.parse.urlencode(params_list).encode('utf-8')
         req = urllib.request.Request(url, data=data)
         
         companies = []
@@ -978,77 +2581,87 @@ def diagnose_inn_duplicates(inn: str, cur) -> Dict[str, Any]:
             
             if companies_result.get('result'):
                 companies = companies_result['result']
-                print(f"[DEBUG] Found {len(companies)} active companies")
+                log('DEBUG', 'flow', f"Found {len(companies)} active companies")
         
         # 2. Для КАЖДОЙ компании получаем ВСЕ реквизиты (включая RQ_NAME)
         all_requisites_data = []
+        stamps = get_requisites_stamps([str(company['ID']) for company in companies]) if companies else {}
         
         for company in companies:
             company_id = str(company['ID'])
             
-            # Получаем реквизиты компании
-            params = urllib.parse.urlencode({
-                'filter[ENTITY_ID]': company_id,
-                'filter[ENTITY_TYPE_ID]': '4',
-            })
-            req_url = f"{bitrix_webhook.rstrip('/')}/crm.requisite.list.json?{params}"
-            
+            # Реквизиты компании из кеша карточек (DATE_MODIFY и отпечатки реквизитов уже получены пакетно)
             try:
-                with urllib.request.urlopen(req_url, timeout=5) as req_response:
-                    req_data = json.loads(req_response.read().decode('utf-8'))
-                    
-                    if req_data.get('result'):
-                        for req_item in req_data['result']:
-                            # Проверяем ИНН (может быть с пробелами или в другом формате)
-                            req_inn = str(req_item.get('RQ_INN', '')).strip()
-                            search_inn = str(inn).strip()
+                card_result = get_company_card(cur, company_id, company.get('DATE_MODIFY'), (stamps or {}).get(company_id))
+                
+                if card_result.get('success'):
+                    for req_item in card_result['company'].get('REQUISITES', []):
+                        # Проверяем ИНН (может быть с пробелами или в другом формате)
+                        req_inn = str(req_item.get('RQ_INN', '')).strip()
+                        search_inn = str(inn).strip()
+                        
+                        if req_inn == search_inn:
+                            phone_value = ''
+                            if company.get('PHONE') and isinstance(company['PHONE'], list) and len(company['PHONE']) > 0:
+                                phone_value = company['PHONE'][0].get('VALUE', '')
+                            
+                            email_value = ''
+                            if company.get('EMAIL') and isinstance(company['EMAIL'], list) and len(company['EMAIL']) > 0:
+                                email_value = company['EMAIL'][0].get('VALUE', '')
                             
-                            if req_inn == search_inn:
-                                phone_value = ''
-                                if company.get('PHONE') and isinstance(company['PHONE'], list) and len(company['PHONE']) > 0:
-                                    phone_value = company['PHONE'][0].get('VALUE', '')
-                                
-                                email_value = ''
-                                if company.get('EMAIL') and isinstance(company['EMAIL'], list) and len(company['EMAIL']) > 0:
-                                    email_value = company['EMAIL'][0].get('VALUE', '')
-                                
-                                all_requisites_data.append({
-                                    'ID': company_id,
-                                    'REQUISITE_ID': req_item.get('ID', ''),
-                                    'TITLE': company.get('TITLE', ''),
-                                    'RQ_NAME': req_item.get('RQ_NAME', ''),
-                                    'DATE_CREATE': company.get('DATE_CREATE', ''),
-                                    'is_active': True,
-                                    'COMPANY_TYPE': company.get('COMPANY_TYPE', ''),
-                                    'RQ_INN': req_item.get('RQ_INN', inn),
-                                    'RQ_KPP': req_item.get('RQ_KPP', ''),
-                                    'PHONE': phone_value,
-                                    'EMAIL': email_value,
-                                })
-                                
-                                result['requisites_in_db'].append({
-                                    'id': req_item.get('ID', ''),
-                                    'entity_id': company_id,
-                                    'entity_type_id': req_item.get('ENTITY_TYPE_ID', ''),
-                                    'inn': req_item.get('RQ_INN', ''),
-                                    'company_exists': True
-                                })
-                            else:
-                                print(f"[DEBUG] Skipping requisite: INN mismatch '{req_inn}' != '{search_inn}'")
+                            all_requisites_data.append({
+                                'ID': company_id,
+                                'REQUISITE_ID': req_item.get('ID', ''),
+                                'TITLE': company.get('TITLE', ''),
+                                'RQ_NAME': req_item.get('RQ_NAME', ''),
+                                'DATE_CREATE': company.get('DATE_CREATE', ''),
+                                'is_active': True,
+                                'COMPANY_TYPE': company.get('COMPANY_TYPE', ''),
+                                'RQ_INN': req_item.get('RQ_INN', inn),
+                                'RQ_KPP': req_item.get('RQ_KPP', ''),
+                                'PHONE': phone_value,
+                                'EMAIL': email_value,
+                            })
+                            
+                            result['requisites_in_db'].append({
+                                'id': req_item.get('ID', ''),
+                                'entity_id': company_id,
+                                'entity_type_id': req_item.get('ENTITY_TYPE_ID', ''),
+                                'inn': req_item.get('RQ_INN', ''),
+                                'company_exists': True
+                            })
+                        else:
+                            log('DEBUG', 'flow', f"Skipping requisite: INN mismatch '{req_inn}' != '{search_inn}'")
+                else:
+                    log('WARN', 'flow', f"Failed to get requisites for company {company_id}: {card_result.get('error')}")
             except Exception as e:
-                print(f"[ERROR] Failed to get requisites for company {company_id}: {e}")
+                log('ERROR', 'flow', f"Failed to get requisites for company {company_id}: {e}")
         
         result['bitrix_companies'] = all_requisites_data
+        
+        # 3. Нечёткие дубли: похожее название, общий телефон или email (в т.ч. компании без ИНН)
+        fuzzy_targets = [
+            prepare_fuzzy_company(
+                company['ID'], inn, company.get('TITLE', ''),
+                company['PHONE'][0].get('VALUE', '') if isinstance(company.get('PHONE'), list) and company['PHONE'] else '',
+                company['EMAIL'][0].get('VALUE', '') if isinstance(company.get('EMAIL'), list) and company['EMAIL'] else ''
+            )
+            for company in companies
+        ]
+        if fuzzy_targets:
+            result['fuzzy_duplicates'] = find_fuzzy_duplicates(cur, fuzzy_targets)
+            result['summary']['fuzzy_matches'] = result['fuzzy_duplicates']['total_matches']
+        
         result['summary']['total_bitrix'] = len(companies)
         result['summary']['total_requisites'] = len(all_requisites_data)
         result['summary']['orphaned_requisites'] = 0  # Все реквизиты привязаны к активным компаниям
         
-        print(f"[DEBUG] Result: {len(all_requisites_data)} requisites from {len(companies)} active companies")
+        log('DEBUG', 'flow', f"Result: {len(all_requisites_data)} requisites from {len(companies)} active companies")
     
     except Exception as e:
-        print(f"[ERROR] Failed to diagnose INN: {e}")
+        log('ERROR', 'flow', f"Failed to diagnose INN: {e}")
         import traceback
-        traceback.print_exc()
+        log('ERROR', 'flow', traceback.format_exc)
     
     return result
 
@@ -1091,7 +2704,7 @@ def clean_orphaned_requisites(inn: str) -> Dict[str, Any]:
             # Если компания не существует - удаляем реквизит
             if entity_id not in active_company_ids:
                 req_id = req.get('ID')
-                print(f"[DEBUG] Deleting orphaned requisite {req_id} (company {entity_id} not found)")
+                log('DEBUG', 'flow', f"Deleting orphaned requisite {req_id} (company {entity_id} not found)")
                 
                 delete_url = f"{bitrix_webhook.rstrip('/')}/crm.requisite.delete.json"
                 delete_data = urllib.parse.urlencode({'id': req_id}).encode('utf-8')
@@ -1102,9 +2715,9 @@ def clean_orphaned_requisites(inn: str) -> Dict[str, Any]:
                         delete_result = json.loads(delete_response.read().decode('utf-8'))
                         if delete_result.get('result'):
                             cleaned_count += 1
-                            print(f"[DEBUG] Successfully deleted requisite {req_id}")
+                            log('DEBUG', 'flow', f"Successfully deleted requisite {req_id}")
                 except Exception as e:
-                    print(f"[ERROR] Failed to delete requisite {req_id}: {e}")
+                    log('ERROR', 'flow', f"Failed to delete requisite {req_id}: {e}")
         
         return {
             'success': True,
@@ -1113,7 +2726,7 @@ def clean_orphaned_requisites(inn: str) -> Dict[str, Any]:
         }
     
     except Exception as e:
-        print(f"[ERROR] Failed to clean orphaned requisites: {e}")
+        log('ERROR', 'flow', f"Failed to clean orphaned requisites: {e}")
         return {
             'success': False,
             'error': str(e),
@@ -1128,24 +2741,24 @@ def delete_multiple_companies(company_ids: List[str]) -> Dict[str, Any]:
     deleted = []
     failed = []
     
-    print(f"[DEBUG] Starting bulk delete for {len(company_ids)} companies: {company_ids}")
+    log('DEBUG', 'flow', lambda: f"Starting bulk delete for {len(company_ids)} companies: {company_ids}")
     
     for company_id in company_ids:
-        print(f"[DEBUG] Attempting to delete company {company_id}")
+        log('DEBUG', 'flow', f"Attempting to delete company {company_id}")
         result = delete_bitrix_company(company_id)
         
         if result.get('success'):
             deleted.append(company_id)
-            print(f"[DEBUG] Successfully deleted company {company_id}")
+            log('DEBUG', 'flow', f"Successfully deleted company {company_id}")
         else:
             error_msg = result.get('error', 'Unknown error')
             failed.append({
                 'company_id': company_id,
                 'error': error_msg
             })
-            print(f"[DEBUG] Failed to delete company {company_id}: {error_msg}")
+            log('WARN', 'flow', f"Failed to delete company {company_id}: {error_msg}")
     
-    print(f"[DEBUG] Bulk delete completed: {len(deleted)} deleted, {len(failed)} failed")
+    log('DEBUG', 'flow', f"Bulk delete completed: {len(deleted)} deleted, {len(failed)} failed")
     
     return {
         'success': True,
@@ -1,14 +1,25 @@
 """
 Business: Получение истории изменений сделок из базы данных
-Args: event с queryStringParameters (limit, offset, search)
-Returns: JSON с массивом изменений сделок
+Args: event с queryStringParameters (limit, cursor, search, deal_id, since_id; offset - устаревший;
+      фильтры stage, category_id, assigned_by_id, company_id, event_type - списки через запятую,
+      opportunity_min/opportunity_max, date_from/date_to - ISO дата или дата-время;
+      fields - проекция: колонки, deal_data.КЛЮЧ, changes_summary.КЛЮЧ или * - всё;
+      change_id - полный снимок одного изменения;
+      view=timeline + deal_id - общая лента сделки: версии, откаты, вебхуки закупок)
+Returns: JSON с массивом изменений сделок и next_cursor для следующей страницы
 """
+import base64
 import json
 import os
-from typing import Dict, Any
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Строки моложе этого возраста курсор since_id не проходит (дольше длится транзакция записи - нужен больший запас)
+CURSOR_SETTLE_SECONDS = int(os.environ.get('CURSOR_SETTLE_SECONDS', '60'))
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -32,10 +43,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     params = event.get('queryStringParameters') or {}
-    limit = int(params.get('limit', '50'))
-    offset = int(params.get('offset', '0'))
+    # limit=0 дал бы пустую страницу с курсором из rows[-1], отрицательный offset - ошибку SQL
+    limit = min(max(int(params.get('limit', '50')), 1), 500)
+    offset = max(int(params.get('offset', '0')), 0)
     search = params.get('search', '')
     deal_id = params.get('deal_id', '')
+    since_id = params.get('since_id', '')
+    
+    timeline = params.get('view') == 'timeline'
+    if timeline and not deal_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'deal_id is required for timeline'})
+        }
+    
+    # cursor - непрозрачный курсор из next_cursor предыдущей страницы
+    after = None
+    if params.get('cursor'):
+        after = decode_cursor(params['cursor'], 3 if timeline else 2)
+        if not after:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid cursor'})
+            }
+    
+    try:
+        filters = parse_filters(params)
+        projection = parse_projection(params.get('fields') or DEFAULT_FIELDS)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False)
+        }
     
     dsn = os.environ.get('DATABASE_URL')
     if not dsn:
@@ -48,45 +90,79 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     conn = psycopg2.connect(dsn)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    query = """
-        SELECT 
-            id, deal_id, event_type, deal_data, timestamp_received,
-            modifier_user_id, modifier_user_name, 
-            previous_stage, current_stage, changes_summary
-        FROM deal_changes 
-        WHERE 1=1
-    """
-    query_params = []
-    
-    if deal_id:
-        query += f" AND deal_id = '{deal_id}'"
+    # Полный снимок одного изменения (список по умолчанию отдаёт только ключевые поля)
+    if str(params.get('change_id', '')).isdigit():
+        full_projection = parse_projection('*')
+        select_sql, select_params = build_select_list(full_projection)
+        cursor.execute(f"SELECT {select_sql} FROM deal_changes WHERE id = %s", select_params + [int(params['change_id'])])
+        rows = cursor.fetchall()
+        rebuild_deal_data(cursor, rows)
+        cursor.close()
+        conn.close()
+        if not rows:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Change not found'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'success': True, 'change': format_change(rows[0], full_projection)})
+        }
     
-    if search:
-        search_escaped = search.replace("'", "''")
-        query += f" AND (deal_id LIKE '%{search_escaped}%' OR deal_data::text LIKE '%{search_escaped}%' OR modifier_user_name LIKE '%{search_escaped}%')"
+    # Лента сделки: один UNION ALL по трём журналам, страница по курсору (время, тип, id)
+    if timeline:
+        query, query_params = build_timeline_query(deal_id, after, limit)
+        cursor.execute(query, query_params)
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        
+        entries = [{
+            'kind': row['kind'],
+            'id': row['id'],
+            'ts': row['ts'].isoformat(),
+            'previous_stage': row['previous_stage'],
+            'new_stage': row['new_stage'],
+            'actor': row['actor'],
+            'success': row['success'],
+            'details': row['details']
+        } for row in rows]
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'success': True,
+                'deal_id': deal_id,
+                'timeline': entries,
+                'count': len(entries),
+                'next_cursor': encode_cursor(rows[-1]['ts'].isoformat(), rows[-1]['kind_rank'], rows[-1]['id']) if rows and len(rows) == limit else None
+            }, default=str)
+        }
     
-    query += f" ORDER BY timestamp_received DESC LIMIT {limit} OFFSET {offset}"
+    state_deal_ids = find_state_deal_ids(cursor, search) if search else []
+    query, query_params = build_changes_query(deal_id, search, since_id, filters, after, limit, offset, projection, state_deal_ids)
     
-    cursor.execute(query)
+    cursor.execute(query, query_params)
     rows = cursor.fetchall()
+    # Опрос выбирает по возрастанию id (без пропусков при переполнении страницы), отдаём новые сверху
+    if since_id.isdigit():
+        rows.reverse()
+    rebuild_deal_data(cursor, rows, projection['deal_data'])
     
     cursor.close()
     conn.close()
     
-    changes = []
-    for row in rows:
-        changes.append({
-            'id': row['id'],
-            'deal_id': row['deal_id'],
-            'event_type': row['event_type'],
-            'deal_data': row['deal_data'],
-            'timestamp_received': row['timestamp_received'].isoformat() if row['timestamp_received'] else None,
-            'modifier_user_id': row['modifier_user_id'],
-            'modifier_user_name': row['modifier_user_name'],
-            'previous_stage': row['previous_stage'],
-            'current_stage': row['current_stage'],
-            'changes_summary': row['changes_summary']
-        })
+    changes = [format_change(row, projection) for row in rows]
     
     return {
         'statusCode': 200,
@@ -98,6 +174,373 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'body': json.dumps({
             'success': True,
             'changes': changes,
-            'count': len(changes)
+            'count': len(changes),
+            'next_cursor': encode_cursor(rows[-1]['timestamp_received'].isoformat(), rows[-1]['id']) if rows and len(rows) == limit else None,
+            'incremental': since_id.isdigit(),
+            'has_more': since_id.isdigit() and len(rows) == limit,
+            'cursor': {'since_id': next_since_id(rows, since_id)}
         })
-    }
\ No newline at end of file
+    }
+
+def build_changes_query(deal_id: str, search: str, since_id: str, filters: Dict[str, Any], after: Optional[Tuple[str, int]],
+                        limit: int, offset: int, projection: Dict[str, Any],
+                        state_deal_ids: Optional[List[str]] = None) -> Tuple[str, List[Any]]:
+    '''
+    Запрос страницы истории: условия и параметры собираются списками, значения - только через %s.
+    search: триграммы по ID сделки и имени автора (GIN gin_trgm_ops), полнотекстовый поиск по
+    TITLE/COMMENTS/... версии (search_vector, префиксы слов); сделки, найденные по текущему состоянию,
+    передаются готовым списком state_deal_ids (find_state_deal_ids) - условие deal_id = ANY
+    оставляет все ветви OR индексными (BitmapOr), подзапрос в OR свёл бы поиск к полному сканированию.
+    filters - результат parse_filters, каждый фильтр - предикат по индексированной колонке.
+    after - ключ последней строки предыдущей страницы: выборка по индексу (timestamp_received, id) без OFFSET.
+    projection - результат parse_projection: JSONB-поля урезаются до нужных ключей на стороне БД
+    '''
+    select_sql, select_params = build_select_list(projection)
+    select_sql += ", timestamp_received < NOW() - make_interval(secs => %s) AS settled"
+    select_params.append(CURSOR_SETTLE_SECONDS)
+    conditions = []
+    query_params: List[Any] = []
+    
+    if deal_id:
+        conditions.append("deal_id = %s")
+        query_params.append(deal_id)
+    
+    if search:
+        pattern = f"%{escape_like(search)}%"
+        search_conditions = ["deal_id ILIKE %s", "modifier_user_name ILIKE %s"]
+        query_params.extend([pattern, pattern])
+        
+        ts_query = search_ts_query(search)
+        if ts_query:
+            search_conditions.append("search_vector @@ to_tsquery('russian', %s)")
+            query_params.append(ts_query)
+        if state_deal_ids:
+            search_conditions.append("deal_id = ANY(%s)")
+            query_params.append(state_deal_ids)
+        conditions.append(f"({' OR '.join(search_conditions)})")
+    
+    for column, values in filters.get('lists', {}).items():
+        conditions.append(f"{column} = ANY(%s)")
+        query_params.append(values)
+    if 'opportunity_min' in filters:
+        conditions.append("opportunity >= %s")
+        query_params.append(filters['opportunity_min'])
+    if 'opportunity_max' in filters:
+        conditions.append("opportunity <= %s")
+        query_params.append(filters['opportunity_max'])
+    if 'date_from' in filters:
+        conditions.append("timestamp_received >= %s")
+        query_params.append(filters['date_from'])
+    if 'date_to' in filters:
+        conditions.append("timestamp_received < %s")
+        query_params.append(filters['date_to'])
+    
+    # since_id - только изменения, пришедшие после курсора (опрос страницы): по возрастанию id,
+    # чтобы при числе новых строк больше limit следующий опрос продолжил с места остановки
+    order_sql = "timestamp_received DESC, id DESC"
+    if since_id.isdigit():
+        conditions.append("id > %s")
+        query_params.append(int(since_id))
+        order_sql = "id ASC"
+    
+    if after:
+        conditions.append("(timestamp_received, id) < (%s::timestamptz, %s)")
+        query_params.extend(after)
+        offset = 0
+    
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"""
+        SELECT {select_sql}
+        FROM deal_changes 
+        {where_sql}
+        ORDER BY {order_sql} LIMIT %s OFFSET %s
+    """
+    return query, select_params + query_params + [limit, offset]
+
+# Колонки deal_changes, доступные в fields (id, deal_id, timestamp_received, version, is_keyframe
+# выбираются всегда: они нужны курсору и восстановлению дельта-версий)
+ROW_FIELDS = [
+    'id', 'deal_id', 'event_type', 'timestamp_received', 'modifier_user_id', 'modifier_user_name',
+    'previous_stage', 'current_stage', 'version', 'category_id', 'assigned_by_id', 'opportunity', 'company_id'
+]
+JSON_FIELDS = ('deal_data', 'changes_summary')
+
+# Проекция списка по умолчанию - то, что показывает таблица истории
+DEFAULT_FIELDS = (
+    'id,deal_id,event_type,timestamp_received,modifier_user_id,modifier_user_name,previous_stage,current_stage,'
+    'changes_summary.stage,deal_data.TITLE,deal_data.OPPORTUNITY,deal_data.CURRENCY_ID,deal_data.error'
+)
+
+def parse_projection(fields: str) -> Dict[str, Any]:
+    '''
+    fields=... в проекцию: {'columns': [...], 'deal_data': None | '*' | [ключи], 'changes_summary': ...}.
+    "*" - все колонки и полные JSONB, неизвестное поле - ValueError
+    '''
+    projection: Dict[str, Any] = {'columns': [], 'deal_data': None, 'changes_summary': None}
+    for field in (item.strip() for item in fields.split(',')):
+        if not field:
+            continue
+        if field == '*':
+            return {'columns': list(ROW_FIELDS), 'deal_data': '*', 'changes_summary': '*'}
+        name, _, key = field.partition('.')
+        if name in JSON_FIELDS:
+            if not key:
+                projection[name] = '*'
+            elif projection[name] != '*':
+                projection[name] = (projection[name] or []) + [key]
+        elif name in ROW_FIELDS and not key:
+            if name not in projection['columns']:
+                projection['columns'].append(name)
+        else:
+            raise ValueError(f"Unknown field: {field}")
+    return projection
+
+def build_select_list(projection: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    '''Список SELECT для проекции: выбранные ключи JSONB собираются jsonb_object_agg по jsonb_each'''
+    columns = ['id', 'deal_id', 'timestamp_received', 'version', 'is_keyframe']
+    columns += [column for column in projection['columns'] if column not in columns]
+    select_params: List[Any] = []
+    for name in JSON_FIELDS:
+        if projection[name] == '*':
+            columns.append(name)
+        elif projection[name]:
+            columns.append(f"(SELECT jsonb_object_agg(key, value) FROM jsonb_each({name}) WHERE key = ANY(%s)) AS {name}")
+            select_params.append(projection[name])
+    return ', '.join(columns), select_params
+
+def format_change(row: Dict[str, Any], projection: Dict[str, Any]) -> Dict[str, Any]:
+    '''Запись изменения для ответа: только поля проекции'''
+    change: Dict[str, Any] = {}
+    for column in projection['columns']:
+        value = row[column]
+        if column == 'timestamp_received' and value:
+            value = value.isoformat()
+        elif column == 'opportunity' and value is not None:
+            value = float(value)
+        change[column] = value
+    for name in JSON_FIELDS:
+        if projection[name]:
+            change[name] = row[name] or {}
+    if row.get('deal_data_incomplete'):
+        change['deal_data_incomplete'] = True
+    return change
+
+# Параметр запроса -> колонка deal_changes для фильтров-списков
+LIST_FILTERS = {
+    'stage': 'current_stage',
+    'category_id': 'category_id',
+    'assigned_by_id': 'assigned_by_id',
+    'company_id': 'company_id',
+    'event_type': 'event_type'
+}
+
+def parse_filters(params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Типизированные фильтры из строки запроса; неверное значение - ValueError с именем параметра.
+    Списки - через запятую, date_to в виде даты включает весь день
+    '''
+    filters: Dict[str, Any] = {'lists': {}}
+    for name, column in LIST_FILTERS.items():
+        values = [value.strip() for value in str(params.get(name) or '').split(',') if value.strip()]
+        if values:
+            filters['lists'][column] = [value.upper() for value in values] if name == 'event_type' else values
+    
+    for name in ('opportunity_min', 'opportunity_max'):
+        if params.get(name):
+            try:
+                filters[name] = float(params[name])
+            except ValueError:
+                raise ValueError(f"Invalid {name}: expected number")
+    
+    for name in ('date_from', 'date_to'):
+        if params.get(name):
+            try:
+                value = datetime.fromisoformat(params[name])
+            except ValueError:
+                raise ValueError(f"Invalid {name}: expected ISO date or datetime")
+            if name == 'date_to' and len(params[name]) == 10:
+                value += timedelta(days=1)
+            filters[name] = value
+    
+    return filters
+
+# Ветви ленты сделки: ранг задаёт порядок записей с одинаковым временем (ORDER BY ts, ранг, id DESC)
+TIMELINE_SOURCES = [
+    {
+        'kind': 'change',
+        'rank': 3,
+        'table': 'deal_changes',
+        'ts': 'timestamp_received',
+        'columns': """previous_stage, current_stage AS new_stage, modifier_user_name AS actor,
+                   NOT (deal_data ? 'error') AS success,
+                   jsonb_build_object('event_type', event_type, 'version', version,
+                                      'fields', changes_summary->'fields', 'removed', changes_summary->'removed',
+                                      'error', deal_data->'error') AS details"""
+    },
+    {
+        'kind': 'rollback',
+        'rank': 2,
+        'table': 't_p8980362_bitrix_webhook_handl.rollback_logs',
+        'ts': 'performed_at',
+        'columns': """previous_stage, new_stage, performed_by AS actor, success,
+                   jsonb_build_object('action_type', action_type, 'change_id', change_id,
+                                      'reason', reason, 'error_message', error_message) AS details"""
+    },
+    {
+        'kind': 'purchase_webhook',
+        'rank': 1,
+        'table': 'purchase_webhooks',
+        'ts': 'created_at',
+        'columns': """NULL::text AS previous_stage, NULL::text AS new_stage, NULL::text AS actor, NULL::boolean AS success,
+                   jsonb_build_object('webhook_type', webhook_type, 'company_id', company_id,
+                                      'products_count', products_count, 'total_amount', total_amount,
+                                      'response_status', response_status, 'purchase_created', purchase_created) AS details"""
+    }
+]
+
+def build_timeline_query(deal_id: str, after: Optional[Tuple[str, int, int]], limit: int) -> Tuple[str, List[Any]]:
+    '''
+    Лента сделки одним запросом: каждая ветвь UNION ALL берёт не больше limit строк по своему
+    индексу (deal_id, время DESC, id DESC), общий ORDER BY сливает их. Условие курсора
+    (время, ранг, id) < after раскрыто для каждой ветви с её постоянным рангом, чтобы оставаться
+    диапазоном по индексу
+    '''
+    branches = []
+    query_params: List[Any] = []
+    for source in TIMELINE_SOURCES:
+        condition = "deal_id = %s"
+        query_params.append(deal_id)
+        if after:
+            after_ts, after_rank, after_id = after
+            if source['rank'] < after_rank:
+                condition += f" AND {source['ts']} <= %s::timestamptz"
+                query_params.append(after_ts)
+            elif source['rank'] > after_rank:
+                condition += f" AND {source['ts']} < %s::timestamptz"
+                query_params.append(after_ts)
+            else:
+                condition += f" AND ({source['ts']} < %s::timestamptz OR ({source['ts']} = %s::timestamptz AND id < %s))"
+                query_params.extend([after_ts, after_ts, after_id])
+        branches.append(f"""(
+            SELECT '{source['kind']}' AS kind, {source['rank']} AS kind_rank, id, {source['ts']}::timestamptz AS ts,
+                   {source['columns']}
+            FROM {source['table']}
+            WHERE {condition}
+            ORDER BY {source['ts']} DESC, id DESC
+            LIMIT %s
+        )""")
+        query_params.append(limit)
+    
+    query = f"""
+        {' UNION ALL '.join(branches)}
+        ORDER BY ts DESC, kind_rank DESC, id DESC
+        LIMIT %s
+    """
+    return query, query_params + [limit]
+
+def search_ts_query(search: str) -> Optional[str]:
+    '''Слова поиска в tsquery с префиксами (договор пост -> договор:* & пост:*); None - слов нет'''
+    words = re.findall(r'[^\W_]+', search)
+    return ' & '.join(f"{word}:*" for word in words) if words else None
+
+def find_state_deal_ids(cursor, search: str) -> List[str]:
+    '''Сделки, текущее состояние которых подходит под поиск (GIN-индекс по deal_latest_state.search_vector)'''
+    ts_query = search_ts_query(search)
+    if not ts_query:
+        return []
+    cursor.execute(
+        "SELECT deal_id FROM deal_latest_state WHERE search_vector @@ to_tsquery('russian', %s)",
+        (ts_query,)
+    )
+    return [row['deal_id'] for row in cursor.fetchall()]
+
+def next_since_id(rows: List[Dict[str, Any]], since_id: str) -> int:
+    '''
+    Курсор since_id для следующего опроса. id выдаются до коммита, поэтому строка с меньшим id
+    может стать видимой позже строки с большим: курсор не сдвигается дальше первой строки моложе
+    CURSOR_SETTLE_SECONDS (колонка settled), такие строки придут повторно - клиент сливает их по id
+    '''
+    current = int(since_id) if since_id.isdigit() else 0
+    unsettled = [row['id'] for row in rows if not row['settled']]
+    if unsettled:
+        return max(min(unsettled) - 1, current)
+    return max([row['id'] for row in rows], default=current)
+
+def encode_cursor(*key: Any) -> str:
+    '''Курсор страницы - base64 от ключа последней строки (время, [ранг,] id)'''
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> Optional[Tuple[Any, ...]]:
+    '''Ключ из курсора: время строкой и size - 1 целых; None - курсор повреждён'''
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(key, list) or len(key) != size:
+            return None
+        return (str(key[0]),) + tuple(int(value) for value in key[1:])
+    except (ValueError, TypeError):
+        return None
+
+def escape_like(value: str) -> str:
+    '''Экранирует спецсимволы LIKE, чтобы % и _ в строке поиска искались буквально'''
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def rebuild_deal_data(cursor, rows: List[Dict[str, Any]], keys: Any = '*') -> None:
+    '''
+    Восстанавливает deal_data для дельта-версий страницы: по каждой сделке - один запрос
+    от ближайшего ключевого кадра до старшей нужной версии (индекс deal_id, version),
+    изменённые поля из changes_summary накладываются по порядку версий.
+    Если ключевой кадр сделки уже удалён вместе с секцией месяца, цепочка начинается с дельты:
+    такие версии помечаются deal_data_incomplete (в deal_data - только поля из сохранившихся дельт).
+    keys - ключи проекции deal_data ('*' - все, None - deal_data не запрошен)
+    '''
+    if not keys:
+        return
+    key_filter = None if keys == '*' else set(keys)
+    needed: Dict[str, List[int]] = {}
+    for row in rows:
+        if row.get('version') and not row.get('is_keyframe'):
+            needed.setdefault(row['deal_id'], []).append(row['version'])
+    
+    # Ключевые кадры тоже урезаются до ключей проекции на стороне БД
+    select_sql, select_params = build_select_list({'columns': [], 'deal_data': keys, 'changes_summary': '*'})
+    for deal_id, versions in needed.items():
+        incomplete = set()
+        cursor.execute(f"""
+            SELECT {select_sql}
+            FROM deal_changes
+            WHERE deal_id = %s AND version <= %s
+              AND version >= COALESCE((
+                  SELECT MAX(version) FROM deal_changes
+                  WHERE deal_id = %s AND is_keyframe AND version <= %s
+              ), 1)
+            ORDER BY version
+        """, select_params + [deal_id, max(versions), deal_id, min(versions)])
+        
+        state: Dict[str, Any] = {}
+        rebuilt: Dict[int, Dict[str, Any]] = {}
+        complete = False
+        for chain_row in cursor.fetchall():
+            if chain_row['is_keyframe']:
+                complete = True
+                state = {
+                    field: value for field, value in (chain_row['deal_data'] or {}).items()
+                    if key_filter is None or field in key_filter
+                }
+            else:
+                summary = chain_row['changes_summary'] or {}
+                for field, change in (summary.get('fields') or {}).items():
+                    if key_filter is None or field in key_filter:
+                        state[field] = change.get('to')
+                for field in summary.get('removed') or []:
+                    state.pop(field, None)
+            rebuilt[chain_row['version']] = dict(state)
+            if not complete:
+                incomplete.add(chain_row['version'])
+        
+        for row in rows:
+            if row['deal_id'] != deal_id or row.get('is_keyframe') or not row.get('version'):
+                continue
+            if row['version'] in rebuilt:
+                row['deal_data'] = rebuilt[row['version']]
+            if row['version'] in incomplete or row['version'] not in rebuilt:
+                row['deal_data_incomplete'] = True
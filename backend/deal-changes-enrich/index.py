@@ -1,16 +1,47 @@
 """
-Business: Обогащает записи изменений сделок именами пользователей из Битрикс24
-Args: event с queryStringParameters (limit для количества записей)
-Returns: JSON с количеством обновлённых записей
+Business: Синхронизирует справочник пользователей Битрикс24 (bitrix_users) пакетной выгрузкой user.get
+          и проставляет имена авторов в записях изменений сделок одним UPDATE с join по справочнику
+Args: event с queryStringParameters (full=1 - полная выгрузка пользователей вместо инкрементальной)
+Returns: JSON с количеством обновлённых записей и отчётом синхронизации
 """
 import json
 import os
-from typing import Dict, Any
+import random
+from typing import Dict, Any, Callable, List, Tuple, Union
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import urllib.request
 import urllib.parse
 
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+USERS_PAGE_SIZE = 50
+USERS_BATCH_COMMANDS = 50
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'POST')
     
@@ -36,7 +67,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     params = event.get('queryStringParameters') or {}
-    limit = int(params.get('limit', '50'))
+    force_full = params.get('full', '') in ('1', 'true')
     
     webhook_url = os.environ.get('BITRIX24_WEBHOOK_URL')
     if not webhook_url:
@@ -59,72 +90,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     conn = psycopg2.connect(dsn)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    # Находим записи без имён пользователей
-    cursor.execute(f"""
-        SELECT DISTINCT modifier_user_id 
-        FROM deal_changes 
-        WHERE modifier_user_id IS NOT NULL 
-        AND modifier_user_id != '' 
-        AND (modifier_user_name IS NULL OR modifier_user_name = '' OR modifier_user_name LIKE 'Пользователь #%')
-        LIMIT {limit}
-    """)
-    
-    rows = cursor.fetchall()
-    user_ids = [row['modifier_user_id'] for row in rows]
-    
-    if not user_ids:
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'message': 'Нет записей для обогащения',
-                'updated': 0
-            }),
-            'isBase64Encoded': False
-        }
-    
-    # Получаем данные пользователей из Битрикс24
-    updated_count = 0
-    user_cache = {}
-    
-    for user_id in user_ids:
-        if user_id in user_cache:
-            continue
-            
-        try:
-            user_url = f"{webhook_url}user.get.json"
-            user_params = urllib.parse.urlencode({'ID': user_id})
-            user_req = urllib.request.Request(f"{user_url}?{user_params}")
-            
-            with urllib.request.urlopen(user_req, timeout=5) as user_response:
-                user_data = json.loads(user_response.read().decode('utf-8'))
-            
-            if user_data.get('result') and len(user_data['result']) > 0:
-                user = user_data['result'][0]
-                user_name = f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}".strip()
-                
-                if user_name:
-                    user_cache[user_id] = user_name
-                    
-                    # Обновляем все записи этого пользователя
-                    cursor.execute("""
-                        UPDATE deal_changes 
-                        SET modifier_user_name = %s 
-                        WHERE modifier_user_id = %s 
-                        AND (modifier_user_name IS NULL OR modifier_user_name = '' OR modifier_user_name LIKE 'Пользователь #%%')
-                    """, (user_name, user_id))
-                    
-                    updated_count += cursor.rowcount
-                    print(f"[INFO] Обновлено {cursor.rowcount} записей для пользователя {user_name}")
-        
-        except Exception as e:
-            print(f"[WARN] Не удалось получить данные пользователя {user_id}: {e}")
-            continue
+    try:
+        sync_report = sync_bitrix_users(cursor, webhook_url, force_full)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log('WARN', 'bitrix', f"Синхронизация пользователей не выполнена: {type(e).__name__}: {e}")
+        sync_report = {'mode': 'failed', 'users': 0, 'error': str(e)}
     
+    # Имена из справочника - одним UPDATE по всем записям с заглушкой вместо имени
+    cursor.execute("""
+        UPDATE deal_changes dc
+        SET modifier_user_name = bu.full_name
+        FROM bitrix_users bu
+        WHERE bu.user_id = dc.modifier_user_id
+        AND bu.full_name != ''
+        AND dc.modifier_user_id IS NOT NULL 
+        AND dc.modifier_user_id != '' 
+        AND (dc.modifier_user_name IS NULL OR dc.modifier_user_name = '' OR dc.modifier_user_name LIKE 'Пользователь #%%')
+    """)
+    updated_count = cursor.rowcount
     conn.commit()
+    log('INFO', 'db', f"Обновлено {updated_count} записей, синхронизация: {sync_report}")
+    
     cursor.close()
     conn.close()
     
@@ -137,9 +125,114 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'isBase64Encoded': False,
         'body': json.dumps({
             'success': True,
-            'message': f'Обновлено {updated_count} записей',
+            'message': f'Обновлено {updated_count} записей' if updated_count else 'Нет записей для обогащения',
             'updated': updated_count,
-            'users_processed': len(user_cache),
-            'user_names': list(user_cache.values())
+            'users_processed': sync_report['users'],
+            'sync': sync_report
         }, ensure_ascii=False)
     }
+
+def sync_bitrix_users(cursor, webhook_url: str, force_full: bool) -> Dict[str, Any]:
+    '''
+    Полная выгрузка user.get раз в USERS_FULL_SYNC_HOURS (или по full=1): страницы по 50 пользователей,
+    до 50 страниц в одном batch-запросе. Между полными выгрузками - только пользователи с ID больше
+    последнего известного. Прогресс - в mirror_reconcile_state (entity = users).
+    Транзакцией управляет вызывающий
+    '''
+    full_sync_hours = float(os.environ.get('USERS_FULL_SYNC_HOURS', '24'))
+    cursor.execute("""
+        SELECT cycle_completed_at IS NULL OR cycle_completed_at < CURRENT_TIMESTAMP - make_interval(secs => %s) AS stale
+        FROM mirror_reconcile_state WHERE entity = 'users'
+    """, (full_sync_hours * 3600,))
+    state = cursor.fetchone()
+    cursor.execute("SELECT MAX(id_num) AS max_id FROM bitrix_users")
+    max_id = cursor.fetchone()['max_id']
+    full = force_full or max_id is None or not state or bool(state['stale'])
+    
+    filters = [] if full else [('FILTER[>ID]', max_id)]
+    users, calls, complete = fetch_all_users(webhook_url, filters)
+    
+    if users:
+        execute_values(cursor, """
+            INSERT INTO bitrix_users (user_id, full_name, email, active, user_data, synced_at)
+            VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                full_name = EXCLUDED.full_name, email = EXCLUDED.email, active = EXCLUDED.active,
+                user_data = EXCLUDED.user_data, synced_at = CURRENT_TIMESTAMP
+        """, [(
+            str(user['ID']),
+            f"{user.get('NAME') or ''} {user.get('LAST_NAME') or ''}".strip() or (user.get('EMAIL') or ''),
+            user.get('EMAIL'),
+            user.get('ACTIVE') not in (False, 'N'),
+            json.dumps(user, ensure_ascii=False)
+        ) for user in users], template='(%s, %s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP)')
+    
+    report = {'mode': 'full' if full else 'incremental', 'users': len(users), 'rest_calls': calls, 'complete': complete}
+    
+    # Пользователи, которых нет в полной выгрузке, удалены или уволены: имя остаётся для истории.
+    # Неполная выгрузка (страница не пришла) не даёт права никого деактивировать, цикл повторится
+    if full and users and complete:
+        cursor.execute(
+            "UPDATE bitrix_users SET active = FALSE WHERE active AND NOT (user_id = ANY(%s))",
+            ([str(user['ID']) for user in users],)
+        )
+        report['deactivated'] = cursor.rowcount
+    
+    cursor.execute("""
+        INSERT INTO mirror_reconcile_state (entity, last_report, cycle_completed_at, updated_at)
+        VALUES ('users', %s::jsonb, CASE WHEN %s THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+        ON CONFLICT (entity) DO UPDATE SET
+            last_report = EXCLUDED.last_report,
+            cycle_completed_at = COALESCE(EXCLUDED.cycle_completed_at, mirror_reconcile_state.cycle_completed_at),
+            updated_at = CURRENT_TIMESTAMP
+    """, (json.dumps(report), full and complete))
+    
+    return report
+
+def fetch_all_users(webhook_url: str, filters: List[Tuple[str, Any]]) -> Tuple[List[Dict[str, Any]], int, bool]:
+    '''
+    Все пользователи по фильтру: первая страница узнаёт total, остальные страницы
+    уходят batch-запросами по USERS_BATCH_COMMANDS команд.
+    Возвращает (пользователи, число вызовов REST, выгрузка полная): выгрузка неполная, если хоть одна
+    команда batch вернула ошибку или пользователей получено меньше total
+    '''
+    base_params = [('sort', 'ID'), ('order', 'ASC'), ('ADMIN_MODE', 'True')] + filters
+    first_page = bitrix_post(webhook_url, 'user.get', base_params + [('start', 0)])
+    users = list(first_page.get('result') or [])
+    total = int(first_page.get('total') or len(users))
+    calls = 1
+    
+    complete = True
+    starts = list(range(USERS_PAGE_SIZE, total, USERS_PAGE_SIZE))
+    query = urllib.parse.urlencode(base_params)
+    for offset in range(0, len(starts), USERS_BATCH_COMMANDS):
+        commands = [
+            (f"cmd[p{start}]", f"user.get?{query}&start={start}")
+            for start in starts[offset:offset + USERS_BATCH_COMMANDS]
+        ]
+        batch = bitrix_post(webhook_url, 'batch', commands + [('halt', 0)])
+        calls += 1
+        pages = batch.get('result', {}).get('result') or {}
+        errors = batch.get('result', {}).get('result_error') or {}
+        if errors:
+            complete = False
+            log('WARN', 'bitrix', f"user.get batch: ошибки в {len(errors)} командах: {json.dumps(errors, ensure_ascii=False)[:300]}")
+        for start in starts[offset:offset + USERS_BATCH_COMMANDS]:
+            users.extend(pages.get(f"p{start}") or [])
+    
+    if len({str(user['ID']) for user in users}) < total:
+        complete = False
+    log('INFO', 'bitrix', f"user.get: {len(users)} пользователей из {total}, вызовов REST: {calls}")
+    return users, calls, complete
+
+def bitrix_post(webhook_url: str, method: str, params_list: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    '''Вызов REST Битрикс24 (POST, form-encoded); ошибка REST - исключение'''
+    req = urllib.request.Request(
+        f"{webhook_url.rstrip('/')}/{method}.json",
+        data=urllib.parse.urlencode(params_list).encode('utf-8')
+    )
+    with urllib.request.urlopen(req, timeout=20) as response:
+        result = json.loads(response.read().decode('utf-8'))
+    if 'result' not in result:
+        raise RuntimeError(f"{method}: {result.get('error_description', result.get('error'))}")
+    return result
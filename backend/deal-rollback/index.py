@@ -65,8 +65,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn = psycopg2.connect(db_dsn)
             cur = conn.cursor()
             cur.execute(
-                "SELECT deal_data FROM t_p8980362_bitrix_webhook_handl.deal_changes WHERE deal_id = %s ORDER BY id DESC LIMIT 1",
-                (deal_id,)
+                "SELECT deal_data FROM t_p8980362_bitrix_webhook_handl.deal_latest_state WHERE deal_id = %s",
+                (str(deal_id),)
             )
             row = cur.fetchone()
             if row and row[0]:
@@ -7,11 +7,89 @@ Returns: HTTP response with success status
 
 import json
 import os
+import base64
+import urllib.parse
 from typing import Dict, Any
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+def parse_form_body(body: str) -> Dict[str, Any]:
+    '''
+    Разбор x-www-form-urlencoded тела Битрикс24 за один проход: PHP-ключи со скобками
+    (auth[domain], data[FIELDS][ID], document_id[], data[FIELDS][UF_LIST][0]) раскладываются
+    во вложенные dict/list. Повтор ключа без скобок перезаписывает значение (как в PHP),
+    числовые индексы по порядку дают list, пропуск индекса превращает list в dict.
+    Тело декодируется одним вызовом unquote_plus (закодированные & и = защищены маркерами;
+    если маркеры уже есть в теле - сырыми или как %00/%01 - разбор попарный),
+    контейнеры запоминаются по префиксу ключа: соседние поля data[FIELDS][...] пишутся без обхода пути
+    '''
+    escaped = '%26' in body or '%3D' in body or '%3d' in body
+    if '\x00' in body or '\x01' in body or '%00' in body or '%01' in body:
+        pairs = [tuple(urllib.parse.unquote_plus(part) for part in pair.partition('=')[::2]) for pair in body.split('&') if pair]
+        escaped = False
+    else:
+        if escaped:
+            body = body.replace('%26', '\x00').replace('%3D', '\x01').replace('%3d', '\x01')
+        pairs = [pair.partition('=')[::2] for pair in urllib.parse.unquote_plus(body).split('&') if pair]
+    
+    result: Dict[str, Any] = {}
+    containers: Dict[str, Dict[str, Any]] = {}
+    for key, value in pairs:
+        if escaped:
+            key = key.replace('\x00', '&').replace('\x01', '=')
+            value = value.replace('\x00', '&').replace('\x01', '=')
+        
+        if not key.endswith(']') or key.find('[') <= 0:
+            if key in result:
+                containers.clear()
+            result[key] = value
+            continue
+        
+        cut = key.rfind('[')
+        prefix, last = key[:cut], key[cut + 1:-1]
+        container = containers.get(prefix)
+        if container is not None and last and not last.isdigit() and not isinstance(container.get(last), (dict, list)):
+            container[last] = value
+            continue
+        
+        bracket = key.find('[')
+        node: Any = result
+        name = key[:bracket]
+        for segment in key[bracket + 1:-1].split(']['):
+            child = form_node_get(node, name)
+            if isinstance(child, list) and segment and not (segment.isdigit() and int(segment) <= len(child)):
+                child = {str(index): item for index, item in enumerate(child)}
+                form_node_set(node, name, child)
+                containers.clear()
+            elif not isinstance(child, (dict, list)):
+                child = [] if not segment or segment == '0' else {}
+                form_node_set(node, name, child)
+            node, name = child, segment
+        if isinstance(form_node_get(node, name), (dict, list)):
+            containers.clear()
+        form_node_set(node, name, value)
+        if isinstance(node, dict) and '[]' not in prefix:
+            containers[prefix] = node
+    
+    return result
+
+def form_node_get(node: Any, name: str) -> Any:
+    '''Элемент контейнера по сегменту ключа; "[]" всегда создаёт новый элемент'''
+    if isinstance(node, list):
+        return node[int(name)] if name and int(name) < len(node) else None
+    return node.get(name)
+
+def form_node_set(node: Any, name: str, value: Any) -> None:
+    '''Запись в контейнер по сегменту ключа: в list - добавление в конец или замена по индексу'''
+    if isinstance(node, list):
+        if not name or int(name) == len(node):
+            node.append(value)
+        else:
+            node[int(name)] = value
+    else:
+        node[name] = value
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
     
@@ -33,11 +111,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
+            body_str = event.get('body') or '{}'
+            headers = event.get('headers') or {}
+            if 'application/x-www-form-urlencoded' in headers.get('Content-Type', headers.get('content-type', '')):
+                # Исходящий вебхук Битрикс24: PHP-ключи auth[...], data[FIELDS][...] - во вложенные dict/list
+                if event.get('isBase64Encoded', False):
+                    body_str = base64.b64decode(body_str).decode('utf-8')
+                body_data = parse_form_body(body_str)
+            else:
+                body_data = json.loads(body_str)
+            
+            # Пакет событий сделок из очереди event.offline.get (bitrix-event-pull)
+            if body_data.get('action') == 'process_events':
+                results = []
+                for item in body_data.get('events', []):
+                    try:
+                        event_body = {'deal_id': str(item.get('id', '')), 'event': item.get('event', ''), 'source': 'offline_queue'}
+                        webhook_id = log_purchase_webhook(cur, event_body, 'event.offline.get')
+                        conn.commit()
+                        results.append({'key': item.get('key'), 'success': True, 'webhook_id': webhook_id, 'error': None})
+                    except Exception as e:
+                        conn.rollback()
+                        results.append({'key': item.get('key'), 'success': False, 'error': str(e)})
+                
+                return response_json(200, {'success': True, 'results': results})
             
-            deal_id = str(body_data.get('deal_id', ''))
-            webhook_event = body_data.get('event', 'OnCrmDealUpdate')
-            company_id = str(body_data.get('company_id', ''))
+            # Событие сделки (ONCRMDEAL*) несёт ID в data[FIELDS][ID]
+            deal_id = str(body_data.get('deal_id') or (body_data.get('data') or {}).get('FIELDS', {}).get('ID', ''))
             
             if not deal_id:
                 return response_json(400, {
@@ -45,19 +145,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'error': 'deal_id is required'
                 })
             
-            headers = event.get('headers', {})
+            body_data['deal_id'] = deal_id
             user_agent = headers.get('User-Agent', headers.get('user-agent', 'Bitrix24'))
             source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
             source_info = f"IP: {source_ip} | UA: {user_agent[:100]}"
             
-            cur.execute("""
-                INSERT INTO purchase_webhooks 
-                (deal_id, company_id, webhook_type, products_count, total_amount, source_info)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (deal_id, company_id, webhook_event, 0, 0, source_info))
-            
-            webhook_id = cur.fetchone()['id']
+            webhook_id = log_purchase_webhook(cur, body_data, source_info)
             conn.commit()
             
             return response_json(200, {
@@ -102,6 +195,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur.close()
         conn.close()
 
+def log_purchase_webhook(cur, body_data: Dict[str, Any], source_info: str) -> int:
+    cur.execute("""
+        INSERT INTO purchase_webhooks 
+        (deal_id, company_id, webhook_type, products_count, total_amount, request_body, source_info)
+        VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s)
+        RETURNING id
+    """, (
+        str(body_data.get('deal_id', '')),
+        str(body_data.get('company_id', '')),
+        body_data.get('event', 'OnCrmDealUpdate'),
+        0, 0,
+        json.dumps(body_data, ensure_ascii=False),
+        source_info
+    ))
+    return cur.fetchone()['id']
+
 def response_json(status_code: int, data: Dict[str, Any]) -> Dict[str, Any]:
     return {
         'statusCode': status_code,
@@ -1,12 +1,43 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
+import random
+from typing import Dict, Any, List, Optional, Callable, Tuple, Union
 import urllib.request
 import urllib.parse
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+# Строки моложе этого возраста курсор since_id не проходит (дольше длится транзакция записи - нужен больший запас)
+CURSOR_SETTLE_SECONDS = int(os.environ.get('CURSOR_SETTLE_SECONDS', '60'))
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Обрабатывает закупки из Битрикс24 - получает товары по сделке, создаёт закупки в ЦРМ Обеспечение, логирует вебхуки
@@ -52,16 +83,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             query_params = event.get('queryStringParameters', {}) or {}
             action = query_params.get('action', '')
             
-            # Получить список закупок
+            since_id = query_params.get('since_id', '')
+            since_ts = query_params.get('since_ts', '')
+            
+            # Получить список закупок (since_ts - созданные или изменённые после курсора)
             if action == 'list_purchases':
-                cur.execute('''
-                    SELECT * FROM purchases 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                ''')
+                if since_ts:
+                    # По возрастанию (updated_at, id): при переполнении страницы следующий опрос продолжит с курсора
+                    cur.execute('''
+                        SELECT *, updated_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchases 
+                        WHERE (updated_at, id) > (%s::timestamp, %s)
+                        ORDER BY updated_at ASC, id ASC 
+                        LIMIT 100
+                    ''', (CURSOR_SETTLE_SECONDS, *parse_since_ts(since_ts)))
+                else:
+                    cur.execute('''
+                        SELECT *, updated_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchases 
+                        ORDER BY created_at DESC 
+                        LIMIT 100
+                    ''', (CURSOR_SETTLE_SECONDS,))
                 purchases = [dict(row) for row in cur.fetchall()]
+                next_ts = next_since_ts(purchases, 'updated_at', since_ts)
+                if since_ts:
+                    purchases.reverse()
                 
                 for p in purchases:
+                    p.pop('settled', None)
                     if isinstance(p.get('created_at'), datetime):
                         p['created_at'] = p['created_at'].isoformat()
                     if isinstance(p.get('updated_at'), datetime):
@@ -70,26 +119,47 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return response_json(200, {
                     'success': True,
                     'purchases': purchases,
-                    'total': len(purchases)
+                    'total': len(purchases),
+                    'incremental': bool(since_ts),
+                    'has_more': bool(since_ts) and len(purchases) == 100,
+                    'cursor': {'since_ts': next_ts}
                 })
             
-            # Получить журнал вебхуков
+            # Получить журнал вебхуков (since_id - только новые записи)
             if action == 'list_webhooks':
-                cur.execute('''
-                    SELECT * FROM purchase_webhooks 
-                    ORDER BY created_at DESC 
-                    LIMIT 100
-                ''')
+                if since_id.isdigit():
+                    # По возрастанию id: при переполнении страницы следующий опрос продолжит с курсора
+                    cur.execute('''
+                        SELECT *, created_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchase_webhooks 
+                        WHERE id > %s
+                        ORDER BY id ASC 
+                        LIMIT 100
+                    ''', (CURSOR_SETTLE_SECONDS, int(since_id)))
+                else:
+                    cur.execute('''
+                        SELECT *, created_at < NOW() - make_interval(secs => %s) AS settled
+                        FROM purchase_webhooks 
+                        ORDER BY created_at DESC 
+                        LIMIT 100
+                    ''', (CURSOR_SETTLE_SECONDS,))
                 webhooks = [dict(row) for row in cur.fetchall()]
+                next_id = next_since_id(webhooks, since_id)
+                if since_id.isdigit():
+                    webhooks.reverse()
                 
                 for w in webhooks:
+                    w.pop('settled', None)
                     if isinstance(w.get('created_at'), datetime):
                         w['created_at'] = w['created_at'].isoformat()
                 
                 return response_json(200, {
                     'success': True,
                     'webhooks': webhooks,
-                    'total': len(webhooks)
+                    'total': len(webhooks),
+                    'incremental': since_id.isdigit(),
+                    'has_more': since_id.isdigit() and len(webhooks) == 100,
+                    'cursor': {'since_id': next_id}
                 })
             
             # Получить товары по сделке
@@ -188,12 +258,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = query_params.get('action', '')
             
             if action == 'clear_webhooks':
-                cur.execute('DELETE FROM purchase_webhooks')
-                deleted = cur.rowcount
+                # Журнал секционирован по месяцам - TRUNCATE снимает все секции без раздувания таблицы
+                # и без полного сканирования (число удалённых строк поэтому не возвращается)
+                cur.execute('TRUNCATE purchase_webhooks')
                 conn.commit()
                 return response_json(200, {
                     'success': True,
-                    'message': f'Удалено записей: {deleted}'
+                    'message': 'Журнал вебхуков очищен'
                 })
         
         return response_json(405, {
@@ -215,7 +286,7 @@ def log_webhook(cur, conn, deal_id: str, company_id: str, webhook_type: str,
     cur.execute('''
         INSERT INTO purchase_webhooks 
         (deal_id, company_id, webhook_type, products_count, total_amount, request_body, response_status, source_info)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s, %s)
     ''', (deal_id, company_id, webhook_type, products_count, total_amount, request_body, response_status, source_info))
     conn.commit()
 
@@ -248,14 +319,14 @@ def get_deal_products(webhook_url: str, deal_id: str) -> Dict[str, Any]:
         params = urllib.parse.urlencode({'id': deal_id})
         req_url = f"{url}?{params}"
         
-        print(f"[DEBUG] Fetching products for deal {deal_id}: {req_url}")
+        log('DEBUG', 'bitrix', lambda: f"Fetching products for deal {deal_id}: {req_url}")
         
         with urllib.request.urlopen(req_url, timeout=10) as response:
             result = json.loads(response.read().decode('utf-8'))
             
             if not result.get('result'):
                 error_msg = result.get('error_description', 'Товары не найдены')
-                print(f"[ERROR] Failed to get products: {error_msg}")
+                log('ERROR', 'flow', f"Failed to get products: {error_msg}")
                 return {
                     'success': False,
                     'error': error_msg,
@@ -275,7 +346,7 @@ def get_deal_products(webhook_url: str, deal_id: str) -> Dict[str, Any]:
                     'measure': product.get('MEASURE_NAME', 'шт'),
                 })
             
-            print(f"[DEBUG] Found {len(formatted_products)} products for deal {deal_id}")
+            log('DEBUG', 'flow', f"Found {len(formatted_products)} products for deal {deal_id}")
             
             return {
                 'success': True,
@@ -286,14 +357,14 @@ def get_deal_products(webhook_url: str, deal_id: str) -> Dict[str, Any]:
     
     except urllib.error.HTTPError as e:
         error_body = e.read().decode('utf-8')
-        print(f"[ERROR] HTTP error getting products: {e.code} - {error_body}")
+        log('ERROR', 'bitrix', f"HTTP error getting products: {e.code} - {error_body}")
         return {
             'success': False,
             'error': f'HTTP ошибка: {e.code}',
             'products': []
         }
     except Exception as e:
-        print(f"[ERROR] Exception getting products: {e}")
+        log('ERROR', 'flow', f"Exception getting products: {e}")
         return {
             'success': False,
             'error': str(e),
@@ -346,14 +417,14 @@ def create_purchase_in_crm(webhook_url: str, deal_id: str, products: List[Dict[s
         data = urllib.parse.urlencode(fields).encode('utf-8')
         req = urllib.request.Request(url, data=data, method='POST')
         
-        print(f"[DEBUG] Creating purchase in CRM for deal {deal_id}")
+        log('DEBUG', 'flow', f"Creating purchase in CRM for deal {deal_id}")
         
         with urllib.request.urlopen(req, timeout=10) as response:
             result = json.loads(response.read().decode('utf-8'))
             
             if not result.get('result'):
                 error_msg = result.get('error_description', 'Не удалось создать закупку')
-                print(f"[ERROR] Failed to create purchase: {error_msg}")
+                log('ERROR', 'flow', f"Failed to create purchase: {error_msg}")
                 return {
                     'success': False,
                     'error': error_msg
@@ -362,16 +433,12 @@ def create_purchase_in_crm(webhook_url: str, deal_id: str, products: List[Dict[s
             purchase_id = result['result'].get('item', {}).get('id', '')
             created_item = result['result'].get('item', {})
             
-            print(f"[DEBUG] Purchase created with ID: {purchase_id}")
-            print(f"[DEBUG] ===== СОЗДАННАЯ ЗАКУПКА В БИТРИКС24 =====")
-            print(f"[DEBUG] ID закупки: {purchase_id}")
-            print(f"[DEBUG] Название: {title}")
-            print(f"[DEBUG] Поля закупки:")
-            print(json.dumps(created_item, ensure_ascii=False, indent=2))
-            print(f"[DEBUG] Товары в закупке ({len(products)} шт.):")
-            for idx, p in enumerate(products, 1):
-                print(f"[DEBUG]   {idx}. {p.get('name')} - {p.get('quantity')} {p.get('measure')} x {p.get('price')} руб. = {p.get('total')} руб.")
-            print(f"[DEBUG] ==========================================")
+            log('INFO', 'flow', f"Purchase created with ID: {purchase_id}, title: {title}, products: {len(products)}")
+            log('DEBUG', 'payload', lambda: f"Поля закупки: {json.dumps(created_item, ensure_ascii=False)}")
+            log('DEBUG', 'payload', lambda: 'Товары в закупке: ' + '; '.join(
+                f"{p.get('name')} - {p.get('quantity')} {p.get('measure')} x {p.get('price')} руб. = {p.get('total')} руб."
+                for p in products
+            ))
             
             return {
                 'success': True,
@@ -384,7 +451,7 @@ def create_purchase_in_crm(webhook_url: str, deal_id: str, products: List[Dict[s
             }
     
     except Exception as e:
-        print(f"[ERROR] Exception creating purchase: {e}")
+        log('ERROR', 'flow', f"Exception creating purchase: {e}")
         return {
             'success': False,
             'error': str(e)
@@ -422,6 +489,35 @@ def get_deal_info(webhook_url: str, deal_id: str) -> Dict[str, Any]:
         }
 
 
+def next_since_id(rows: List[Dict[str, Any]], since_id: str) -> int:
+    '''
+    Курсор since_id для следующего опроса. id выдаются до коммита, поэтому строка с меньшим id
+    может стать видимой позже строки с большим: курсор не сдвигается дальше первой строки моложе
+    CURSOR_SETTLE_SECONDS (колонка settled), такие строки придут повторно - клиент сливает их по id
+    '''
+    current = int(since_id) if since_id.isdigit() else 0
+    unsettled = [row['id'] for row in rows if not row['settled']]
+    if unsettled:
+        return max(min(unsettled) - 1, current)
+    return max([row['id'] for row in rows], default=current)
+
+def parse_since_ts(since_ts: str) -> Tuple[str, int]:
+    '''Курсор since_ts "время|id" -> (время, id); старый курсор без id - (время, 0)'''
+    ts, _, row_id = since_ts.partition('|')
+    return ts, int(row_id) if row_id.isdigit() else 0
+
+def next_since_ts(rows: List[Dict[str, Any]], ts_field: str, since_ts: str) -> Optional[str]:
+    '''
+    Курсор since_ts для следующего опроса: старший ключ (время, id) среди строк старше
+    CURSOR_SETTLE_SECONDS. Время ставится в начале транзакции записи, поэтому более свежие строки
+    (и ещё не видимые строки с тем же временем) курсор не проходит - они придут повторно
+    '''
+    settled = [(row[ts_field], row['id']) for row in rows if row['settled'] and isinstance(row.get(ts_field), datetime)]
+    if not settled:
+        return since_ts or None
+    ts, row_id = max(settled)
+    return f"{ts.isoformat()}|{row_id}"
+
 def response_json(status_code: int, data: Dict[str, Any]) -> Dict[str, Any]:
     '''
     Формирует HTTP response в формате Cloud Function
@@ -1,14 +1,17 @@
 """
 Business: Получение истории откатов сделок из audit лога
-Args: event с queryStringParameters {deal_id, limit}
+Args: event с queryStringParameters {deal_id, limit, since_id}
 Returns: JSON массив с историей действий
 """
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Строки моложе этого возраста курсор since_id не проходит (дольше длится транзакция записи - нужен больший запас)
+CURSOR_SETTLE_SECONDS = int(os.environ.get('CURSOR_SETTLE_SECONDS', '60'))
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -42,31 +45,40 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     params = event.get('queryStringParameters') or {}
     deal_id = params.get('deal_id')
     limit = int(params.get('limit', 100))
+    since_id = str(params.get('since_id', ''))
     
     conn = psycopg2.connect(db_dsn)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
+    conditions = []
+    query_params = []
     if deal_id:
-        cur.execute(
-            """SELECT id, deal_id, action_type, change_id, previous_stage, new_stage,
-                      deal_snapshot, performed_at, performed_by, reason, success, error_message
-               FROM t_p8980362_bitrix_webhook_handl.rollback_logs
-               WHERE deal_id = %s
-               ORDER BY performed_at DESC
-               LIMIT %s""",
-            (deal_id, limit)
-        )
-    else:
-        cur.execute(
-            """SELECT id, deal_id, action_type, change_id, previous_stage, new_stage,
-                      deal_snapshot, performed_at, performed_by, reason, success, error_message
-               FROM t_p8980362_bitrix_webhook_handl.rollback_logs
-               ORDER BY performed_at DESC
-               LIMIT %s""",
-            (limit,)
-        )
+        conditions.append("deal_id = %s")
+        query_params.append(deal_id)
+    # since_id - только записи после курсора, по возрастанию id: при переполнении страницы
+    # следующий опрос продолжит с места остановки
+    order_sql = "performed_at DESC"
+    if since_id.isdigit():
+        conditions.append("id > %s")
+        query_params.append(int(since_id))
+        order_sql = "id ASC"
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cur.execute(
+        f"""SELECT id, deal_id, action_type, change_id, previous_stage, new_stage,
+                   deal_snapshot, performed_at, performed_by, reason, success, error_message,
+                   performed_at < NOW() - make_interval(secs => %s) AS settled
+            FROM t_p8980362_bitrix_webhook_handl.rollback_logs
+            {where_sql}
+            ORDER BY {order_sql}
+            LIMIT %s""",
+        [CURSOR_SETTLE_SECONDS] + query_params + [limit]
+    )
     
     rows = cur.fetchall()
+    next_id = next_since_id(rows, since_id)
+    if since_id.isdigit():
+        rows.reverse()
     cur.close()
     conn.close()
     
@@ -96,6 +108,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'isBase64Encoded': False,
         'body': json.dumps({
             'logs': logs,
-            'total': len(logs)
+            'total': len(logs),
+            'incremental': since_id.isdigit(),
+            'has_more': since_id.isdigit() and len(logs) == limit,
+            'cursor': {'since_id': next_id}
         })
     }
+
+def next_since_id(rows: List[Dict[str, Any]], since_id: str) -> int:
+    '''
+    Курсор since_id для следующего опроса. id выдаются до коммита, поэтому строка с меньшим id
+    может стать видимой позже строки с большим: курсор не сдвигается дальше первой строки моложе
+    CURSOR_SETTLE_SECONDS (колонка settled), такие строки придут повторно - клиент сливает их по id
+    '''
+    current = int(since_id) if since_id.isdigit() else 0
+    unsettled = [row['id'] for row in rows if not row['settled']]
+    if unsettled:
+        return max(min(unsettled) - 1, current)
+    return max([row['id'] for row in rows], default=current)
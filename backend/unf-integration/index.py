@@ -1,6 +1,7 @@
 import json
 import os
-from typing import Dict, Any, List
+import random
+from typing import Dict, Any, List, Callable, Union
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import requests
@@ -8,6 +9,33 @@ from requests.auth import HTTPBasicAuth
 import base64
 from datetime import datetime
 
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '1000'))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition('=') for item in os.environ.get('LOG_SAMPLE', '').split(','))
+    if category.strip() and rate.strip()
+}
+
+def log(level: str, category: str, message: Union[str, Callable[[], str]]) -> None:
+    '''
+    Пишет строку лога с уровнем и категорией (payload, bitrix, db, flow).
+    LOG_LEVEL - минимальный уровень, LOG_SAMPLE - доли записей DEBUG/INFO по категориям
+    (например payload=0.05,bitrix=0.5), LOG_MAX_CHARS - обрезка длинных сообщений.
+    message может быть lambda: строка формируется, только если запись попадёт в лог.
+    '''
+    if LOG_LEVELS.get(level, 20) < LOG_LEVEL:
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(category, 1.0)
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS['WARN'] and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    text = message() if callable(message) else message
+    if len(text) > LOG_MAX_CHARS:
+        text = f"{text[:LOG_MAX_CHARS]}... (+{len(text) - LOG_MAX_CHARS} симв.)"
+    print(f"[{level}] [{category}] {text}")
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Интеграция с 1С УНФ через XDTO - получение документов заказов и синхронизация с Битрикс24
@@ -352,7 +380,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return response_json(405, {'error': 'Method not allowed'})
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        log('ERROR', 'flow', f"Error: {str(e)}")
         return response_json(500, {'success': False, 'error': str(e)})
     finally:
         cur.close()
@@ -361,7 +389,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 def test_1c_connection(url: str, username: str, password: str) -> Dict[str, Any]:
     """Проверка подключения к 1С УНФ через OData"""
     try:
-        print(f"[DEBUG] Testing connection to: {url}")
+        log('DEBUG', 'bitrix', lambda: f"Testing connection to: {url}")
         
         odata_url = f"{url}/odata/standard.odata/Document_ЗаказПокупателя"
         params = {
@@ -377,7 +405,7 @@ def test_1c_connection(url: str, username: str, password: str) -> Dict[str, Any]
             timeout=10
         )
         
-        print(f"[DEBUG] Response status: {response.status_code}")
+        log('DEBUG', 'bitrix', f"Response status: {response.status_code}")
         
         if response.status_code == 200:
             return {'success': True, 'message': 'Connection successful'}
@@ -388,13 +416,13 @@ def test_1c_connection(url: str, username: str, password: str) -> Dict[str, Any]
         else:
             return {'success': False, 'error': f'Ошибка сервера: HTTP {response.status_code}'}
     except requests.exceptions.Timeout:
-        print(f"[DEBUG] Timeout error")
+        log('WARN', 'flow', "Timeout error")
         return {'success': False, 'error': 'Превышено время ожидания. Проверьте доступность сервера'}
     except requests.exceptions.ConnectionError as e:
-        print(f"[DEBUG] Connection error: {str(e)}")
+        log('WARN', 'flow', f"Connection error: {str(e)}")
         return {'success': False, 'error': 'Не удалось подключиться к серверу. Проверьте URL'}
     except Exception as e:
-        print(f"[DEBUG] Exception: {str(e)}")
+        log('WARN', 'flow', f"Exception: {str(e)}")
         return {'success': False, 'error': f'Ошибка подключения: {str(e)}'}
 
 def fetch_documents_from_1c(url: str, username: str, password: str, limit: int = 100) -> List[Dict]:
@@ -412,7 +440,7 @@ def fetch_documents_from_1c(url: str, username: str, password: str, limit: int =
     if response_count.status_code == 200:
         try:
             total_count = int(response_count.text.strip())
-            print(f"[DEBUG] Total documents in 1C: {total_count}")
+            log('DEBUG', 'bitrix', f"Total documents in 1C: {total_count}")
         except:
             pass
     
@@ -425,8 +453,8 @@ def fetch_documents_from_1c(url: str, username: str, password: str, limit: int =
     }
     
     try:
-        print(f"[DEBUG] Fetching documents from: {odata_url}")
-        print(f"[DEBUG] Limit: {limit} documents")
+        log('DEBUG', 'bitrix', lambda: f"Fetching documents from: {odata_url}")
+        log('DEBUG', 'flow', f"Limit: {limit} documents")
         
         response = requests.get(
             odata_url,
@@ -436,17 +464,17 @@ def fetch_documents_from_1c(url: str, username: str, password: str, limit: int =
             timeout=15
         )
         
-        print(f"[DEBUG] Response status: {response.status_code}")
+        log('DEBUG', 'bitrix', f"Response status: {response.status_code}")
         
         if response.status_code == 200:
             data = response.json()
-            print(f"[DEBUG] Response JSON keys: {list(data.keys())}")
-            print(f"[DEBUG] Full response: {json.dumps(data, ensure_ascii=False)[:500]}")
+            log('DEBUG', 'payload', lambda: f"Response JSON keys: {list(data.keys())}")
+            log('DEBUG', 'payload', lambda: f"Full response: {json.dumps(data, ensure_ascii=False)[:500]}")
             
             documents = []
             
             for item in data.get('value', []):
-                print(f"[DEBUG] Document item keys: {list(item.keys())}")
+                log('DEBUG', 'flow', lambda: f"Document item keys: {list(item.keys())}")
                 
                 customer_ref = item.get('Контрагент_Key', '')
                 order_status_ref = item.get('СостояниеЗаказа_Key', '')
@@ -465,13 +493,13 @@ def fetch_documents_from_1c(url: str, username: str, password: str, limit: int =
                     'raw_data': item
                 })
             
-            print(f"[DEBUG] Fetched {len(documents)} documents")
+            log('DEBUG', 'flow', f"Fetched {len(documents)} documents")
             return documents
         else:
-            print(f"1C OData error: {response.status_code} - {response.text}")
+            log('ERROR', 'bitrix', lambda: f"1C OData error: {response.status_code} - {response.text}")
             return []
     except Exception as e:
-        print(f"Error fetching from 1C: {str(e)}")
+        log('ERROR', 'bitrix', f"Error fetching from 1C: {str(e)}")
         return []
 
 def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str) -> Dict:
@@ -481,7 +509,7 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
         
         params = {'$format': 'json'}
         
-        print(f"[DEBUG] Enriching document: {doc_uid}")
+        log('DEBUG', 'bitrix', f"Enriching document: {doc_uid}")
         
         response = requests.get(
             odata_url,
@@ -491,14 +519,14 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
             timeout=10
         )
         
-        print(f"[DEBUG] Enrich response status: {response.status_code}")
+        log('DEBUG', 'bitrix', f"Enrich response status: {response.status_code}")
         
         if response.status_code != 200:
-            print(f"1C OData enrich error: {response.status_code} - {response.text}")
+            log('ERROR', 'bitrix', lambda: f"1C OData enrich error: {response.status_code} - {response.text}")
             return None
             
         item = response.json()
-        print(f"[DEBUG] Document keys: {list(item.keys())}")
+        log('DEBUG', 'flow', lambda: f"Document keys: {list(item.keys())}")
         
         customer_ref = item.get('Контрагент_Key', '')
         
@@ -520,8 +548,8 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
         
         author_ref = item.get('Автор_Key', '')
         
-        print(f"[DEBUG] Raw order_status: {item.get('СостояниеЗаказа')}")
-        print(f"[DEBUG] Raw order_type: {item.get('ВидЗаказа')}")
+        log('DEBUG', 'bitrix', f"Raw order_status: {item.get('СостояниеЗаказа')}")
+        log('DEBUG', 'flow', f"Raw order_type: {item.get('ВидЗаказа')}")
         
         customer_name = ''
         if customer_ref:
@@ -550,9 +578,9 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
                 )
                 if status_resp.status_code == 200:
                     order_status = status_resp.json().get('Description', '')
-                    print(f"[DEBUG] Order status loaded: {order_status}")
+                    log('DEBUG', 'bitrix', f"Order status loaded: {order_status}")
             except Exception as e:
-                print(f"[DEBUG] Error loading order status: {str(e)}")
+                log('WARN', 'bitrix', f"Error loading order status: {str(e)}")
                 order_status = order_status_ref
         else:
             order_status = order_status_ref
@@ -569,9 +597,9 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
                 )
                 if type_resp.status_code == 200:
                     order_type = type_resp.json().get('Description', '')
-                    print(f"[DEBUG] Order type loaded: {order_type}")
+                    log('DEBUG', 'flow', f"Order type loaded: {order_type}")
             except Exception as e:
-                print(f"[DEBUG] Error loading order type: {str(e)}")
+                log('WARN', 'flow', f"Error loading order type: {str(e)}")
                 order_type = order_type_ref
         else:
             order_type = order_type_ref
@@ -626,9 +654,9 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
                         'price': float(row.get('Цена', 0) or 0),
                         'sum': float(row.get('Сумма', 0) or 0)
                     })
-                print(f"[DEBUG] Loaded {len(nomenclature)} nomenclature items from Запасы")
+                log('DEBUG', 'flow', f"Loaded {len(nomenclature)} nomenclature items from Запасы")
         except Exception as e:
-            print(f"Error loading nomenclature: {str(e)}")
+            log('ERROR', 'flow', f"Error loading nomenclature: {str(e)}")
         
         return {
             'customer': customer_name,
@@ -638,7 +666,7 @@ def enrich_document_from_1c(url: str, username: str, password: str, doc_uid: str
             'nomenclature': nomenclature
         }
     except Exception as e:
-        print(f"Error enriching document: {str(e)}")
+        log('ERROR', 'flow', f"Error enriching document: {str(e)}")
         return None
 
 def create_bitrix_deal(webhook_url: str, document: Dict) -> str:
@@ -669,10 +697,10 @@ def create_bitrix_deal(webhook_url: str, document: Dict) -> str:
         if result.get('result'):
             return str(result['result'])
         else:
-            print(f"Bitrix error: {result}")
+            log('ERROR', 'bitrix', lambda: f"Bitrix error: {result}")
             return None
     except Exception as e:
-        print(f"Error creating deal: {str(e)}")
+        log('ERROR', 'flow', f"Error creating deal: {str(e)}")
         return None
 
 def check_deal_exists(webhook_url: str, deal_id: str) -> bool:
@@ -686,7 +714,7 @@ def check_deal_exists(webhook_url: str, deal_id: str) -> bool:
         
         return bool(result.get('result'))
     except Exception as e:
-        print(f"Error checking deal: {str(e)}")
+        log('ERROR', 'flow', f"Error checking deal: {str(e)}")
         return False
 
 def find_deal_by_1c_order(webhook_url: str, order_number: str, order_date: str) -> str:
@@ -710,7 +738,7 @@ def find_deal_by_1c_order(webhook_url: str, order_number: str, order_date: str)
         else:
             return None
     except Exception as e:
-        print(f"Error finding deal by 1C order: {str(e)}")
+        log('ERROR', 'bitrix', f"Error finding deal by 1C order: {str(e)}")
         return None
 
 def response_json(status_code: int, data: Dict) -> Dict[str, Any]:
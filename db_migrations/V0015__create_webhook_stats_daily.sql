@@ -0,0 +1,32 @@
+-- Дневные счётчики вебхуков по типу (вместо полного сканирования webhook_logs на каждый опрос дашборда)
+CREATE TABLE IF NOT EXISTS webhook_stats_daily (
+    day DATE NOT NULL,
+    webhook_type VARCHAR(100) NOT NULL,
+    total_requests INTEGER NOT NULL DEFAULT 0,
+    duplicates_found INTEGER NOT NULL DEFAULT 0,
+    successful INTEGER NOT NULL DEFAULT 0,
+    first_at TIMESTAMP,
+    last_at TIMESTAMP,
+    PRIMARY KEY (day, webhook_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_stats_daily_type ON webhook_stats_daily(webhook_type, day DESC);
+
+-- Первичное заполнение из существующих логов
+INSERT INTO webhook_stats_daily (day, webhook_type, total_requests, duplicates_found, successful, first_at, last_at)
+SELECT
+    created_at::date,
+    webhook_type,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE duplicate_found = true),
+    COUNT(*) FILTER (WHERE response_status = 'success'),
+    MIN(created_at),
+    MAX(created_at)
+FROM webhook_logs
+GROUP BY created_at::date, webhook_type
+ON CONFLICT (day, webhook_type) DO NOTHING;
+
+COMMENT ON TABLE webhook_stats_daily IS 'Счётчики webhook_logs по дням и типу вебхука, обновляются при записи лога';
+
+-- Последние запуски по типу вебхука (список экземпляров в bitrix-timeline-logs)
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_type_created_at ON webhook_logs(webhook_type, created_at DESC);
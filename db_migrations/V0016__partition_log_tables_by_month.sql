@@ -0,0 +1,108 @@
+-- Помесячное секционирование журналов по created_at.
+-- Очистка старых данных = DETACH + DROP секции вместо DELETE по всей таблице.
+
+-- Создаёт секцию на месяц; строки этого месяца, попавшие в default-секцию, переносятся в неё
+CREATE OR REPLACE FUNCTION ensure_monthly_partition(parent_table TEXT, month_start DATE) RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    partition_name TEXT := parent_table || '_p' || to_char(month_start, 'YYYYMM');
+    default_name TEXT := parent_table || '_default';
+    month_end DATE := (month_start + INTERVAL '1 month')::date;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TEMP TABLE tmp_partition_rows AS SELECT * FROM %I WHERE created_at >= %L AND created_at < %L',
+                   default_name, month_start, month_end);
+    EXECUTE format('DELETE FROM %I WHERE created_at >= %L AND created_at < %L', default_name, month_start, month_end);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                   partition_name, parent_table, month_start, month_end);
+    EXECUTE format('INSERT INTO %I SELECT * FROM tmp_partition_rows', parent_table);
+    DROP TABLE tmp_partition_rows;
+
+    RETURN partition_name;
+END;
+$$;
+
+-- Отсоединяет и удаляет месячные секции старше retention_months полных месяцев
+CREATE OR REPLACE FUNCTION drop_expired_partitions(parent_table TEXT, retention_months INTEGER) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => retention_months))::date;
+    part RECORD;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = parent_table::regclass
+          AND c.relname ~ ('^' || parent_table || '_p[0-9]{6}$')
+        ORDER BY c.relname
+    LOOP
+        IF to_date(right(part.relname, 6), 'YYYYMM') < cutoff THEN
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent_table, part.relname);
+            EXECUTE format('DROP TABLE %I', part.relname);
+            RETURN NEXT part.relname;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- Пересоздаём таблицы как секционированные и переносим данные
+DO $$
+DECLARE
+    log_table TEXT;
+    first_month DATE;
+    month_cursor DATE;
+BEGIN
+    FOREACH log_table IN ARRAY ARRAY['webhook_logs', 'purchase_webhooks', 'deal_changes'] LOOP
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', log_table, log_table || '_legacy');
+        EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I',
+                       log_table || '_legacy', log_table || '_pkey', log_table || '_legacy_pkey');
+        EXECUTE format('UPDATE %I SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL', log_table || '_legacy');
+
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)',
+                       log_table, log_table || '_legacy');
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN created_at SET NOT NULL', log_table);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, created_at)', log_table);
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', log_table || '_default', log_table);
+
+        EXECUTE format('SELECT date_trunc(''month'', COALESCE(MIN(created_at), CURRENT_TIMESTAMP))::date FROM %I',
+                       log_table || '_legacy') INTO first_month;
+        month_cursor := first_month;
+        WHILE month_cursor <= (date_trunc('month', CURRENT_DATE) + INTERVAL '2 months')::date LOOP
+            PERFORM ensure_monthly_partition(log_table, month_cursor);
+            month_cursor := (month_cursor + INTERVAL '1 month')::date;
+        END LOOP;
+
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', log_table, log_table || '_legacy');
+
+        -- Сохраняем SERIAL-последовательность при удалении старой таблицы
+        EXECUTE format('ALTER SEQUENCE %I OWNED BY NONE', log_table || '_id_seq');
+        EXECUTE format('DROP TABLE %I', log_table || '_legacy');
+        EXECUTE format('ALTER SEQUENCE %I OWNED BY %I.id', log_table || '_id_seq', log_table);
+    END LOOP;
+END;
+$$;
+
+-- Индексы: BRIN для диапазонных выборок по времени, B-tree по created_at остаётся для ORDER BY ... LIMIT
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_created_at_brin ON webhook_logs USING BRIN (created_at);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_created_at ON webhook_logs(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_inn ON webhook_logs(inn);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_type_created_at ON webhook_logs(webhook_type, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_purchase_webhooks_created_at_brin ON purchase_webhooks USING BRIN (created_at);
+CREATE INDEX IF NOT EXISTS idx_webhooks_created_at ON purchase_webhooks(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_webhooks_deal_id ON purchase_webhooks(deal_id);
+CREATE INDEX IF NOT EXISTS idx_webhooks_purchase_created ON purchase_webhooks(purchase_created);
+
+CREATE INDEX IF NOT EXISTS idx_deal_changes_created_at_brin ON deal_changes USING BRIN (created_at);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_created_at ON deal_changes(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_deal_id ON deal_changes(deal_id);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_event_type ON deal_changes(event_type);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_modifier ON deal_changes(modifier_user_id);
+
+COMMENT ON TABLE webhook_logs IS 'Журнал вебхуков, секционирован по месяцам (created_at)';
+COMMENT ON TABLE purchase_webhooks IS 'Журнал входящих вебхуков по закупкам, секционирован по месяцам (created_at)';
+COMMENT ON TABLE deal_changes IS 'Логи всех изменений сделок из Битрикс24, секционированы по месяцам (created_at)';
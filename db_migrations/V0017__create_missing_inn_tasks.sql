@@ -0,0 +1,21 @@
+-- Реестр задач "Заполнить ИНН" по компаниям: одна открытая задача на компанию,
+-- уведомления ответственным уходят дайджестом, задача закрывается при появлении ИНН
+CREATE TABLE IF NOT EXISTS missing_inn_tasks (
+    id SERIAL PRIMARY KEY,
+    company_id VARCHAR(255) NOT NULL,
+    company_title VARCHAR(500),
+    responsible_id VARCHAR(50) NOT NULL,
+    task_id VARCHAR(50),
+    status VARCHAR(20) NOT NULL DEFAULT 'open',
+    notified_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    closed_at TIMESTAMP
+);
+
+-- Не больше одной открытой задачи на компанию
+CREATE UNIQUE INDEX IF NOT EXISTS idx_missing_inn_tasks_open_company ON missing_inn_tasks(company_id) WHERE status = 'open';
+
+-- Очередь дайджеста: открытые задачи, о которых ответственный ещё не уведомлён
+CREATE INDEX IF NOT EXISTS idx_missing_inn_tasks_pending_digest ON missing_inn_tasks(responsible_id, created_at) WHERE notified_at IS NULL AND status = 'open';
+
+COMMENT ON TABLE missing_inn_tasks IS 'Задачи на заполнение ИНН, созданные по вебхукам компаний без реквизитов';
@@ -0,0 +1,2 @@
+-- Инкрементальная догрузка фильтра ИНН: компании, изменённые после последнего watermark
+CREATE INDEX IF NOT EXISTS idx_companies_updated_at ON companies(updated_at);
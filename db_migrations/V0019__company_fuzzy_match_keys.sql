@@ -0,0 +1,25 @@
+-- Зеркало компаний для нечёткого поиска дублей: контакты и нормализованные ключи
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS phone VARCHAR(100) DEFAULT '';
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS email VARCHAR(255) DEFAULT '';
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS title_norm VARCHAR(500) DEFAULT '';
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS phone_norm VARCHAR(20) DEFAULT '';
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS email_norm VARCHAR(255) DEFAULT '';
+
+-- Первичное заполнение title_norm (то же правило, что normalize_company_title в bitrix-webhook):
+-- нижний регистр, ё->е, без организационно-правовой формы и пунктуации
+UPDATE companies SET title_norm = btrim(regexp_replace(
+    regexp_replace(
+        regexp_replace(
+            regexp_replace(lower(replace(COALESCE(title, ''), 'ё', 'е')),
+                '(общество с ограниченной ответственностью|(публичное |закрытое |открытое |непубличное )?акционерное общество|индивидуальный предприниматель|некоммерческая организация)',
+                ' ', 'g'),
+            '[^[:alnum:]]+', ' ', 'g'),
+        '(^| )(ооо|оао|зао|пао|нао|ао|ип|нко|ано|фгуп|гуп|муп|тоо|llc|ltd|inc)(?= |$)', ' ', 'g'),
+    ' +', ' ', 'g'));
+
+-- Блоки: триграммы названия, телефон, email
+CREATE INDEX IF NOT EXISTS idx_companies_title_norm_trgm ON companies USING GIN (title_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_companies_phone_norm ON companies(phone_norm);
+CREATE INDEX IF NOT EXISTS idx_companies_email_norm ON companies(email_norm);
@@ -0,0 +1,10 @@
+-- Кеш карточек компаний Битрикс24: последняя увиденная карточка с реквизитами.
+-- Актуальность проверяется по DATE_MODIFY через crm.company.list (ID, DATE_MODIFY)
+CREATE TABLE IF NOT EXISTS company_cards (
+    bitrix_id VARCHAR(255) PRIMARY KEY,
+    date_modify VARCHAR(50),
+    card JSONB NOT NULL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE company_cards IS 'Кеш карточек компаний (все поля + REQUISITES), ключ актуальности - DATE_MODIFY';
@@ -0,0 +1,20 @@
+-- Локальная карта сделка -> компания, ведётся bitrix-deal-tracker по событиям ONCRMDEALADD/UPDATE/DELETE
+CREATE TABLE IF NOT EXISTS deal_company_map (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    company_id VARCHAR(255),
+    deal_data JSONB NOT NULL,
+    date_modify VARCHAR(50),
+    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_deal_company_map_company ON deal_company_map(company_id) WHERE deleted = FALSE;
+
+-- Компании, чьи сделки полностью сверены с Битрикс24 через REST (дальше карту держат события)
+CREATE TABLE IF NOT EXISTS company_deal_sync (
+    company_id VARCHAR(255) PRIMARY KEY,
+    synced_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE deal_company_map IS 'Последнее состояние сделок с привязкой к компании (для бэкапов и восстановления компаний)';
+COMMENT ON TABLE company_deal_sync IS 'Время последней полной сверки сделок компании через crm.deal.list';
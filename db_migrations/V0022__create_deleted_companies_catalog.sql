@@ -0,0 +1,35 @@
+-- Каталог удалённых дубликатов компаний: поиск по ИНН/названию и восстановление по ID каталога
+CREATE TABLE IF NOT EXISTS deleted_companies (
+    id SERIAL PRIMARY KEY,
+    bitrix_id VARCHAR(255) NOT NULL,
+    inn VARCHAR(12),
+    title VARCHAR(500),
+    existing_company_id VARCHAR(255),
+    webhook_log_id INTEGER,
+    snapshot JSONB NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    restored_at TIMESTAMP,
+    restored_company_id VARCHAR(255)
+);
+
+CREATE INDEX IF NOT EXISTS idx_deleted_companies_deleted_at ON deleted_companies(deleted_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_deleted_companies_inn ON deleted_companies(inn text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_deleted_companies_title_trgm ON deleted_companies USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_deleted_companies_webhook_log ON deleted_companies(webhook_log_id);
+
+-- Переносим снимки, которые раньше хранились только в request_body логов
+INSERT INTO deleted_companies (bitrix_id, inn, title, existing_company_id, webhook_log_id, snapshot, deleted_at)
+SELECT
+    bitrix_company_id,
+    inn,
+    (request_body::jsonb)->'deleted_company_data'->>'TITLE',
+    substring(action_taken from 'INN already exists in ([0-9]+)'),
+    id,
+    (request_body::jsonb)->'deleted_company_data',
+    created_at
+FROM webhook_logs
+WHERE duplicate_found = TRUE
+  AND action_taken LIKE 'Auto-deleted%'
+  AND request_body LIKE '%"deleted_company_data"%';
+
+COMMENT ON TABLE deleted_companies IS 'Снимки компаний, автоматически удалённых как дубликаты ИНН';
@@ -0,0 +1,32 @@
+-- request_body журналов: TEXT -> JSONB, GIN-индекс для поиска по вхождению (@>)
+
+-- Безопасное приведение: невалидный JSON сохраняется как {"raw": "..."}
+CREATE OR REPLACE FUNCTION text_to_jsonb_safe(value TEXT) RETURNS JSONB
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    IF value IS NULL OR btrim(value) = '' THEN
+        RETURN NULL;
+    END IF;
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN jsonb_build_object('raw', value);
+END;
+$$;
+
+ALTER TABLE webhook_logs ALTER COLUMN request_body TYPE JSONB USING text_to_jsonb_safe(request_body);
+ALTER TABLE purchase_webhooks ADD COLUMN IF NOT EXISTS request_body TEXT;
+ALTER TABLE purchase_webhooks ALTER COLUMN request_body TYPE JSONB USING text_to_jsonb_safe(request_body);
+
+-- Ключевые поля тела запроса отдельными колонками
+ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS request_event VARCHAR(100)
+    GENERATED ALWAYS AS (request_body->>'event') STORED;
+ALTER TABLE purchase_webhooks ADD COLUMN IF NOT EXISTS request_event VARCHAR(100)
+    GENERATED ALWAYS AS (request_body->>'event') STORED;
+
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_request_body ON webhook_logs USING GIN (request_body jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_company_created_at ON webhook_logs(bitrix_company_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_request_event ON webhook_logs(request_event, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_purchase_webhooks_request_body ON purchase_webhooks USING GIN (request_body jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_purchase_webhooks_company_created_at ON purchase_webhooks(company_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_purchase_webhooks_request_event ON purchase_webhooks(request_event, created_at DESC);
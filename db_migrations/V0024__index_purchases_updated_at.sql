@@ -0,0 +1,5 @@
+-- Инкрементальный опрос списка закупок: WHERE updated_at > курсор ORDER BY updated_at DESC
+CREATE INDEX IF NOT EXISTS idx_purchases_updated_at ON purchases(updated_at DESC);
+
+-- Курсоры since_id по журналам (webhook_logs, purchase_webhooks, deal_changes) обслуживает
+-- первичный ключ (id, created_at), rollback_logs - первичный ключ id
@@ -0,0 +1,49 @@
+-- Сверка локальных зеркал с Битрикс24 по диапазонам ID: для каждого зеркала нужен
+-- числовой ID (диапазонные выборки) и DATE_MODIFY из Битрикс24 (контрольная сумма диапазона)
+
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS date_modify VARCHAR(50);
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS id_num BIGINT
+    GENERATED ALWAYS AS (CASE WHEN bitrix_id ~ '^[0-9]{1,18}$' THEN bitrix_id::bigint END) STORED;
+CREATE INDEX IF NOT EXISTS idx_companies_id_num ON companies(id_num, date_modify);
+
+-- Для компаний из кеша карточек DATE_MODIFY уже известен
+UPDATE companies c SET date_modify = cc.date_modify
+FROM company_cards cc
+WHERE cc.bitrix_id = c.bitrix_id AND c.date_modify IS NULL;
+
+ALTER TABLE deal_company_map ADD COLUMN IF NOT EXISTS id_num BIGINT
+    GENERATED ALWAYS AS (CASE WHEN deal_id ~ '^[0-9]{1,18}$' THEN deal_id::bigint END) STORED;
+CREATE INDEX IF NOT EXISTS idx_deal_company_map_id_num ON deal_company_map(id_num, date_modify) WHERE deleted = FALSE;
+
+-- Зеркало реквизитов компаний (ENTITY_TYPE_ID = 4): источник ИНН для companies
+CREATE TABLE IF NOT EXISTS company_requisites (
+    requisite_id VARCHAR(50) PRIMARY KEY,
+    company_id VARCHAR(255) NOT NULL,
+    inn VARCHAR(12) NOT NULL DEFAULT '',
+    date_modify VARCHAR(50),
+    requisite JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    id_num BIGINT GENERATED ALWAYS AS (CASE WHEN requisite_id ~ '^[0-9]{1,18}$' THEN requisite_id::bigint END) STORED
+);
+
+CREATE INDEX IF NOT EXISTS idx_company_requisites_id_num ON company_requisites(id_num, date_modify);
+CREATE INDEX IF NOT EXISTS idx_company_requisites_company ON company_requisites(company_id);
+
+COMMENT ON TABLE company_requisites IS 'Зеркало реквизитов компаний Битрикс24, поддерживается сверкой по диапазонам ID';
+COMMENT ON COLUMN companies.date_modify IS 'DATE_MODIFY компании в Битрикс24 на момент последнего обновления зеркала';
+
+-- Состояние сверки по каждому зеркалу: водяной знак DATE_MODIFY прошлого полного цикла,
+-- прогресс текущего прохода и недосверенные диапазоны ID (сверка продолжается со следующего вызова)
+CREATE TABLE IF NOT EXISTS mirror_reconcile_state (
+    entity VARCHAR(50) PRIMARY KEY,
+    watermark VARCHAR(50),
+    scan_after_id BIGINT,
+    scan_watermark VARCHAR(50),
+    pending_ranges JSONB,
+    avg_entity_bytes INTEGER,
+    last_report JSONB,
+    cycle_completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE mirror_reconcile_state IS 'Прогресс сверки зеркал companies/requisites/deals с Битрикс24';
@@ -0,0 +1,14 @@
+-- Буфер событий сделок для bitrix-deal-tracker: события за окно DEAL_BATCH_WINDOW_MS
+-- разбираются одним пакетом (crm.deal.list по ID + многострочный INSERT в deal_changes)
+CREATE TABLE IF NOT EXISTS deal_event_buffer (
+    id BIGSERIAL PRIMARY KEY,
+    deal_id VARCHAR(50) NOT NULL,
+    event_type VARCHAR(100),
+    event_handler_id VARCHAR(50),
+    ts VARCHAR(50),
+    domain VARCHAR(255),
+    member_id VARCHAR(255),
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE deal_event_buffer IS 'Принятые, но ещё не сохранённые в deal_changes события сделок';
@@ -0,0 +1,21 @@
+-- Последнее состояние каждой сделки: предыдущая стадия и снимок для отката читаются
+-- по первичному ключу, а не сортировкой всей истории сделки в deal_changes
+CREATE TABLE IF NOT EXISTS deal_latest_state (
+    deal_id VARCHAR(50) PRIMARY KEY,
+    stage_id VARCHAR(100),
+    deal_data JSONB NOT NULL,
+    last_change_id INTEGER,
+    event_type VARCHAR(100),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Первичное заполнение: последний полученный из REST снимок каждой сделки
+INSERT INTO deal_latest_state (deal_id, stage_id, deal_data, last_change_id, event_type, updated_at)
+SELECT DISTINCT ON (deal_id)
+    deal_id, deal_data->>'STAGE_ID', deal_data, id, event_type, timestamp_received
+FROM deal_changes
+WHERE NOT (deal_data ? 'error')
+ORDER BY deal_id, timestamp_received DESC, id DESC
+ON CONFLICT (deal_id) DO NOTHING;
+
+COMMENT ON TABLE deal_latest_state IS 'Последний снимок и стадия сделки, обновляется bitrix-deal-tracker в одной транзакции с deal_changes';
@@ -0,0 +1,31 @@
+-- Дельта-снимки сделок: полный снимок (keyframe) раз в DEAL_KEYFRAME_INTERVAL версий,
+-- между ними deal_data = '{}', а изменённые поля лежат в changes_summary.fields {поле: {from, to}}
+-- (удалённые поля - в changes_summary.removed). Снимки с ошибкой REST версии не получают.
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS version INTEGER;
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS is_keyframe BOOLEAN NOT NULL DEFAULT TRUE;
+
+-- Существующие полные снимки остаются ключевыми кадрами, версии - по порядку получения
+UPDATE deal_changes dc SET version = numbered.version
+FROM (
+    SELECT id, created_at, ROW_NUMBER() OVER (PARTITION BY deal_id ORDER BY timestamp_received, id) AS version
+    FROM deal_changes
+    WHERE NOT (deal_data ? 'error')
+) numbered
+WHERE dc.id = numbered.id AND dc.created_at = numbered.created_at;
+
+UPDATE deal_changes SET is_keyframe = FALSE WHERE version IS NULL;
+
+-- Восстановление версии: ближайший keyframe и дельты после него
+CREATE INDEX IF NOT EXISTS idx_deal_changes_deal_version ON deal_changes(deal_id, version) WHERE version IS NOT NULL;
+
+ALTER TABLE deal_latest_state ADD COLUMN IF NOT EXISTS version INTEGER;
+ALTER TABLE deal_latest_state ADD COLUMN IF NOT EXISTS keyframe_version INTEGER;
+
+UPDATE deal_latest_state dls SET version = versions.max_version, keyframe_version = versions.max_version
+FROM (
+    SELECT deal_id, MAX(version) AS max_version FROM deal_changes WHERE version IS NOT NULL GROUP BY deal_id
+) versions
+WHERE dls.deal_id = versions.deal_id;
+
+COMMENT ON COLUMN deal_changes.version IS 'Номер версии снимка сделки (NULL - снимок с ошибкой REST)';
+COMMENT ON COLUMN deal_changes.is_keyframe IS 'TRUE - deal_data содержит полный снимок, FALSE - только дельта в changes_summary';
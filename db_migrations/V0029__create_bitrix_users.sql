@@ -0,0 +1,20 @@
+-- Справочник пользователей Битрикс24: заполняется пакетной выгрузкой user.get (deal-changes-enrich),
+-- имена авторов изменений сделок берутся из него, а не запросом к REST на каждое событие
+CREATE TABLE IF NOT EXISTS bitrix_users (
+    user_id VARCHAR(50) PRIMARY KEY,
+    full_name VARCHAR(255) NOT NULL DEFAULT '',
+    email VARCHAR(255),
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    user_data JSONB,
+    id_num BIGINT GENERATED ALWAYS AS (CASE WHEN user_id ~ '^[0-9]{1,18}$' THEN user_id::bigint END) STORED,
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_bitrix_users_id_num ON bitrix_users(id_num);
+
+COMMENT ON TABLE bitrix_users IS 'Пользователи Битрикс24: полная выгрузка раз в USERS_FULL_SYNC_HOURS, между ними - только новые ID';
+
+-- Демо-имя из V0009 заменяем заглушкой: настоящее имя проставит обогащение из bitrix_users
+UPDATE deal_changes
+SET modifier_user_name = 'Пользователь #1'
+WHERE modifier_user_id = '1' AND modifier_user_name = 'Администратор (ID: 1)';
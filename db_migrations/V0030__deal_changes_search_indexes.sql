@@ -0,0 +1,34 @@
+-- Поиск по истории сделок (deal-changes-api, параметр search) без полного перебора deal_data::text:
+-- триграммы по ID сделки и имени автора, полнотекстовый вектор по ключевым текстовым полям сделки
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_deal_changes_deal_id_trgm ON deal_changes USING GIN (deal_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_modifier_name_trgm ON deal_changes USING GIN (modifier_user_name gin_trgm_ops);
+
+-- Полный снимок (keyframe) даёт поля из deal_data, дельта-версия - новые значения из changes_summary.fields
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('russian',
+        COALESCE(deal_data->>'TITLE', '') || ' ' ||
+        COALESCE(deal_data->>'COMMENTS', '') || ' ' ||
+        COALESCE(deal_data->>'ADDITIONAL_INFO', '') || ' ' ||
+        COALESCE(deal_data->>'SOURCE_DESCRIPTION', '') || ' ' ||
+        COALESCE(changes_summary->'fields'->'TITLE'->>'to', '') || ' ' ||
+        COALESCE(changes_summary->'fields'->'COMMENTS'->>'to', '') || ' ' ||
+        COALESCE(changes_summary->'fields'->'ADDITIONAL_INFO'->>'to', '') || ' ' ||
+        COALESCE(changes_summary->'fields'->'SOURCE_DESCRIPTION'->>'to', ''))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_deal_changes_search_vector ON deal_changes USING GIN (search_vector);
+
+-- Текущее состояние сделки: поиск по названию находит все изменения сделки, а не только версии, где оно менялось
+ALTER TABLE deal_latest_state ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('russian',
+        COALESCE(deal_data->>'TITLE', '') || ' ' ||
+        COALESCE(deal_data->>'COMMENTS', '') || ' ' ||
+        COALESCE(deal_data->>'ADDITIONAL_INFO', '') || ' ' ||
+        COALESCE(deal_data->>'SOURCE_DESCRIPTION', ''))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_deal_latest_state_search_vector ON deal_latest_state USING GIN (search_vector);
+
+COMMENT ON COLUMN deal_changes.search_vector IS 'Полнотекстовый индекс TITLE/COMMENTS/ADDITIONAL_INFO/SOURCE_DESCRIPTION (снимок или дельта)';
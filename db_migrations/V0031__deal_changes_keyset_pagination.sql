@@ -0,0 +1,7 @@
+-- Постраничная выдача истории сделок по курсору (timestamp_received, id) вместо OFFSET:
+-- страница 1000 читает из индекса столько же строк, сколько страница 1
+UPDATE deal_changes SET timestamp_received = created_at WHERE timestamp_received IS NULL;
+ALTER TABLE deal_changes ALTER COLUMN timestamp_received SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_deal_changes_received_keyset ON deal_changes(timestamp_received DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_deal_received_keyset ON deal_changes(deal_id, timestamp_received DESC, id DESC);
@@ -0,0 +1,25 @@
+-- Типизированные фильтры истории сделок (воронка, ответственный, сумма, компания) без разбора deal_data.
+-- Колонки заполняет bitrix-deal-tracker из полного снимка: у дельта-версий deal_data пуст,
+-- поэтому GENERATED-колонка от deal_data для них дала бы NULL. Стадия - существующая current_stage
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS category_id VARCHAR(50);
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS assigned_by_id VARCHAR(50);
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS opportunity NUMERIC(18, 2);
+ALTER TABLE deal_changes ADD COLUMN IF NOT EXISTS company_id VARCHAR(50);
+
+-- Существующие записи - полные снимки
+UPDATE deal_changes SET
+    category_id = NULLIF(deal_data->>'CATEGORY_ID', ''),
+    assigned_by_id = NULLIF(deal_data->>'ASSIGNED_BY_ID', ''),
+    opportunity = CASE WHEN deal_data->>'OPPORTUNITY' ~ '^-?[0-9]+(\.[0-9]+)?$' THEN (deal_data->>'OPPORTUNITY')::numeric END,
+    company_id = NULLIF(NULLIF(deal_data->>'COMPANY_ID', ''), '0')
+WHERE is_keyframe AND version IS NOT NULL;
+
+-- Второй столбец индексов - порядок выдачи (timestamp_received DESC): фильтр + страница читаются из одного индекса
+CREATE INDEX IF NOT EXISTS idx_deal_changes_stage_received ON deal_changes(current_stage, timestamp_received DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_category_received ON deal_changes(category_id, timestamp_received DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_assigned_received ON deal_changes(assigned_by_id, timestamp_received DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_company_received ON deal_changes(company_id, timestamp_received DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_opportunity ON deal_changes(opportunity);
+CREATE INDEX IF NOT EXISTS idx_deal_changes_event_type_received ON deal_changes(event_type, timestamp_received DESC);
+
+COMMENT ON COLUMN deal_changes.opportunity IS 'OPPORTUNITY сделки на момент версии (для фильтра по сумме)';
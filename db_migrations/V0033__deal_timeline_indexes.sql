@@ -0,0 +1,6 @@
+-- Единая лента сделки (deal-changes-api, view=timeline): каждая ветвь UNION читает
+-- свой индекс (deal_id, время DESC, id DESC) и останавливается через LIMIT строк.
+-- Для deal_changes индекс (deal_id, timestamp_received, id) создан в V0031
+CREATE INDEX IF NOT EXISTS idx_rollback_logs_deal_performed
+    ON t_p8980362_bitrix_webhook_handl.rollback_logs(deal_id, performed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_webhooks_deal_created ON purchase_webhooks(deal_id, created_at DESC, id DESC);
@@ -0,0 +1,6 @@
+-- DATE_MODIFY компании не меняется при правке её реквизитов, поэтому кеш карточки
+-- сверяется ещё и по отпечатку реквизитов (sha1 от отсортированных пар ID:DATE_MODIFY).
+-- У существующих строк отпечатка нет - при первом обращении карточка перечитывается
+ALTER TABLE company_cards ADD COLUMN IF NOT EXISTS requisites_stamp VARCHAR(40);
+
+COMMENT ON COLUMN company_cards.requisites_stamp IS 'Отпечаток реквизитов компании (ID:DATE_MODIFY) на момент загрузки карточки';
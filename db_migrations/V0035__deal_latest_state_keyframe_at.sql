@@ -0,0 +1,10 @@
+-- Ключевой кадр сделки должен лежать в той же месячной секции deal_changes, что и дельты после него:
+-- очистка журнала удаляет секции целиком. keyframe_at - время записи последнего ключевого кадра,
+-- bitrix-deal-tracker пишет полный снимок, если ключевой кадр сделки из прошлого месяца
+ALTER TABLE deal_latest_state ADD COLUMN IF NOT EXISTS keyframe_at TIMESTAMP;
+
+UPDATE deal_latest_state dls SET keyframe_at = dc.created_at
+FROM deal_changes dc
+WHERE dc.deal_id = dls.deal_id AND dc.version = dls.keyframe_version AND dc.is_keyframe;
+
+COMMENT ON COLUMN deal_latest_state.keyframe_at IS 'Время записи последнего ключевого кадра (месяц секции deal_changes)';
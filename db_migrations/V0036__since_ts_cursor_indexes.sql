@@ -0,0 +1,4 @@
+-- Курсор since_ts - ключ (время, id): опрос читает WHERE (время, id) > курсора ORDER BY время, id,
+-- сравнение строк идёт диапазоном по составному индексу
+CREATE INDEX IF NOT EXISTS idx_purchases_updated_at_id ON purchases(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_created_at_id ON webhook_logs(created_at, id);
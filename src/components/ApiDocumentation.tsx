@@ -51,6 +51,21 @@ export default function ApiDocumentation({ apiUrl }: ApiDocumentationProps) {
 }`}
           </pre>
         </div>
+        <div>
+          <p className="text-sm font-semibold text-foreground mb-2">Массовая проверка (импорт из таблиц и 1С):</p>
+          <pre className="p-4 bg-secondary rounded-md text-foreground text-sm overflow-x-auto">
+{`{
+  "action": "bulk_check",
+  "company_ids": ["12345", "12346"],
+  "inns": ["7707083893"],
+  "format": "json" | "ndjson"
+}`}
+          </pre>
+          <p className="text-xs text-muted-foreground mt-2">
+            Вердикт по каждому элементу: unique, duplicate, exists, no_inn, not_found, invalid.
+            Больше 500 элементов - ответ в NDJSON (строка на элемент, последняя строка - итог).
+          </p>
+        </div>
         <div className="p-4 bg-accent/10 border border-accent/20 rounded-md">
           <div className="flex items-start gap-2">
             <Icon name="AlertCircle" size={16} className="text-accent mt-0.5" />
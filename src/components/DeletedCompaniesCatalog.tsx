@@ -0,0 +1,177 @@
+import { useState, useEffect } from 'react';
+import { Button } from '@/components/ui/button';
+import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
+import { Input } from '@/components/ui/input';
+import { Badge } from '@/components/ui/badge';
+import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
+import Icon from '@/components/ui/icon';
+
+interface DeletedCompany {
+  id: number;
+  bitrix_id: string;
+  inn: string;
+  title: string;
+  existing_company_id: string | null;
+  deleted_at: string;
+  restored_at: string | null;
+  restored_company_id: string | null;
+}
+
+interface DeletedCompaniesCatalogProps {
+  apiUrl: string;
+}
+
+const PAGE_SIZE = 50;
+
+export default function DeletedCompaniesCatalog({ apiUrl }: DeletedCompaniesCatalogProps) {
+  const [search, setSearch] = useState('');
+  const [query, setQuery] = useState('');
+  const [offset, setOffset] = useState(0);
+  const [items, setItems] = useState<DeletedCompany[]>([]);
+  const [total, setTotal] = useState(0);
+  const [loading, setLoading] = useState(false);
+  const [restoringId, setRestoringId] = useState<number | null>(null);
+
+  useEffect(() => {
+    fetchCatalog();
+  }, [query, offset]);
+
+  const fetchCatalog = async () => {
+    setLoading(true);
+    try {
+      const params = new URLSearchParams({
+        action: 'deleted_companies',
+        search: query,
+        limit: String(PAGE_SIZE),
+        offset: String(offset),
+      });
+      const response = await fetch(`${apiUrl}?${params}`);
+      const data = await response.json();
+      setItems(data.items || []);
+      setTotal(data.total || 0);
+    } catch (error) {
+      console.error('Error fetching deleted companies:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const applySearch = () => {
+    setOffset(0);
+    setQuery(search.trim());
+  };
+
+  const restoreCompany = async (item: DeletedCompany) => {
+    setRestoringId(item.id);
+    try {
+      const response = await fetch(apiUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'restore', catalog_id: item.id }),
+      });
+      const result = await response.json();
+
+      if (result.success) {
+        alert(`✅ Компания восстановлена с новым ID: ${result.company_id}`);
+        await fetchCatalog();
+      } else {
+        alert(`❌ Ошибка восстановления: ${result.error || 'Неизвестная ошибка'}`);
+      }
+    } catch (error) {
+      console.error('Error restoring company:', error);
+      alert('❌ Ошибка при восстановлении компании. Проверьте консоль браузера.');
+    } finally {
+      setRestoringId(null);
+    }
+  };
+
+  return (
+    <Card className="border-border bg-card">
+      <CardHeader>
+        <CardTitle className="flex items-center gap-2">
+          <Icon name="Archive" size={20} />
+          Удалённые компании
+        </CardTitle>
+        <CardDescription>
+          Дубликаты, удалённые автоматически. Поиск по ИНН, ID или названию; восстановление из снимка на сервере.
+        </CardDescription>
+      </CardHeader>
+      <CardContent className="space-y-4">
+        <div className="flex gap-2">
+          <Input
+            placeholder="ИНН, ID компании или название"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+            onKeyDown={(e) => e.key === 'Enter' && applySearch()}
+          />
+          <Button onClick={applySearch} disabled={loading}>
+            <Icon name="Search" size={16} className="mr-2" />
+            Найти
+          </Button>
+        </div>
+
+        <div className="border border-border rounded-lg overflow-x-auto">
+          <Table>
+            <TableHeader>
+              <TableRow>
+                <TableHead>Удалена (Екб)</TableHead>
+                <TableHead>ИНН</TableHead>
+                <TableHead>ID</TableHead>
+                <TableHead>Название</TableHead>
+                <TableHead>Оригинал</TableHead>
+                <TableHead className="w-[160px]"></TableHead>
+              </TableRow>
+            </TableHeader>
+            <TableBody>
+              {items.map((item) => (
+                <TableRow key={item.id}>
+                  <TableCell className="font-mono text-sm">{item.deleted_at}</TableCell>
+                  <TableCell className="font-semibold text-primary">{item.inn}</TableCell>
+                  <TableCell className="font-mono">{item.bitrix_id}</TableCell>
+                  <TableCell>{item.title || '—'}</TableCell>
+                  <TableCell className="font-mono">{item.existing_company_id || '—'}</TableCell>
+                  <TableCell>
+                    {item.restored_at ? (
+                      <Badge variant="secondary">Восстановлена: {item.restored_company_id}</Badge>
+                    ) : (
+                      <Button
+                        size="sm"
+                        variant="outline"
+                        disabled={restoringId === item.id}
+                        onClick={() => restoreCompany(item)}
+                      >
+                        <Icon name={restoringId === item.id ? 'Loader2' : 'RotateCcw'} size={14} className={restoringId === item.id ? 'mr-2 animate-spin' : 'mr-2'} />
+                        Восстановить
+                      </Button>
+                    )}
+                  </TableCell>
+                </TableRow>
+              ))}
+              {!loading && items.length === 0 && (
+                <TableRow>
+                  <TableCell colSpan={6} className="text-center text-muted-foreground">
+                    Ничего не найдено
+                  </TableCell>
+                </TableRow>
+              )}
+            </TableBody>
+          </Table>
+        </div>
+
+        <div className="flex items-center justify-between text-sm text-muted-foreground">
+          <span>
+            {total > 0 ? `${offset + 1}–${Math.min(offset + PAGE_SIZE, total)} из ${total}` : '0 записей'}
+          </span>
+          <div className="flex gap-2">
+            <Button size="sm" variant="outline" disabled={offset === 0 || loading} onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}>
+              <Icon name="ChevronLeft" size={14} />
+            </Button>
+            <Button size="sm" variant="outline" disabled={offset + PAGE_SIZE >= total || loading} onClick={() => setOffset(offset + PAGE_SIZE)}>
+              <Icon name="ChevronRight" size={14} />
+            </Button>
+          </div>
+        </div>
+      </CardContent>
+    </Card>
+  );
+}
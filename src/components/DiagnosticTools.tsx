@@ -7,6 +7,7 @@ import Icon from '@/components/ui/icon';
 import DiagnosticSummary from './diagnostic/DiagnosticSummary';
 import CompaniesSection from './diagnostic/CompaniesSection';
 import RequisitesSection from './diagnostic/RequisitesSection';
+import FuzzyDuplicatesSection from './diagnostic/FuzzyDuplicatesSection';
 import { DiagnosticResult, CompanyFilters } from './diagnostic/types';
 
 interface DiagnosticToolsProps {
@@ -225,6 +226,8 @@ export default function DiagnosticTools({ apiUrl }: DiagnosticToolsProps) {
               cleaningOrphans={cleaningOrphans}
               onCleanOrphans={cleanOrphanedRequisites}
             />
+
+            <FuzzyDuplicatesSection result={result} />
           </div>
         )}
       </CardContent>
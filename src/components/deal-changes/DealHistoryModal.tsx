@@ -10,19 +10,46 @@ import {
   TableHeader,
   TableRow,
 } from '@/components/ui/table';
-import { RollbackLog, STAGE_NAMES, formatDate } from './dealChangesUtils';
+import { TimelineEntry, TIMELINE_KINDS, STAGE_NAMES, formatDate } from './dealChangesUtils';
 
 interface DealHistoryModalProps {
   dealId: string | null;
-  logs: RollbackLog[];
+  logs: TimelineEntry[];
   loading: boolean;
+  hasMore: boolean;
+  onLoadMore: () => void;
   onClose: () => void;
 }
 
+// Что произошло: для версии - изменённые поля, для отката - причина, для вебхука - итог закупки
+const describeEntry = (entry: TimelineEntry) => {
+  const details = entry.details || {};
+  if (entry.kind === 'change') {
+    if (details.error) return String(details.error);
+    const fields = Object.keys(details.fields || {});
+    const removed: string[] = details.removed || [];
+    if (!fields.length && !removed.length) return details.event_type || '';
+    return [...fields, ...removed.map((field) => `−${field}`)].join(', ');
+  }
+  if (entry.kind === 'rollback') {
+    return details.error_message || details.reason || '';
+  }
+  const parts = [details.webhook_type, details.response_message];
+  if (details.products_count) parts.push(`товаров: ${details.products_count}`);
+  if (details.total_amount) parts.push(`сумма: ${details.total_amount}`);
+  return parts.filter(Boolean).join(' · ');
+};
+
+// Вебхук закупки успешен, если закупка создана
+const isSuccess = (entry: TimelineEntry) =>
+  entry.kind === 'purchase_webhook' ? !!entry.details?.purchase_created : entry.success !== false;
+
 export default function DealHistoryModal({
   dealId,
   logs,
   loading,
+  hasMore,
+  onLoadMore,
   onClose,
 }: DealHistoryModalProps) {
   if (!dealId) return null;
@@ -57,7 +84,7 @@ export default function DealHistoryModal({
         </div>
       </CardHeader>
       <CardContent>
-        {loading ? (
+        {loading && logs.length === 0 ? (
           <div className="flex items-center justify-center py-8">
             <Icon name="Loader2" size={32} className="animate-spin text-slate-400" />
           </div>
@@ -72,37 +99,37 @@ export default function DealHistoryModal({
               <TableRow>
                 <TableHead className="w-16">ID</TableHead>
                 <TableHead className="w-32">Тип</TableHead>
-                <TableHead className="w-40">Изменение</TableHead>
+                <TableHead className="w-40">Стадия</TableHead>
                 <TableHead className="w-32">Кто</TableHead>
-                <TableHead>Причина</TableHead>
+                <TableHead>Подробности</TableHead>
                 <TableHead className="w-32">Статус</TableHead>
                 <TableHead className="w-44">Время</TableHead>
               </TableRow>
             </TableHeader>
             <TableBody>
               {logs.map((log) => (
-                <TableRow key={log.id} className={!log.success ? 'bg-red-50' : ''}>
+                <TableRow key={`${log.kind}-${log.id}`} className={!isSuccess(log) ? 'bg-red-50' : ''}>
                   <TableCell className="font-mono text-xs">{log.id}</TableCell>
                   <TableCell>
-                    <Badge variant="outline">
-                      {log.action_type === 'rollback' ? 'Откат' : log.action_type}
-                    </Badge>
+                    <Badge variant="outline">{TIMELINE_KINDS[log.kind] || log.kind}</Badge>
                   </TableCell>
                   <TableCell>
-                    {log.previous_stage && log.new_stage ? (
+                    {log.previous_stage && log.new_stage && log.previous_stage !== log.new_stage ? (
                       <div className="flex items-center gap-1 text-xs">
                         {getStageBadge(log.previous_stage)}
                         <Icon name="ArrowRight" size={12} />
                         {getStageBadge(log.new_stage)}
                       </div>
+                    ) : log.new_stage ? (
+                      <span className="text-xs">{getStageBadge(log.new_stage)}</span>
                     ) : (
-                      <span className="text-xs">→ {getStageBadge(log.new_stage)}</span>
+                      <span className="text-xs text-slate-400">—</span>
                     )}
                   </TableCell>
-                  <TableCell className="text-xs">{log.performed_by}</TableCell>
-                  <TableCell className="text-xs text-slate-600">{log.reason}</TableCell>
+                  <TableCell className="text-xs">{log.actor || '—'}</TableCell>
+                  <TableCell className="text-xs text-slate-600">{describeEntry(log)}</TableCell>
                   <TableCell>
-                    {log.success ? (
+                    {isSuccess(log) ? (
                       <Badge variant="default" className="bg-green-500">
                         <Icon name="CheckCircle" size={12} className="mr-1" />
                         Успешно
@@ -115,13 +142,21 @@ export default function DealHistoryModal({
                     )}
                   </TableCell>
                   <TableCell className="text-xs text-slate-600">
-                    {formatDate(log.performed_at)}
+                    {formatDate(log.ts)}
                   </TableCell>
                 </TableRow>
               ))}
             </TableBody>
           </Table>
         )}
+        {logs.length > 0 && hasMore && (
+          <div className="flex justify-center pt-4">
+            <Button variant="outline" onClick={onLoadMore} disabled={loading}>
+              {loading && <Icon name="Loader2" size={16} className="mr-2 animate-spin" />}
+              Показать ещё
+            </Button>
+          </div>
+        )}
       </CardContent>
     </Card>
   );
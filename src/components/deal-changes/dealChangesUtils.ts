@@ -9,6 +9,7 @@ export interface DealChange {
   previous_stage?: string;
   current_stage?: string;
   changes_summary?: any;
+  deal_data_incomplete?: boolean;
 }
 
 export interface RollbackLog {
@@ -26,6 +27,23 @@ export interface RollbackLog {
   error_message?: string;
 }
 
+export interface TimelineEntry {
+  kind: 'change' | 'rollback' | 'purchase_webhook';
+  id: number;
+  ts: string;
+  previous_stage?: string | null;
+  new_stage?: string | null;
+  actor?: string | null;
+  success?: boolean | null;
+  details: Record<string, any>;
+}
+
+export const TIMELINE_KINDS: Record<TimelineEntry['kind'], string> = {
+  change: 'Изменение',
+  rollback: 'Откат',
+  purchase_webhook: 'Вебхук закупки',
+};
+
 export const BACKEND_URL = 'https://functions.poehali.dev/fa7ea1c4-cbac-4964-b75e-c5b527e353c7';
 export const ENRICH_URL = 'https://functions.poehali.dev/b597a185-9519-4098-92d3-670edaa7daac';
 export const ROLLBACK_URL = 'https://functions.poehali.dev/61454b6b-601a-40b6-81e2-b0a8bc5da4d7';
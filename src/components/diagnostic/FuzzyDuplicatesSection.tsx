@@ -0,0 +1,65 @@
+import { Badge } from '@/components/ui/badge';
+import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
+import Icon from '@/components/ui/icon';
+import { DiagnosticResult, FuzzyMatch } from './types';
+
+interface FuzzyDuplicatesSectionProps {
+  result: DiagnosticResult;
+}
+
+const REASON_LABELS: Record<FuzzyMatch['reasons'][number], string> = {
+  title: 'Название',
+  phone: 'Телефон',
+  email: 'Email',
+};
+
+export default function FuzzyDuplicatesSection({ result }: FuzzyDuplicatesSectionProps) {
+  const fuzzy = result.fuzzy_duplicates;
+  if (!fuzzy || fuzzy.matches.length === 0) return null;
+
+  return (
+    <div className="space-y-3">
+      <p className="text-sm font-semibold flex items-center gap-2">
+        <Icon name="GitCompare" size={16} />
+        Похожие компании (название, телефон, email): {fuzzy.total_matches}
+        {fuzzy.elapsed_ms !== undefined && (
+          <span className="text-xs font-normal text-muted-foreground">({fuzzy.elapsed_ms} мс)</span>
+        )}
+      </p>
+      <div className="border border-border rounded-lg overflow-x-auto">
+        <Table>
+          <TableHeader>
+            <TableRow>
+              <TableHead>Компания</TableHead>
+              <TableHead>Похожая компания</TableHead>
+              <TableHead>ИНН</TableHead>
+              <TableHead>Сходство</TableHead>
+              <TableHead>Совпадения</TableHead>
+            </TableRow>
+          </TableHeader>
+          <TableBody>
+            {fuzzy.matches.map((match) => (
+              <TableRow key={`${match.company_id}-${match.candidate_id}`}>
+                <TableCell>
+                  <span className="font-mono text-xs text-muted-foreground mr-2">{match.company_id}</span>
+                  {match.company_title}
+                </TableCell>
+                <TableCell>
+                  <span className="font-mono text-xs text-muted-foreground mr-2">{match.candidate_id}</span>
+                  {match.candidate_title}
+                </TableCell>
+                <TableCell className="font-mono">{match.candidate_inn || '—'}</TableCell>
+                <TableCell className="font-mono">{Math.round(match.title_score * 100)}%</TableCell>
+                <TableCell className="space-x-1">
+                  {match.reasons.map((reason) => (
+                    <Badge key={reason} variant="secondary">{REASON_LABELS[reason]}</Badge>
+                  ))}
+                </TableCell>
+              </TableRow>
+            ))}
+          </TableBody>
+        </Table>
+      </div>
+    </div>
+  );
+}
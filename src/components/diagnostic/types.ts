@@ -20,13 +20,31 @@ export interface DiagnosticResult {
     inn: string;
     company_exists: boolean;
   }>;
+  fuzzy_duplicates?: {
+    matches: FuzzyMatch[];
+    total_matches: number;
+    candidates_scored?: number;
+    elapsed_ms?: number;
+  };
   summary: {
     total_bitrix: number;
     total_requisites: number;
     orphaned_requisites: number;
+    fuzzy_matches?: number;
   };
 }
 
+export interface FuzzyMatch {
+  company_id: string;
+  company_title: string;
+  candidate_id: string;
+  candidate_title: string;
+  candidate_inn: string;
+  same_inn: boolean;
+  title_score: number;
+  reasons: Array<'title' | 'phone' | 'email'>;
+}
+
 export interface CompanyFilters {
   title: string;
   rqName?: string;
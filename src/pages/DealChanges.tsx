@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import { useNavigate } from 'react-router-dom';
@@ -8,11 +8,10 @@ import DealChangesTable from '@/components/deal-changes/DealChangesTable';
 import DealHistoryModal from '@/components/deal-changes/DealHistoryModal';
 import {
   DealChange,
-  RollbackLog,
+  TimelineEntry,
   BACKEND_URL,
   ENRICH_URL,
   ROLLBACK_URL,
-  HISTORY_URL,
   STAGE_NAMES,
 } from '@/components/deal-changes/dealChangesUtils';
 
@@ -24,19 +23,36 @@ export default function DealChanges() {
   const [searchQuery, setSearchQuery] = useState('');
   const [autoRefresh, setAutoRefresh] = useState(false);
   const [historyDealId, setHistoryDealId] = useState<string | null>(null);
-  const [historyLogs, setHistoryLogs] = useState<RollbackLog[]>([]);
+  const [historyLogs, setHistoryLogs] = useState<TimelineEntry[]>([]);
   const [historyLoading, setHistoryLoading] = useState(false);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const { toast } = useToast();
 
-  const fetchChanges = async () => {
-    setLoading(true);
+  // Курсор автообновления: id последнего полученного изменения и поиск, к которому он относится
+  const cursorRef = useRef<{ sinceId: number; search: string } | null>(null);
+  // Поиск, к которому относится next_cursor (подгрузка страниц при прокрутке)
+  const pageSearchRef = useRef('');
+  const sentinelRef = useRef<HTMLDivElement>(null);
+
+  const fetchChanges = async (incremental = false) => {
+    const search = searchQuery.trim();
+    const cursor = incremental && cursorRef.current?.search === search ? cursorRef.current : null;
+    if (!cursor) {
+      setLoading(true);
+    }
     try {
       const params = new URLSearchParams({
         limit: '50',
       });
       
-      if (searchQuery.trim()) {
-        params.append('search', searchQuery.trim());
+      if (search) {
+        params.append('search', search);
+      }
+
+      if (cursor) {
+        params.append('since_id', String(cursor.sinceId));
       }
 
       const response = await fetch(`${BACKEND_URL}?${params}`);
@@ -46,7 +62,26 @@ export default function DealChanges() {
       }
 
       const data = await response.json();
-      setChanges(data.changes || []);
+      const received: DealChange[] = data.changes || [];
+      // Новых записей больше страницы - проще перечитать список целиком
+      if (cursor && data.has_more) {
+        cursorRef.current = null;
+        await fetchChanges(false);
+        return;
+      }
+      if (cursor) {
+        // Недавние записи сервер присылает повторно, пока они не "устоялись" - сливаем по id
+        if (received.length > 0) {
+          setChanges(prev => [...received, ...prev.filter(change => !received.some(r => r.id === change.id))]);
+        }
+      } else {
+        setChanges(received);
+        setNextCursor(data.next_cursor || null);
+        pageSearchRef.current = search;
+      }
+      if (data.cursor) {
+        cursorRef.current = { sinceId: data.cursor.since_id, search };
+      }
     } catch (err: any) {
       toast({
         title: 'Ошибка',
@@ -58,6 +93,40 @@ export default function DealChanges() {
     }
   };
 
+  // Следующая страница по курсору (timestamp_received, id): стоимость не растёт с глубиной прокрутки
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const params = new URLSearchParams({
+        limit: '50',
+        cursor: nextCursor,
+      });
+
+      if (pageSearchRef.current) {
+        params.append('search', pageSearchRef.current);
+      }
+
+      const response = await fetch(`${BACKEND_URL}?${params}`);
+
+      if (!response.ok) {
+        throw new Error('Ошибка загрузки данных');
+      }
+
+      const data = await response.json();
+      setChanges(prev => [...prev, ...(data.changes || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (err: any) {
+      toast({
+        title: 'Ошибка',
+        description: err.message || 'Не удалось загрузить историю изменений',
+        variant: 'destructive',
+      });
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const enrichUserData = async () => {
     setEnriching(true);
     try {
@@ -125,16 +194,23 @@ export default function DealChanges() {
     }
   };
 
-  const fetchDealHistory = async (dealId: string) => {
+  // Лента сделки: версии, откаты и вебхуки закупок одним запросом, следующие страницы по курсору
+  const fetchDealHistory = async (dealId: string, cursor: string | null = null) => {
     setHistoryDealId(dealId);
     setHistoryLoading(true);
     try {
-      const response = await fetch(`${HISTORY_URL}?deal_id=${dealId}&limit=50`);
+      const params = new URLSearchParams({ view: 'timeline', deal_id: dealId, limit: '50' });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
+      const response = await fetch(`${BACKEND_URL}?${params}`);
       if (!response.ok) {
         throw new Error('Ошибка загрузки истории');
       }
       const data = await response.json();
-      setHistoryLogs(data.logs || []);
+      const entries: TimelineEntry[] = data.timeline || [];
+      setHistoryLogs((prev) => (cursor ? [...prev, ...entries] : entries));
+      setHistoryCursor(data.next_cursor || null);
     } catch (err: any) {
       toast({
         title: 'Ошибка',
@@ -149,6 +225,7 @@ export default function DealChanges() {
   const closeHistory = () => {
     setHistoryDealId(null);
     setHistoryLogs([]);
+    setHistoryCursor(null);
   };
 
   useEffect(() => {
@@ -159,12 +236,26 @@ export default function DealChanges() {
     if (!autoRefresh) return;
 
     const interval = setInterval(() => {
-      fetchChanges();
+      fetchChanges(true);
     }, 10000);
 
     return () => clearInterval(interval);
   }, [autoRefresh, searchQuery]);
 
+  useEffect(() => {
+    const sentinel = sentinelRef.current;
+    if (!sentinel || !nextCursor) return;
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) {
+        loadMore();
+      }
+    }, { rootMargin: '400px' });
+    observer.observe(sentinel);
+
+    return () => observer.disconnect();
+  }, [nextCursor, loadingMore]);
+
   const filteredChanges = changes.filter((change) => {
     if (!searchQuery.trim()) return true;
     const search = searchQuery.toLowerCase();
@@ -199,13 +290,13 @@ export default function DealChanges() {
         <DealChangesFilters
           searchQuery={searchQuery}
           setSearchQuery={setSearchQuery}
-          onSearch={fetchChanges}
+          onSearch={() => fetchChanges()}
           enriching={enriching}
           onEnrich={enrichUserData}
           autoRefresh={autoRefresh}
           setAutoRefresh={setAutoRefresh}
           loading={loading}
-          onRefresh={fetchChanges}
+          onRefresh={() => fetchChanges()}
         />
 
         <DealChangesTable
@@ -215,10 +306,26 @@ export default function DealChanges() {
           onShowHistory={fetchDealHistory}
         />
 
+        <div ref={sentinelRef} className="flex justify-center py-4">
+          {loadingMore && (
+            <div className="flex items-center gap-2 text-muted-foreground">
+              <Icon name="Loader2" size={16} className="animate-spin" />
+              Загрузка...
+            </div>
+          )}
+          {!loadingMore && nextCursor && (
+            <Button variant="outline" onClick={loadMore}>
+              Показать ещё
+            </Button>
+          )}
+        </div>
+
         <DealHistoryModal
           dealId={historyDealId}
           logs={historyLogs}
           loading={historyLoading}
+          hasMore={!!historyCursor}
+          onLoadMore={() => historyDealId && fetchDealHistory(historyDealId, historyCursor)}
           onClose={closeHistory}
         />
       </div>
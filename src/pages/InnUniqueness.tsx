@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
@@ -8,6 +8,7 @@ import LogsTable from '@/components/LogsTable';
 import ApiDocumentation from '@/components/ApiDocumentation';
 import LogDetailsDialog from '@/components/LogDetailsDialog';
 import DiagnosticTools from '@/components/DiagnosticTools';
+import DeletedCompaniesCatalog from '@/components/DeletedCompaniesCatalog';
 import { useNavigate } from 'react-router-dom';
 
 interface WebhookLog {
@@ -40,19 +41,40 @@ export default function InnUniqueness() {
   const [selectedLog, setSelectedLog] = useState<WebhookLog | null>(null);
   const [isClearing, setIsClearing] = useState(false);
   const [restoringId, setRestoringId] = useState<number | null>(null);
+  // Курсор последней полученной записи: опрос запрашивает только новые логи
+  const sinceIdRef = useRef<number | null>(null);
 
   useEffect(() => {
-    fetchData();
-    const interval = setInterval(fetchData, 10000);
+    fetchData(true);
+    const interval = setInterval(() => fetchData(), 10000);
     return () => clearInterval(interval);
   }, []);
 
-  const fetchData = async () => {
+  const fetchData = async (full = false) => {
     try {
-      const response = await fetch(API_URL);
+      const incremental = !full && sinceIdRef.current !== null;
+      const response = await fetch(incremental ? `${API_URL}?since_id=${sinceIdRef.current}` : API_URL);
       const data = await response.json();
-      setLogs(data.logs || []);
-      setStats(data.stats || { total_requests: 0, duplicates_found: 0, successful: 0 });
+      const newLogs: WebhookLog[] = data.logs || [];
+      // Новых записей больше страницы - проще перечитать список целиком
+      if (incremental && data.has_more) {
+        await fetchData(true);
+        return;
+      }
+      if (incremental) {
+        // Недавние записи сервер присылает повторно, пока они не "устоялись" - сливаем по id
+        if (newLogs.length > 0) {
+          setLogs(prev => [...newLogs, ...prev.filter(log => !newLogs.some(n => n.id === log.id))].slice(0, 100));
+        }
+      } else {
+        setLogs(newLogs);
+      }
+      if (data.stats) {
+        setStats(data.stats);
+      }
+      if (data.cursor) {
+        sinceIdRef.current = data.cursor.since_id;
+      }
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
@@ -67,7 +89,7 @@ export default function InnUniqueness() {
         method: 'DELETE',
       });
       if (response.ok) {
-        await fetchData();
+        await fetchData(true);
       }
     } catch (error) {
       console.error('Error clearing logs:', error);
@@ -79,15 +101,7 @@ export default function InnUniqueness() {
   const restoreCompany = async (log: WebhookLog) => {
     setRestoringId(log.id);
     try {
-      const requestBody = JSON.parse(log.request_body);
-      const companyData = requestBody.deleted_company_data;
-      
-      if (!companyData) {
-        alert('Данные для восстановления не найдены в логе. Возможно компания была удалена до обновления системы.');
-        setRestoringId(null);
-        return;
-      }
-
+      // Снимок компании хранится в каталоге удалённых компаний на сервере, передаём только ID лога
       const response = await fetch(API_URL, {
         method: 'POST',
         headers: {
@@ -95,7 +109,7 @@ export default function InnUniqueness() {
         },
         body: JSON.stringify({
           action: 'restore',
-          original_data: companyData,
+          log_id: log.id,
         }),
       });
 
@@ -103,7 +117,7 @@ export default function InnUniqueness() {
       
       if (result.success) {
         alert(`✅ Компания восстановлена с новым ID: ${result.company_id}`);
-        await fetchData();
+        await fetchData(true);
       } else {
         alert(`❌ Ошибка восстановления: ${result.error || 'Неизвестная ошибка'}`);
       }
@@ -159,11 +173,15 @@ export default function InnUniqueness() {
         <StatsCards stats={stats} />
 
         <Tabs defaultValue="logs" className="w-full">
-          <TabsList className="grid w-full max-w-2xl grid-cols-3 bg-secondary">
+          <TabsList className="grid w-full max-w-3xl grid-cols-4 bg-secondary">
             <TabsTrigger value="logs" className="data-[state=active]:bg-primary">
               <Icon name="FileText" size={16} className="mr-2" />
               Журнал вебхуков
             </TabsTrigger>
+            <TabsTrigger value="deleted" className="data-[state=active]:bg-primary">
+              <Icon name="Archive" size={16} className="mr-2" />
+              Удалённые
+            </TabsTrigger>
             <TabsTrigger value="diagnostic" className="data-[state=active]:bg-primary">
               <Icon name="Wrench" size={16} className="mr-2" />
               Диагностика
@@ -188,6 +206,10 @@ export default function InnUniqueness() {
             />
           </TabsContent>
 
+          <TabsContent value="deleted" className="mt-6">
+            <DeletedCompaniesCatalog apiUrl={API_URL} />
+          </TabsContent>
+
           <TabsContent value="diagnostic" className="mt-6">
             <DiagnosticTools apiUrl={API_URL} />
           </TabsContent>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import Icon from '@/components/ui/icon';
@@ -20,6 +20,10 @@ export default function Purchases() {
   const [stats, setStats] = useState<MonthlyStats | null>(null);
   const [loadingMonitor, setLoadingMonitor] = useState(true);
 
+  // Курсоры опроса: после первой загрузки запрашиваются только новые и изменённые записи
+  const purchasesCursorRef = useRef<string | null>(null);
+  const webhooksCursorRef = useRef<number | null>(null);
+
   useEffect(() => {
     fetchMonitorData();
     const interval = setInterval(fetchMonitorData, 10000);
@@ -28,26 +32,66 @@ export default function Purchases() {
 
   const fetchMonitorData = async () => {
     try {
-      const [purchasesRes, webhooksRes, statsRes] = await Promise.all([
-        fetch(`${API_URL}?action=list_purchases`),
-        fetch(`${API_URL}?action=list_webhooks`),
-        fetch(`${API_URL}?action=stats`)
+      const initial = purchasesCursorRef.current === null && webhooksCursorRef.current === null;
+      const purchasesQuery = purchasesCursorRef.current ? `&since_ts=${encodeURIComponent(purchasesCursorRef.current)}` : '';
+      const webhooksQuery = webhooksCursorRef.current !== null ? `&since_id=${webhooksCursorRef.current}` : '';
+      const [purchasesRes, webhooksRes] = await Promise.all([
+        fetch(`${API_URL}?action=list_purchases${purchasesQuery}`),
+        fetch(`${API_URL}?action=list_webhooks${webhooksQuery}`)
       ]);
       
-      const purchasesData = await purchasesRes.json();
-      const webhooksData = await webhooksRes.json();
-      const statsData = await statsRes.json();
+      let purchasesData = await purchasesRes.json();
+      let webhooksData = await webhooksRes.json();
+      let changed = initial;
+      // Изменённых закупок больше страницы - перечитываем список целиком
+      if (purchasesData.incremental && purchasesData.has_more) {
+        purchasesData = await (await fetch(`${API_URL}?action=list_purchases`)).json();
+        changed = true;
+      }
+      // Новых вебхуков больше страницы - перечитываем журнал целиком
+      if (webhooksData.incremental && webhooksData.has_more) {
+        webhooksData = await (await fetch(`${API_URL}?action=list_webhooks`)).json();
+        changed = true;
+      }
       
       if (purchasesData.success) {
-        setPurchases(purchasesData.purchases || []);
+        const received: Purchase[] = purchasesData.purchases || [];
+        if (purchasesData.incremental) {
+          if (received.length > 0) {
+            setPurchases(prev => {
+              const updated = prev.map(p => received.find(r => r.id === p.id) || p);
+              const added = received.filter(r => !prev.some(p => p.id === r.id));
+              return [...added, ...updated].slice(0, 100);
+            });
+            changed = true;
+          }
+        } else {
+          setPurchases(received);
+        }
+        purchasesCursorRef.current = purchasesData.cursor?.since_ts ?? purchasesCursorRef.current;
       }
       
       if (webhooksData.success) {
-        setWebhooks(webhooksData.webhooks || []);
+        const received: Webhook[] = webhooksData.webhooks || [];
+        if (webhooksData.incremental) {
+          // Недавние записи сервер присылает повторно, пока они не "устоялись" - сливаем по id
+          if (received.length > 0) {
+            setWebhooks(prev => [...received, ...prev.filter(w => !received.some(r => r.id === w.id))].slice(0, 100));
+            changed = true;
+          }
+        } else {
+          setWebhooks(received);
+        }
+        webhooksCursorRef.current = webhooksData.cursor?.since_id ?? webhooksCursorRef.current;
       }
       
-      if (statsData.success && statsData.stats) {
-        setStats(statsData.stats);
+      // Статистику пересчитываем только когда что-то изменилось
+      if (changed) {
+        const statsRes = await fetch(`${API_URL}?action=stats`);
+        const statsData = await statsRes.json();
+        if (statsData.success && statsData.stats) {
+          setStats(statsData.stats);
+        }
       }
     } catch (error) {
       console.error('Error fetching monitor data:', error);